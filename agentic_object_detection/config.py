@@ -25,3 +25,5 @@ COLOR_PALETTE = [
 CONFIDENCE_THRESHOLD = 0.2
 
 OPENAI_API_KEY = ""
+# Set to the URL of an OpenAI-compatible server (e.g. the local stand-in server) to use it instead of the OpenAI API
+OPENAI_BASE_URL = None
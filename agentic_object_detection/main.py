@@ -1,9 +1,9 @@
 import gradio as gr
 from models.vision_agent import VisionAgent
-from config import OPENAI_API_KEY, MODEL_ID
+from config import OPENAI_API_KEY, OPENAI_BASE_URL, MODEL_ID
 
 # Instantiate the agent
-agent = VisionAgent(llm_api_key=OPENAI_API_KEY, model_id=MODEL_ID)
+agent = VisionAgent(llm_api_key=OPENAI_API_KEY, model_id=MODEL_ID, llm_base_url=OPENAI_BASE_URL)
 
 def gradio_interface(image, text):
     image_path = "temp_input.jpg"
@@ -11,9 +11,9 @@ class VisionAgent:
     Orchestrates calls to LLMTool, ObjectDetectionTool, and SegmentationTool,
     depending on the user’s intent.
     """
-    def __init__(self, llm_api_key, model_id, obj_det_concept_extraction_model="gpt-4o", obj_det_initial_critique_model="o1", obj_det_final_critique_model="gpt-4o"):
+    def __init__(self, llm_api_key, model_id, obj_det_concept_extraction_model="gpt-4o", obj_det_initial_critique_model="o1", obj_det_final_critique_model="gpt-4o", llm_base_url=None):
         # 1. Initialize VLMTool
-        self.vlm_tool = VLMTool(api_key=llm_api_key)
+        self.vlm_tool = VLMTool(api_key=llm_api_key, base_url=llm_base_url)
 
         # 2. Initialize object detection
         self.object_detection_tool = ObjectDetectionTool(
@@ -8,8 +8,8 @@ class VLMTool:
     """
     Handles LLM calls (e.g. GPT-4).
     """
-    def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key, base_url=None):
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
     
     def chat_completion(self, messages, model="o1", max_tokens=300, temperature=0.1, response_format=None):
         """Calls GPT for chat completion."""
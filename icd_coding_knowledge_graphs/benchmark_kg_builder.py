@@ -0,0 +1,91 @@
+"""
+Checks that the streaming KG builder gives the same graph as building one graph per ICD code and merging them with
+`nx.compose_all`, and measures the build time and peak Python memory of both paths.
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+import networkx as nx
+from helpers import build_graph, extract_entities
+from kg_builder import build_knowledge_graph
+
+ENTITY_TYPES = ["condition", "bodypart", "severity", "encounter_type", "cause", "laterality"]
+
+def make_synthetic_extractions(n_codes, n_entities, seed=0):
+    """
+    Generate random extraction outputs in the format of `prompt_relation_extraction`.
+
+    Args:
+        n_codes (int): Number of ICD codes.
+        n_entities (int): Size of the entity vocabulary.
+        seed (int): Random seed.
+
+    Returns:
+        tuple: The mapping of ICD codes to extraction outputs and the mapping of ICD codes to descriptions.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"entity {i}" for i in range(n_entities)]
+    extracted_graphs, icd_code_description = {}, {}
+    for i in range(n_codes):
+        code = f"X{i:06d}"
+        entities = {entity_type: rng.sample(vocabulary, rng.randint(1, 2)) for entity_type in rng.sample(ENTITY_TYPES, rng.randint(2, 5))}
+        names = [name for values in entities.values() for name in values]
+        relations = [rng.sample(names, 2) for _ in range(rng.randint(1, 4))]
+        lines = ["Entities:"] + [f"{entity_type}: {'||'.join(values)}" for entity_type, values in entities.items()]
+        lines += ["", "Relations:"] + [f"({a}||{b})" for a, b in relations]
+        extracted_graphs[code] = "\n".join(lines)
+        icd_code_description[code] = f"Description of {code}"
+    return extracted_graphs, icd_code_description
+
+def compose_path(extracted_graphs, icd_code_description, normalized_entity_map):
+    """The current path of the notebook: one graph per ICD code, merged with `nx.compose_all`."""
+    graphs_list = [build_graph(value, key, icd_code_description[key], normalized_entity_map) for key, value in extracted_graphs.items()]
+    return nx.compose_all(graphs_list)
+
+def builder_path(extracted_graphs, icd_code_description, normalized_entity_map):
+    return build_knowledge_graph(extracted_graphs, icd_code_description, normalized_entity_map).to_networkx()
+
+def builder_sparse_path(extracted_graphs, icd_code_description, normalized_entity_map):
+    return build_knowledge_graph(extracted_graphs, icd_code_description, normalized_entity_map).to_sparse_adjacency()
+
+def measure(function, *args):
+    """Return the result, the run time in seconds and the peak traced memory in MB of a function call."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the streaming KG builder with nx.compose_all.")
+    parser.add_argument("--extracted_graphs", default=None, help="Optional JSON file of extraction outputs; synthetic outputs are used otherwise")
+    parser.add_argument("--n_codes", type=int, default=72633, help="Number of synthetic ICD codes")
+    parser.add_argument("--n_entities", type=int, default=20000, help="Size of the synthetic entity vocabulary")
+    args = parser.parse_args()
+
+    if args.extracted_graphs:
+        import simple_icd_10_cm as cm
+        extracted_graphs = json.loads(open(args.extracted_graphs).read())
+        icd_code_description = {code: cm.get_description(code) for code in extracted_graphs}
+    else:
+        extracted_graphs, icd_code_description = make_synthetic_extractions(args.n_codes, args.n_entities)
+    # Normalization is not part of the comparison, so entities are mapped to themselves.
+    normalized_entity_map = {entity: entity for value in extracted_graphs.values() for entity in extract_entities(value)}
+
+    results = {}
+    for name, function in [("compose_all", compose_path), ("builder", builder_path), ("builder_sparse", builder_sparse_path)]:
+        result, elapsed, peak = measure(function, extracted_graphs, icd_code_description, normalized_entity_map)
+        results[name] = result
+        print(f"{name:15s} {elapsed:8.2f} s {peak:10.1f} MB peak")
+
+    expected, actual = results["compose_all"], results["builder"]
+    assert dict(expected.nodes(data=True)) == dict(actual.nodes(data=True))
+    assert {frozenset(edge) for edge in expected.edges()} == {frozenset(edge) for edge in actual.edges()}
+    adjacency, node_names = results["builder_sparse"]
+    assert adjacency.nnz == 2 * expected.number_of_edges() - nx.number_of_selfloops(expected)
+    print(f"All paths give the same graph ({expected.number_of_nodes()} nodes, {expected.number_of_edges()} edges).")
@@ -0,0 +1,264 @@
+"""
+Asynchronous bulk extraction of the entities and relations of all ICD-10-CM leaf descriptions.
+
+Requests are sent concurrently, with a concurrency limit that grows while requests succeed and is halved on rate-limit
+errors, so that the extraction settles at the throughput ceiling of the provider. Failed requests are retried with
+exponential backoff and jitter. Every result is appended to sharded JSONL checkpoints as soon as it arrives, and
+codes which are already in the checkpoints are skipped, so an interrupted run resumes where it stopped.
+"""
+
+import argparse
+import asyncio
+import email.utils
+import json
+import os
+import random
+import time
+import simple_icd_10_cm as cm
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from tqdm import tqdm
+from helpers import prompt_relation_extraction
+
+def load_completed(shard_dir):
+    """
+    Read the extraction outputs from the JSONL shards of a directory.
+
+    Args:
+        shard_dir (str): The directory containing the shards.
+
+    Returns:
+        dict: Mapping of ICD codes to the extraction outputs.
+    """
+    completed = {}
+    if not os.path.isdir(shard_dir):
+        return completed
+    for file_name in sorted(os.listdir(shard_dir)):
+        if not file_name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(shard_dir, file_name), "r", encoding="utf-8") as f:
+            for line in f:
+                # A line may be truncated if the previous run was killed while writing it.
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                completed[record["code"]] = record["output"]
+    return completed
+
+class ShardWriter:
+    """
+    Appends records to numbered JSONL shards, starting a new shard every `shard_size` records.
+
+    Each run starts after the last existing shard, so that the shards of previous runs are never modified.
+
+    Args:
+        shard_dir (str): The directory containing the shards.
+        shard_size (int): The number of records per shard.
+    """
+    def __init__(self, shard_dir, shard_size=5000):
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_dir = shard_dir
+        self.shard_size = shard_size
+        existing = [x for x in os.listdir(shard_dir) if x.startswith("shard-") and x.endswith(".jsonl")]
+        self.shard_index = max([int(x[len("shard-"):-len(".jsonl")]) for x in existing], default=-1) + 1
+        self.count = 0
+        self.file = None
+
+    def write(self, record):
+        if self.file is None or self.count >= self.shard_size:
+            self.close()
+            path = os.path.join(self.shard_dir, f"shard-{self.shard_index:05d}.jsonl")
+            self.file = open(path, "a", encoding="utf-8")
+            self.shard_index += 1
+            self.count = 0
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit with additive increase and multiplicative decrease.
+
+    The limit is halved at most once per congestion window: `acquire` returns the number of decreases so far, and a
+    rate-limit error of a request sent before the latest decrease does not halve the limit again, since that request
+    was sent under the previous limit.
+
+    Args:
+        initial (int): The initial number of concurrent requests.
+        minimum (int): The lowest concurrency limit.
+        maximum (int): The highest concurrency limit.
+        increase_every (int): The limit grows by one after this many consecutive successful requests.
+    """
+    def __init__(self, initial=8, minimum=1, maximum=256, increase_every=10):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_every = increase_every
+        self.in_flight = 0
+        self.successes = 0
+        self.decreases = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        """Wait for a free slot and return the congestion window of the request, to be passed to `release`."""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            return self.decreases
+
+    async def release(self, window, rate_limited=False):
+        async with self.condition:
+            self.in_flight -= 1
+            if rate_limited:
+                if window == self.decreases:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.decreases += 1
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.increase_every:
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.successes = 0
+            self.condition.notify_all()
+
+def parse_retry_after(value):
+    """
+    Parse the Retry-After header of a response, given either in seconds or as an HTTP date.
+
+    Args:
+        value (str): The header value (None if it is missing).
+
+    Returns:
+        float: The number of seconds to wait, 0 if the header is missing or invalid.
+    """
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return 0.0
+
+async def get_completion_async(client, limiter, prompt, input, model="gpt-4o-mini", temperature=0.0, max_retries=8, base_delay=1.0, max_delay=60.0):
+    """
+    Asynchronous version of `helpers.get_completion`, with adaptive concurrency and exponential backoff
+    (or the delay requested by the provider in the Retry-After header of rate-limit errors).
+
+    Args:
+        client (AsyncOpenAI): The asynchronous OpenAI client.
+        limiter (AdaptiveLimiter): The shared concurrency limit.
+        prompt (str): The system prompt.
+        input (str): The user input that follows the prompt.
+        model (str): The model identifier.
+        temperature (float): The randomness of the response.
+        max_retries (int): The number of retries on rate-limit and transient errors.
+        base_delay (float): The delay before the first retry, doubled at each retry.
+        max_delay (float): The maximum delay between retries.
+
+    Returns:
+        str: The content of the response message.
+    """
+    for attempt in range(max_retries + 1):
+        window = await limiter.acquire()
+        rate_limited = False
+        retry_after = 0.0
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "system", "content": prompt},
+                          {"role": "user", "content": input}],
+                temperature=temperature,
+            )
+            return response.choices[0].message.content
+        except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+            rate_limited = isinstance(e, RateLimitError)
+            if rate_limited:
+                retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+            if attempt == max_retries:
+                raise
+        finally:
+            await limiter.release(window, rate_limited=rate_limited)
+        delay = min(max_delay, base_delay * 2 ** attempt)
+        await asyncio.sleep(max(retry_after, delay / 2 + random.uniform(0, delay / 2)))
+
+async def run_extraction(icd_code_description, shard_dir, model="gpt-4o-mini", initial_concurrency=8, max_concurrency=256, shard_size=5000, client=None):
+    """
+    Extract the entities and relations of ICD code descriptions, resuming from the checkpoints in `shard_dir`.
+
+    Args:
+        icd_code_description (dict): Mapping of ICD codes to their descriptions.
+        shard_dir (str): The directory of the JSONL checkpoints.
+        model (str): The model identifier.
+        initial_concurrency (int): The initial number of concurrent requests.
+        max_concurrency (int): The highest number of concurrent requests.
+        shard_size (int): The number of records per shard.
+        client (AsyncOpenAI): Optional client; by default one is created from the environment.
+
+    Returns:
+        dict: Mapping of ICD codes to the extraction outputs, including the ones from previous runs.
+    """
+    completed = load_completed(shard_dir)
+    pending = [(code, description) for code, description in icd_code_description.items() if code not in completed]
+    client = client or AsyncOpenAI(max_retries=0)
+    limiter = AdaptiveLimiter(initial=initial_concurrency, maximum=max_concurrency)
+    writer = ShardWriter(shard_dir, shard_size=shard_size)
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    failures = {}
+    progress = tqdm(total=len(pending))
+
+    async def worker():
+        while True:
+            try:
+                code, description = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                output = await get_completion_async(client, limiter, prompt_relation_extraction, "ICD Code Description: " + description, model=model)
+                writer.write({"code": code, "output": output})
+                completed[code] = output
+            except Exception as e:
+                failures[code] = str(e)
+            progress.update(1)
+            progress.set_postfix(concurrency=limiter.limit)
+
+    try:
+        # There are as many workers as the highest concurrency; the limiter decides how many requests are in flight.
+        await asyncio.gather(*[worker() for _ in range(min(max_concurrency, max(1, len(pending))))])
+    finally:
+        writer.close()
+        progress.close()
+
+    if failures:
+        print(f"{len(failures)} codes failed and will be retried on the next run.")
+    return completed
+
+def get_leaf_descriptions():
+    """Return the mapping of all leaf ICD-10-CM codes to their descriptions."""
+    return {code: cm.get_description(code) for code in cm.get_all_codes() if cm.is_leaf(code)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the entities and relations of all ICD-10-CM leaf descriptions with concurrent requests.")
+    parser.add_argument("--shard_dir", default="extracted_entities_relations/shards", help="Directory of the JSONL checkpoints")
+    parser.add_argument("--output_file", default=None, help="Optional JSON file to save all the extracted graphs to")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Model to use for the extraction")
+    parser.add_argument("--initial_concurrency", type=int, default=8, help="Initial number of concurrent requests")
+    parser.add_argument("--max_concurrency", type=int, default=256, help="Highest number of concurrent requests")
+    parser.add_argument("--shard_size", type=int, default=5000, help="Number of records per shard")
+    args = parser.parse_args()
+
+    extracted_graphs = asyncio.run(run_extraction(get_leaf_descriptions(), args.shard_dir, model=args.model,
+                                                  initial_concurrency=args.initial_concurrency,
+                                                  max_concurrency=args.max_concurrency, shard_size=args.shard_size))
+    if args.output_file:
+        with open(args.output_file, "w") as f:
+            json.dump(extracted_graphs, f)
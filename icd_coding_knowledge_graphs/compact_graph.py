@@ -0,0 +1,234 @@
+"""
+Compact representation of the ICD knowledge graph.
+
+The graph is stored as an int32 CSR adjacency (`indptr`, `indices`) over integer node ids, with the node names and ICD
+descriptions interned in UTF-8 blobs and the node types as an integer column. All the arrays are saved as `.npy` files in
+one directory and loaded as memory maps, so opening the full KG takes milliseconds and several processes can share it
+through the page cache.
+"""
+
+import json
+import os
+import numpy as np
+
+def encode_strings(strings):
+    """
+    Encode a list of strings (or None) into a UTF-8 blob and offsets.
+
+    Returns:
+        tuple: The blob (uint8 array), the offsets of each string in the blob (int64 array of length n + 1) and the
+            mask of the strings which are not None.
+    """
+    encoded = [(x or "").encode("utf-8") for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    present = np.array([x is not None for x in strings], dtype=bool)
+    return blob, offsets, present
+
+class CompactGraph:
+    """
+    Undirected graph with an int32 CSR adjacency, interned node names and typed node attribute columns.
+
+    Args:
+        indptr (np.ndarray): The CSR row pointers (int32, length n_nodes + 1).
+        indices (np.ndarray): The sorted neighbour ids of each node (int32). Every edge is stored in both directions, and self-loops once.
+        name_blob, name_offsets (np.ndarray): The interned node names.
+        node_types (np.ndarray): The index in `type_names` of the type of each node (int16, -1 if the node has no type).
+        type_names (list of str): The node types.
+        description_blob, description_offsets, has_description (np.ndarray): The descriptions of the ICD nodes.
+    """
+    ARRAYS = ["indptr", "indices", "name_blob", "name_offsets", "node_types", "description_blob", "description_offsets", "has_description"]
+
+    def __init__(self, indptr, indices, name_blob, name_offsets, node_types, type_names, description_blob, description_offsets, has_description):
+        self.indptr = indptr
+        self.indices = indices
+        self.name_blob = name_blob
+        self.name_offsets = name_offsets
+        self.node_types = node_types
+        self.type_names = list(type_names)
+        self.description_blob = description_blob
+        self.description_offsets = description_offsets
+        self.has_description = has_description
+        self._node_index = None
+
+    @classmethod
+    def from_edges(cls, names, sources, targets, types=None, descriptions=None):
+        """
+        Build a compact graph from an edge list.
+
+        Args:
+            names (list of str): The node names, indexed by node id.
+            sources, targets (array-like): The node ids of the endpoints of each edge. Duplicate edges are merged.
+            types (list of str): Optional type of each node (None for untyped nodes).
+            descriptions (list of str): Optional description of each node (None for nodes without one).
+
+        Returns:
+            CompactGraph: The graph.
+        """
+        n_nodes = len(names)
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        loops = sources == targets
+        rows = np.concatenate([sources, targets[~loops]])
+        cols = np.concatenate([targets, sources[~loops]])
+        keys = np.unique(rows * max(n_nodes, 1) + cols)
+        rows, cols = keys // max(n_nodes, 1), keys % max(n_nodes, 1)
+        if len(cols) >= 2**31:
+            raise ValueError("The graph has too many edges for int32 indices")
+        indptr = np.zeros(n_nodes + 1, dtype=np.int32)
+        np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+
+        types = types if types is not None else [None] * n_nodes
+        type_names = sorted({x for x in types if x is not None})
+        type_index = {x: i for i, x in enumerate(type_names)}
+        node_types = np.array([type_index[x] if x is not None else -1 for x in types], dtype=np.int16)
+        name_blob, name_offsets, _ = encode_strings(names)
+        description_blob, description_offsets, has_description = encode_strings(descriptions if descriptions is not None else [None] * n_nodes)
+        return cls(indptr, cols.astype(np.int32), name_blob, name_offsets, node_types, type_names, description_blob, description_offsets, has_description)
+
+    @classmethod
+    def from_builder(cls, builder):
+        """Build a compact graph from a `kg_builder.KnowledgeGraphBuilder`."""
+        sources, targets = builder.get_edges()
+        types = [builder.type_names[x] if x >= 0 else None for x in builder.node_types]
+        descriptions = [builder.node_descriptions.get(x) for x in range(len(builder.node_names))]
+        return cls.from_edges(builder.node_names, sources, targets, types, descriptions)
+
+    @classmethod
+    def from_networkx(cls, G):
+        """Build a compact graph from a NetworkX graph with the `type` and `description` node attributes of `create_graph`."""
+        names = list(G.nodes())
+        index = {name: i for i, name in enumerate(names)}
+        sources = [index[u] for u, v in G.edges()]
+        targets = [index[v] for u, v in G.edges()]
+        types = [G.nodes[name].get("type") for name in names]
+        descriptions = [G.nodes[name].get("description") for name in names]
+        return cls.from_edges(names, sources, targets, types, descriptions)
+
+    def save(self, directory):
+        """Save the graph as `.npy` arrays and a `meta.json` file in a directory."""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), np.asarray(getattr(self, name)))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"type_names": self.type_names, "n_nodes": self.n_nodes, "n_edges": self.n_edges}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load a graph saved with `save`.
+
+        Args:
+            directory (str): The directory of the graph.
+            mmap (bool): Whether to memory-map the arrays (read-only) instead of reading them into memory.
+
+        Returns:
+            CompactGraph: The graph.
+        """
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r" if mmap else None) for name in cls.ARRAYS}
+        return cls(type_names=meta["type_names"], **arrays)
+
+    @property
+    def n_nodes(self):
+        return len(self.indptr) - 1
+
+    @property
+    def n_edges(self):
+        """The number of undirected edges (self-loops are stored once in the adjacency, other edges twice)."""
+        n_loops = int(np.sum(self.indices == np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))))
+        return (len(self.indices) + n_loops) // 2
+
+    def node_name(self, node_id):
+        return bytes(self.name_blob[self.name_offsets[node_id]:self.name_offsets[node_id + 1]]).decode("utf-8")
+
+    def node_id(self, name):
+        """Return the id of a node name (the name index is built on first use)."""
+        if self._node_index is None:
+            self._node_index = {self.node_name(i): i for i in range(self.n_nodes)}
+        return self._node_index[name]
+
+    def node_type(self, node_id):
+        type_id = self.node_types[node_id]
+        return self.type_names[type_id] if type_id >= 0 else None
+
+    def description(self, node_id):
+        if not self.has_description[node_id]:
+            return None
+        return bytes(self.description_blob[self.description_offsets[node_id]:self.description_offsets[node_id + 1]]).decode("utf-8")
+
+    def nodes_of_type(self, type):
+        """Return the ids of the nodes of a type."""
+        return np.flatnonzero(np.asarray(self.node_types) == self.type_names.index(type))
+
+    def neighbors(self, node_id):
+        """Return the sorted ids of the neighbours of a node."""
+        return self.indices[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    def iter_neighbors(self, name):
+        """Iterate over the names of the neighbours of a node name."""
+        for neighbor in self.neighbors(self.node_id(name)):
+            yield self.node_name(neighbor)
+
+    def degree(self, node_id=None):
+        """Return the number of neighbours of a node, or of all nodes as an array if `node_id` is None."""
+        if node_id is None:
+            return np.diff(self.indptr)
+        return int(self.indptr[node_id + 1] - self.indptr[node_id])
+
+    def to_scipy(self):
+        """Return the adjacency as a scipy.sparse.csr_matrix (sharing the index arrays)."""
+        import scipy.sparse as sp
+        return sp.csr_matrix((np.ones(len(self.indices), dtype=np.float32), self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes))
+
+    def subgraph(self, node_ids):
+        """
+        Extract the subgraph induced by a set of nodes.
+
+        Args:
+            node_ids (array-like): The ids of the nodes to keep.
+
+        Returns:
+            CompactGraph: The subgraph, whose node ids follow the sorted order of `node_ids`.
+        """
+        node_ids = np.unique(np.asarray(node_ids, dtype=np.int64))
+        new_ids = np.full(self.n_nodes, -1, dtype=np.int64)
+        new_ids[node_ids] = np.arange(len(node_ids))
+        starts, ends = np.asarray(self.indptr[node_ids]), np.asarray(self.indptr[node_ids + 1])
+        lengths = ends - starts
+        rows = np.repeat(np.arange(len(node_ids)), lengths)
+        positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        cols = new_ids[np.asarray(self.indices)[positions]]
+        keep = (cols >= 0) & (rows <= cols)
+        names = [self.node_name(x) for x in node_ids]
+        types = [self.node_type(x) for x in node_ids]
+        descriptions = [self.description(x) for x in node_ids]
+        return CompactGraph.from_edges(names, rows[keep], cols[keep], types, descriptions)
+
+    def ego_subgraph(self, node_id, radius=1):
+        """Extract the subgraph induced by the nodes within `radius` hops of a node."""
+        nodes = np.array([node_id])
+        frontier = nodes
+        for _ in range(radius):
+            neighbors = np.concatenate([self.neighbors(x) for x in frontier]) if len(frontier) else np.zeros(0, dtype=np.int32)
+            frontier = np.setdiff1d(neighbors, nodes)
+            nodes = np.union1d(nodes, frontier)
+        return self.subgraph(nodes)
+
+    def to_networkx(self):
+        """Return the graph as a NetworkX graph with the node attributes of `create_graph`."""
+        import networkx as nx
+
+        G = nx.Graph()
+        for node_id in range(self.n_nodes):
+            attributes = {}
+            if self.node_types[node_id] >= 0:
+                attributes["type"] = self.node_type(node_id)
+            if self.has_description[node_id]:
+                attributes["description"] = self.description(node_id)
+            G.add_node(self.node_name(node_id), **attributes)
+        rows = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+        upper = rows <= np.asarray(self.indices)
+        G.add_edges_from((self.node_name(u), self.node_name(v)) for u, v in zip(rows[upper], np.asarray(self.indices)[upper]))
+        return G
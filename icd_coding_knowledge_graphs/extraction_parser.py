@@ -0,0 +1,129 @@
+"""
+Single-pass parsing of the LLM extraction outputs.
+
+`extract_entities` and `build_graph` each split every output into lines and sections, so the 72k outputs are parsed twice.
+`parse_extraction` reads an output once and returns its typed entities and its relations. The resulting records feed both
+the entity normalization (`record_entities`) and the graph builder (`KnowledgeGraphBuilder.add_parsed`), and the shards
+of `bulk_extraction.py` can be parsed in parallel with `parse_shards`.
+"""
+
+import gc
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+def parse_extraction(input_text):
+    """
+    Parse an extraction output in one pass.
+
+    The result is the same as `extract_entities`, `split_sections`, `parse_entities` and `parse_relations` together.
+
+    Args:
+        input_text (str): The output of the extraction prompt.
+
+    Returns:
+        dict: The list of (entity type, entity name) tuples under "entities" and the list of (entity name, entity name)
+            tuples under "relations".
+    """
+    entities, relations = [], []
+    section = None
+    for line in input_text.strip().split('\n'):
+        line = line.strip()
+        if line == 'Entities:':
+            section = entities
+        elif line == 'Relations:':
+            section = relations
+        elif not line or section is None:
+            continue
+        elif section is entities:
+            if ':' in line:
+                entity_type, entity_names = line.split(':', 1)
+                entity_type = entity_type.strip()
+                for entity_name in entity_names.split("||"):
+                    entities.append((entity_type, entity_name.strip()))
+        elif line.startswith('(') and line.endswith(')'):
+            entity_names = [e.strip() for e in line[1:-1].split('||')]
+            if len(entity_names) == 2 and all(entity_names):
+                relations.append((entity_names[0], entity_names[1]))
+    return {"entities": entities, "relations": relations}
+
+def record_entities(records):
+    """Return the distinct entity names of parsed records, to be normalized."""
+    return list({entity_name for record in records for _, entity_name in record["entities"]})
+
+@contextmanager
+def gc_paused():
+    """
+    Disable the cyclic garbage collector in a block. Parsing creates millions of small tuples which all stay alive, and
+    the collections they trigger would otherwise take more time than the parsing itself.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def parse_items(items):
+    """Parse a list of (ICD code, extraction output) tuples."""
+    with gc_paused():
+        return [(code, parse_extraction(output)) for code, output in items]
+
+def parse_shard(path):
+    """Parse the records of one JSONL shard of `bulk_extraction.py`, skipping truncated lines."""
+    parsed = []
+    with gc_paused(), open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            parsed.append((record["code"], parse_extraction(record["output"])))
+    return parsed
+
+def map_tasks(function, tasks, num_workers):
+    """Apply a function to tasks, in a process pool if `num_workers` > 1, and yield the results in order."""
+    if num_workers <= 1:
+        yield from map(function, tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            yield from executor.map(function, tasks)
+
+def parse_extractions(extracted_graphs, num_workers=1, chunk_size=5000):
+    """
+    Parse all the extraction outputs.
+
+    Args:
+        extracted_graphs (dict): Mapping of ICD codes to the extraction outputs.
+        num_workers (int): The number of worker processes (1 to parse in this process).
+        chunk_size (int): The number of outputs per task.
+
+    Returns:
+        dict: Mapping of ICD codes to the parsed records.
+    """
+    items = list(extracted_graphs.items())
+    parsed = {}
+    for result in map_tasks(parse_items, [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)], num_workers):
+        parsed.update(result)
+    return parsed
+
+def parse_shards(shard_dir, num_workers=1):
+    """
+    Parse the JSONL shards of `bulk_extraction.py`, one shard per task.
+
+    As in `load_completed`, the records of later shards override those of earlier shards for the same code.
+
+    Args:
+        shard_dir (str): The directory containing the shards.
+        num_workers (int): The number of worker processes (1 to parse in this process).
+
+    Returns:
+        dict: Mapping of ICD codes to the parsed records.
+    """
+    paths = [os.path.join(shard_dir, x) for x in sorted(os.listdir(shard_dir)) if x.endswith(".jsonl")]
+    parsed = {}
+    for result in map_tasks(parse_shard, paths, num_workers):
+        parsed.update(result)
+    return parsed
@@ -1,19 +1,54 @@
-import simple_icd_10_cm as cm
-from openai import OpenAI
-from tqdm import tqdm
-import random
-import json
-import scispacy
-from scispacy.candidate_generation import CandidateGenerator
-from scispacy.linking import EntityLinker
-import networkx as nx
-
-candidate_generator = CandidateGenerator(name="umls")
-entity_linker = EntityLinker(resolve_abbreviations=True, name="umls", candidate_generator=candidate_generator)
-
-client = OpenAI(
-    api_key="",
-)
+from functools import lru_cache
+
+# The OpenAI client, the UMLS candidate generator and the entity linker are created on first use, so that importing
+# this module for parsing or graph building does not load the UMLS index and knowledge base.
+API_KEY = ""
+
+@lru_cache(maxsize=None)
+def get_client():
+    """
+    Return the shared OpenAI client, creating it on first use.
+
+    Returns:
+    OpenAI: The OpenAI client (using API_KEY, or the OPENAI_API_KEY environment variable if it is empty).
+    """
+    from openai import OpenAI
+    return OpenAI(api_key=API_KEY or None)
+
+@lru_cache(maxsize=None)
+def get_candidate_generator():
+    """
+    Return the shared scispaCy UMLS candidate generator, loading the UMLS ANN index on first use.
+
+    Returns:
+    CandidateGenerator: The UMLS candidate generator.
+    """
+    from scispacy.candidate_generation import CandidateGenerator
+    return CandidateGenerator(name="umls")
+
+@lru_cache(maxsize=None)
+def get_entity_linker():
+    """
+    Return the shared scispaCy UMLS entity linker, loading the UMLS knowledge base on first use.
+
+    Returns:
+    EntityLinker: The UMLS entity linker.
+    """
+    from scispacy.linking import EntityLinker
+    return EntityLinker(resolve_abbreviations=True, name="umls", candidate_generator=get_candidate_generator())
+
+def warm_up(linker=True, client=True):
+    """
+    Create the lazily initialized resources ahead of time, e.g. before timing or forking worker processes.
+
+    Args:
+    linker (bool): Whether to load the UMLS candidate generator and entity linker.
+    client (bool): Whether to create the OpenAI client.
+    """
+    if linker:
+        get_entity_linker()
+    if client:
+        get_client()
 
 prompt_relation_extraction = """You are an expert medical professional, qualified in ICD coding and medical terminology.
 You are given a description of an ICD code, and your task is to extract relevant entities and construct a graph by identifying the relationships between these entities. 
@@ -149,7 +184,7 @@ def get_completion(prompt, input, model="gpt-4o-mini", temperature=0.0):
     Returns:
     str: The content of the message generated by the model as a response to the user input.
     """
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model=model,
         messages=[{"role": "system", "content": prompt},
                   {"role": "user", "content": input}],
@@ -179,25 +214,114 @@ def get_max_similarity_concept_id(candidates):
 
     return best_concept_id
 
-def normalize_entities(entities):
+def get_best_concept_ids(candidates_list):
     """
-    Extracts the top linked concept for the first recognized entity in a given text using scispaCy.
+    Vectorized version of `get_max_similarity_concept_id` over the candidates of many entities.
+
+    The similarities of all candidates are flattened into one array, so the best candidate of every entity is found
+    with segmented reductions instead of a Python loop per candidate.
 
-    Parameters:
-    - text (str): The input text to extract entities from.
+    Args:
+    candidates_list (list): For each entity, the list of MentionCandidate objects returned by the candidate generator.
 
     Returns:
-    - str: The normalized entity if identified, or the original entity text.
+    list: For each entity, the concept ID of the candidate with the highest similarity (the first one on ties), or None if it has no candidates.
     """
-    candidates = candidate_generator(entities, k = 5)
-    normalized_entity_map = {}
-    
-    for entity, candidate in tqdm(zip(entities, candidates)):
-        most_likely_cui = get_max_similarity_concept_id(candidate)
-        cui_entity = entity_linker.kb.cui_to_entity[most_likely_cui]
-        normalized_entity_map[entity] = cui_entity.canonical_name
-    
-    return normalized_entity_map
+    import numpy as np
+
+    concept_ids = [candidate.concept_id for candidates in candidates_list for candidate in candidates]
+    best_concept_ids = [None] * len(candidates_list)
+    if not concept_ids:
+        return best_concept_ids
+
+    n_candidates = np.array([len(candidates) for candidates in candidates_list])
+    n_similarities = np.array([len(candidate.similarities) for candidates in candidates_list for candidate in candidates])
+    similarities = np.fromiter((s for candidates in candidates_list for candidate in candidates for s in candidate.similarities),
+                               dtype=np.float64, count=int(n_similarities.sum()))
+
+    # Highest similarity of each candidate, then the first candidate reaching the highest similarity of its entity.
+    candidate_max = np.maximum.reduceat(similarities, np.concatenate(([0], np.cumsum(n_similarities)[:-1])))
+    has_candidates = np.flatnonzero(n_candidates > 0)
+    starts = np.concatenate(([0], np.cumsum(n_candidates)[:-1]))[has_candidates]
+    entity_max = np.maximum.reduceat(candidate_max, starts)
+    owner = np.repeat(np.arange(len(has_candidates)), n_candidates[has_candidates])
+    is_best = np.flatnonzero(candidate_max == entity_max[owner])
+    _, first = np.unique(owner[is_best], return_index=True)
+
+    for entity_index, candidate_index in zip(has_candidates, is_best[first]):
+        best_concept_ids[entity_index] = concept_ids[candidate_index]
+    return best_concept_ids
+
+def link_entities(entities):
+    """
+    Link entities to UMLS concepts with the shared candidate generator and knowledge base.
+
+    Args:
+    entities (list): The entity surface forms.
+
+    Returns:
+    dict: Mapping of each entity to a (CUI, canonical name) tuple. Entities without candidates map to (None, entity).
+    """
+    candidates = get_candidate_generator()(entities, k = 5)
+    kb = get_entity_linker().kb
+    linked = {}
+    for entity, cui in zip(entities, get_best_concept_ids(candidates)):
+        linked[entity] = (cui, kb.cui_to_entity[cui].canonical_name if cui is not None else entity)
+    return linked
+
+def normalize_entities(entities, cache_path=None, num_workers=1, chunk_size=5000):
+    """
+    Normalizes entities to the canonical names of their most similar UMLS concepts using scispaCy.
+
+    Entities found in the cache are not linked again, and the others are linked in chunks, in parallel when
+    `num_workers` > 1. The worker processes are forked after the UMLS index and knowledge base are loaded, so they
+    share them with the parent process instead of loading their own copies.
+
+    Args:
+    entities (list): The entity surface forms.
+    cache_path (str, optional): The path of the SQLite normalization cache. Default is None (no cache).
+    num_workers (int, optional): The number of worker processes. Default is 1 (link in this process).
+    chunk_size (int, optional): The number of entities linked per task. Default is 5000.
+
+    Returns:
+    dict: Mapping of each entity to its normalized name, or to the original entity text if it could not be linked.
+    """
+    from tqdm import tqdm
+    from normalization_cache import NormalizationCache
+
+    entities = list(dict.fromkeys(entities))
+    cache = NormalizationCache(cache_path) if cache_path else None
+    linked = cache.get_many(entities) if cache else {}
+    misses = [entity for entity in entities if entity not in linked]
+    chunks = [misses[start:start + chunk_size] for start in range(0, len(misses), chunk_size)]
+
+    if chunks:
+        warm_up(client=False)
+    progress = tqdm(total=len(misses))
+    if num_workers > 1 and len(chunks) > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            futures = [executor.submit(link_entities, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                result = future.result()
+                linked.update(result)
+                if cache:
+                    cache.set_many(result)
+                progress.update(len(result))
+    else:
+        for chunk in chunks:
+            result = link_entities(chunk)
+            linked.update(result)
+            if cache:
+                cache.set_many(result)
+            progress.update(len(result))
+    progress.close()
+
+    if cache:
+        cache.close()
+    return {entity: linked[entity][1] for entity in entities}
 
 def extract_entities(input_text):
     """
@@ -346,6 +470,8 @@ def create_graph(icd_code, description, entities, overall_entities, relations, n
     Returns:
         networkx.Graph: A NetworkX graph representing the entities, relations, and the ICD root node.
     """    
+    import networkx as nx
+
     G = nx.Graph()
     G.add_node(icd_code, type="ICD", description = description)
     
@@ -0,0 +1,225 @@
+"""
+Incremental update of the ICD knowledge graph for a new ICD-10-CM release.
+
+A manifest records the hash of the description of every code whose extraction is in the checkpoints. On a new release,
+only the new codes and the codes whose description changed are sent to the LLM, and only their new entities go through
+the UMLS linker (the others are in the normalization cache). The graph is rebuilt from the cached extractions, which
+takes seconds, and compared with the stored graph, so that Neo4j is patched with the nodes and relationships that were
+added, modified or removed instead of being reloaded.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+from bulk_extraction import ShardWriter, get_leaf_descriptions, load_completed, run_extraction
+from compact_graph import CompactGraph
+from extraction_parser import parse_shards, record_entities
+from helpers import normalize_entities
+from kg_builder import build_knowledge_graph_from_records
+
+def description_hash(description):
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+def load_manifest(path):
+    """Return the mapping of processed ICD codes to the hashes of their descriptions (empty if the manifest does not exist)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_manifest(manifest, path):
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(temporary_path, path)
+
+def diff_codes(icd_code_description, manifest):
+    """
+    Compare the codes of a release with the manifest.
+
+    Args:
+        icd_code_description (dict): Mapping of the ICD codes of the release to their descriptions.
+        manifest (dict): Mapping of the processed ICD codes to the hashes of their descriptions.
+
+    Returns:
+        tuple: The sorted lists of added, changed and removed codes.
+    """
+    added = sorted(code for code in icd_code_description if code not in manifest)
+    changed = sorted(code for code, description in icd_code_description.items()
+                     if code in manifest and manifest[code] != description_hash(description))
+    removed = sorted(code for code in manifest if code not in icd_code_description)
+    return added, changed, removed
+
+def graph_contents(graph):
+    """
+    Return the nodes and edges of a compact graph.
+
+    Returns:
+        tuple: The mapping of node names to their attribute dictionaries, and the set of edges as (name, name) tuples in sorted order.
+    """
+    nodes = {}
+    for node_id in range(graph.n_nodes):
+        attributes = {}
+        if graph.node_type(node_id) is not None:
+            attributes["type"] = graph.node_type(node_id)
+        if graph.description(node_id) is not None:
+            attributes["description"] = graph.description(node_id)
+        nodes[graph.node_name(node_id)] = attributes
+    edges = set()
+    for node_id in range(graph.n_nodes):
+        name = graph.node_name(node_id)
+        for neighbor in graph.neighbors(node_id):
+            if neighbor >= node_id:
+                edges.add(tuple(sorted((name, graph.node_name(neighbor)))))
+    return nodes, edges
+
+def diff_graphs(old_graph, new_graph):
+    """
+    Compute the changes that turn one graph into another, in the format of the Neo4j helpers.
+
+    Args:
+        old_graph (CompactGraph): The stored graph, or None if there is none.
+        new_graph (CompactGraph): The updated graph.
+
+    Returns:
+        dict: The node dictionaries to upsert ("node_upserts"), the ids of the nodes to delete ("node_deletes"), and the
+            relationship dictionaries to upsert ("relationship_upserts") and delete ("relationship_deletes").
+    """
+    old_nodes, old_edges = graph_contents(old_graph) if old_graph is not None else ({}, set())
+    new_nodes, new_edges = graph_contents(new_graph)
+    return {
+        "node_upserts": [{'id': name, 'attributes': attributes} for name, attributes in new_nodes.items() if old_nodes.get(name) != attributes],
+        "node_deletes": [name for name in old_nodes if name not in new_nodes],
+        "relationship_upserts": [{'source_id': a, 'target_id': b, 'attributes': {}} for a, b in sorted(new_edges - old_edges)],
+        # Relationships of deleted nodes are removed with the nodes.
+        "relationship_deletes": [{'source_id': a, 'target_id': b} for a, b in sorted(old_edges - new_edges) if a in new_nodes and b in new_nodes],
+    }
+
+def apply_graph_diff(driver, diff, batch_size=1000, num_workers=4, database=None):
+    """
+    Patch the Neo4j database with the changes returned by `diff_graphs`.
+
+    Args:
+        driver (neo4j.Driver): The Neo4j driver.
+        diff (dict): The changes.
+        batch_size (int): The number of items per transaction.
+        num_workers (int): The number of parallel sessions for the upserts.
+        database (str): The database name, or None for the default database.
+    """
+    from neo4j_helpers import chunk_list, delete_nodes, delete_relationships, load_graph, write_batches
+
+    write_batches(driver, delete_relationships, chunk_list(diff["relationship_deletes"], batch_size), database)
+    write_batches(driver, delete_nodes, chunk_list(diff["node_deletes"], batch_size), database)
+    load_graph(driver, diff["node_upserts"], diff["relationship_upserts"], batch_size=batch_size,
+               num_workers=num_workers, database=database, create_constraint=False)
+
+def save_graph(graph, graph_dir):
+    """Replace the graph stored in `graph_dir`, without overwriting the files of a graph that may be memory-mapped."""
+    temporary_dir, old_dir = graph_dir + ".tmp", graph_dir + ".old"
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    graph.save(temporary_dir)
+    if os.path.exists(graph_dir):
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.rename(graph_dir, old_dir)
+    os.rename(temporary_dir, graph_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def update_knowledge_graph(shard_dir, manifest_path, graph_dir, cache_path, model="gpt-4o-mini", driver=None,
+                           icd_code_description=None, num_workers=1, max_concurrency=256, client=None):
+    """
+    Bring the extractions, the stored graph and optionally Neo4j up to date with an ICD-10-CM release.
+
+    Args:
+        shard_dir (str): The directory of the extraction checkpoints of `bulk_extraction.py`.
+        manifest_path (str): The path of the manifest of processed codes.
+        graph_dir (str): The directory of the stored `CompactGraph`.
+        cache_path (str): The path of the normalization cache.
+        model (str): The model used for the extraction.
+        driver (neo4j.Driver): Optional Neo4j driver; the database is patched if it is given.
+        icd_code_description (dict): Mapping of the ICD codes of the release to their descriptions (by default, the installed `simple_icd_10_cm` release).
+        num_workers (int): The number of processes for parsing the checkpoints and for the entity normalization.
+        max_concurrency (int): The highest number of concurrent extraction requests.
+        client (AsyncOpenAI): Optional client for the extraction; by default one is created from the environment.
+
+    Returns:
+        dict: The numbers of added, changed and removed codes, and the numbers of changes of the graph.
+    """
+    icd_code_description = icd_code_description or get_leaf_descriptions()
+    manifest = load_manifest(manifest_path)
+    added, changed, removed = diff_codes(icd_code_description, manifest)
+    summary = {"added": len(added), "changed": len(changed), "removed": len(removed)}
+    if not (added or changed or removed) and os.path.exists(graph_dir):
+        return summary
+
+    # The codes to extract are checkpointed in their own directory, so that an interrupted update resumes, and the
+    # outputs of previous releases for changed codes are not mistaken for completed extractions.
+    pending = {code: icd_code_description[code] for code in added + changed}
+    update_dir = os.path.join(shard_dir, "update-" + description_hash(json.dumps(pending, sort_keys=True))[:12])
+    new_outputs = asyncio.run(run_extraction(pending, update_dir, model=model, max_concurrency=max_concurrency, client=client)) if pending else {}
+    writer = ShardWriter(shard_dir)
+    for code, output in new_outputs.items():
+        writer.write({"code": code, "output": output})
+    writer.close()
+    shutil.rmtree(update_dir, ignore_errors=True)
+
+    # Later shards override earlier ones, so the checkpoints now hold the latest extraction of every code.
+    parsed = parse_shards(shard_dir, num_workers=num_workers)
+    parsed_records = {code: parsed[code] for code in icd_code_description if code in parsed}
+    normalized_entity_map = normalize_entities(record_entities(parsed_records.values()), cache_path=cache_path, num_workers=num_workers)
+    new_graph = CompactGraph.from_builder(build_knowledge_graph_from_records(parsed_records, icd_code_description, normalized_entity_map))
+
+    old_graph = CompactGraph.load(graph_dir) if os.path.exists(graph_dir) else None
+    diff = diff_graphs(old_graph, new_graph)
+    del old_graph
+    if driver is not None:
+        apply_graph_diff(driver, diff)
+    save_graph(new_graph, graph_dir)
+
+    # Codes whose extraction failed are left out of the manifest, so that they are retried on the next update.
+    for code in removed:
+        manifest.pop(code, None)
+    for code in icd_code_description:
+        if code in new_outputs or (code in manifest and code not in pending):
+            manifest[code] = description_hash(icd_code_description[code])
+    save_manifest(manifest, manifest_path)
+
+    summary.update({key: len(value) for key, value in diff.items()})
+    return summary
+
+def initialize_manifest(shard_dir, manifest_path, icd_code_description=None):
+    """
+    Create the manifest of the codes in the checkpoints, assuming they were extracted from `icd_code_description`
+    (by default, the installed `simple_icd_10_cm` release).
+    """
+    icd_code_description = icd_code_description or get_leaf_descriptions()
+    completed = load_completed(shard_dir)
+    save_manifest({code: description_hash(description) for code, description in icd_code_description.items() if code in completed}, manifest_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the ICD knowledge graph for a new ICD-10-CM release.")
+    parser.add_argument("--shard_dir", default="extracted_entities_relations/shards", help="Directory of the JSONL checkpoints")
+    parser.add_argument("--manifest", default="extracted_entities_relations/manifest.json", help="Manifest of the processed codes")
+    parser.add_argument("--graph_dir", default="graph_resources/icd_kg", help="Directory of the stored compact graph")
+    parser.add_argument("--cache_path", default="normalization_cache.sqlite", help="Entity normalization cache")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Model to use for the extraction")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of processes for parsing and entity normalization")
+    parser.add_argument("--init_manifest", action="store_true", help="Create the manifest from the checkpoints and the installed release, then exit")
+    parser.add_argument("--neo4j", action="store_true", help="Patch the Neo4j database configured in neo4j_helpers.py")
+    args = parser.parse_args()
+
+    if args.init_manifest:
+        initialize_manifest(args.shard_dir, args.manifest)
+    else:
+        driver = None
+        if args.neo4j:
+            from neo4j_helpers import GraphDatabase, uri, username, password
+            driver = GraphDatabase.driver(uri, auth=(username, password))
+        try:
+            print(update_knowledge_graph(args.shard_dir, args.manifest, args.graph_dir, args.cache_path, model=args.model,
+                                         driver=driver, num_workers=args.num_workers))
+        finally:
+            if driver is not None:
+                driver.close()
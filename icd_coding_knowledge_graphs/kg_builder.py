@@ -0,0 +1,193 @@
+"""
+Streaming construction of the ICD knowledge graph.
+
+Instead of building one NetworkX graph per ICD code and merging them with `nx.compose_all`, the parsed entities and
+relations of every code are appended to a single edge list of interned integer node ids, with the node attributes kept
+in column tables. The graph is only materialized once, as a NetworkX graph, a SciPy sparse adjacency matrix or the
+node and relationship batches of the Neo4j loader.
+"""
+
+from array import array
+import numpy as np
+from helpers import split_sections, parse_entities, parse_relations
+
+class KnowledgeGraphBuilder:
+    """
+    Accumulates the nodes and edges of the knowledge graph as interned ids and edge arrays.
+
+    The resulting graph is the same as `nx.compose_all` over the graphs returned by `create_graph`: nodes and edges are
+    deduplicated, edges are undirected, and when a node is added several times its attributes are updated with the
+    latest values.
+    """
+    def __init__(self):
+        self.node_index = {}
+        self.node_names = []
+        self.type_index = {}
+        self.type_names = []
+        # Node attribute tables: the index of the type of each node (-1 if the node has no type) and the descriptions of the ICD nodes.
+        self.node_types = array('i')
+        self.node_descriptions = {}
+        self.sources = array('i')
+        self.targets = array('i')
+
+    def get_node_id(self, name):
+        """Return the interned id of a node, adding the node without attributes if it is new."""
+        node_id = self.node_index.get(name)
+        if node_id is None:
+            node_id = len(self.node_names)
+            self.node_index[name] = node_id
+            self.node_names.append(name)
+            self.node_types.append(-1)
+        return node_id
+
+    def add_node(self, name, type, description=None):
+        """Add a node or update the attributes of an existing one, and return its id."""
+        node_id = self.get_node_id(name)
+        type_id = self.type_index.get(type)
+        if type_id is None:
+            type_id = len(self.type_names)
+            self.type_index[type] = type_id
+            self.type_names.append(type)
+        self.node_types[node_id] = type_id
+        if description is not None:
+            self.node_descriptions[node_id] = description
+        return node_id
+
+    def add_edge(self, source_id, target_id):
+        self.sources.append(source_id)
+        self.targets.append(target_id)
+
+    def add_record(self, icd_code, description, entities, overall_entities, relations, normalized_entity_map):
+        """
+        Add the nodes and edges of one ICD code, with the same arguments as `create_graph`.
+
+        Args:
+            icd_code (str): ICD code for the root node of the graph.
+            description (str): Description of the ICD code.
+            entities (dict): Dictionary of normalized entities with their types.
+            overall_entities (set): Set of all entity names encountered.
+            relations (list): List of tuples representing relations between entities.
+            normalized_entity_map (dict): Dictionary mapping original entity names to their normalized forms.
+        """
+        icd_id = self.add_node(icd_code, "ICD", description)
+        for entity_name, entity_type in entities.items():
+            self.add_edge(self.add_node(entity_name, entity_type), icd_id)
+        for entity1, entity2 in relations:
+            if entity1 in overall_entities and entity2 in overall_entities:
+                self.add_edge(self.get_node_id(normalized_entity_map[entity1]), self.get_node_id(normalized_entity_map[entity2]))
+
+    def add_extraction(self, input_text, icd_code, icd_description, normalized_entity_map):
+        """
+        Parse the extraction output of one ICD code and add its nodes and edges, with the same arguments as `build_graph`.
+        """
+        entities_section, relations_section = split_sections(input_text.strip().split('\n'))
+        entities, overall_entities = parse_entities(entities_section, normalized_entity_map)
+        relations = parse_relations(relations_section)
+        self.add_record(icd_code, icd_description, entities, overall_entities, relations, normalized_entity_map)
+
+    def add_parsed(self, icd_code, icd_description, record, normalized_entity_map):
+        """
+        Add the nodes and edges of one ICD code from a record of `extraction_parser.parse_extraction`, without parsing the output again.
+        """
+        entities = {}
+        overall_entities = set()
+        for entity_type, entity_name in record["entities"]:
+            overall_entities.add(entity_name)
+            entities[normalized_entity_map[entity_name]] = entity_type
+        self.add_record(icd_code, icd_description, entities, overall_entities, record["relations"], normalized_entity_map)
+
+    def get_edges(self):
+        """
+        Return the deduplicated undirected edges.
+
+        Returns:
+            tuple: Two int arrays with the source and target node ids of each edge (source <= target), in order of first appearance.
+        """
+        sources = np.frombuffer(self.sources, dtype=np.int32).astype(np.int64)
+        targets = np.frombuffer(self.targets, dtype=np.int32).astype(np.int64)
+        low, high = np.minimum(sources, targets), np.maximum(sources, targets)
+        _, first = np.unique(low * len(self.node_names) + high, return_index=True)
+        first.sort()
+        return low[first], high[first]
+
+    def get_node_attributes(self, node_id):
+        """Return the attribute dictionary of a node, as stored on the NetworkX nodes."""
+        attributes = {}
+        if self.node_types[node_id] >= 0:
+            attributes["type"] = self.type_names[self.node_types[node_id]]
+        if node_id in self.node_descriptions:
+            attributes["description"] = self.node_descriptions[node_id]
+        return attributes
+
+    def to_networkx(self):
+        """
+        Returns:
+            networkx.Graph: The knowledge graph, with the same nodes, node attributes and edges as `nx.compose_all`.
+        """
+        import networkx as nx
+
+        G = nx.Graph()
+        G.add_nodes_from((name, self.get_node_attributes(node_id)) for node_id, name in enumerate(self.node_names))
+        sources, targets = self.get_edges()
+        G.add_edges_from(zip([self.node_names[x] for x in sources], [self.node_names[x] for x in targets]))
+        return G
+
+    def to_sparse_adjacency(self):
+        """
+        Returns:
+            tuple: The symmetric adjacency matrix of the knowledge graph (scipy.sparse.csr_matrix of shape (n_nodes, n_nodes))
+                and the list of node names indexing its rows and columns.
+        """
+        import scipy.sparse as sp
+
+        sources, targets = self.get_edges()
+        n_nodes = len(self.node_names)
+        rows = np.concatenate([sources, targets[sources != targets]])
+        cols = np.concatenate([targets, sources[sources != targets]])
+        adjacency = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n_nodes, n_nodes))
+        return adjacency, list(self.node_names)
+
+    def to_neo4j_payload(self):
+        """
+        Returns:
+            tuple: The node and relationship dictionaries expected by `create_nodes` and `create_relationships`.
+        """
+        nodes = [{'id': name, 'attributes': self.get_node_attributes(node_id)} for node_id, name in enumerate(self.node_names)]
+        sources, targets = self.get_edges()
+        relationships = [{'source_id': self.node_names[source], 'target_id': self.node_names[target], 'attributes': {}}
+                         for source, target in zip(sources, targets)]
+        return nodes, relationships
+
+def build_knowledge_graph(extracted_graphs, icd_code_description, normalized_entity_map):
+    """
+    Build the knowledge graph of all the extraction outputs.
+
+    Args:
+        extracted_graphs (dict): Mapping of ICD codes to the extraction outputs.
+        icd_code_description (dict): Mapping of ICD codes to their descriptions.
+        normalized_entity_map (dict): Dictionary mapping original entity names to their normalized forms.
+
+    Returns:
+        KnowledgeGraphBuilder: The builder holding the knowledge graph.
+    """
+    builder = KnowledgeGraphBuilder()
+    for icd_code, output in extracted_graphs.items():
+        builder.add_extraction(output, icd_code, icd_code_description[icd_code], normalized_entity_map)
+    return builder
+
+def build_knowledge_graph_from_records(parsed_records, icd_code_description, normalized_entity_map):
+    """
+    Build the knowledge graph of the records of `extraction_parser.parse_extractions` or `extraction_parser.parse_shards`.
+
+    Args:
+        parsed_records (dict): Mapping of ICD codes to the parsed records.
+        icd_code_description (dict): Mapping of ICD codes to their descriptions.
+        normalized_entity_map (dict): Dictionary mapping original entity names to their normalized forms.
+
+    Returns:
+        KnowledgeGraphBuilder: The builder holding the knowledge graph.
+    """
+    builder = KnowledgeGraphBuilder()
+    for icd_code, record in parsed_records.items():
+        builder.add_parsed(icd_code, icd_code_description[icd_code], record, normalized_entity_map)
+    return builder
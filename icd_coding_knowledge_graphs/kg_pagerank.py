@@ -0,0 +1,143 @@
+"""
+Candidate expansion over the ICD knowledge graph with batched personalized PageRank.
+
+The row-normalized transition matrix of the KG is computed once. The PageRank vectors of a batch of notes are the rows
+of a sparse matrix, initialized with the note entities (the seeds) and updated with sparse matrix products. After every
+iteration each row keeps only its largest entries, so the cost depends on the neighbourhood of the seeds and not on the
+size of the KG. ICD codes reached through related conditions or body parts, one or more hops away from the seed
+entities, are ranked by their PageRank score.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+def truncate_rows(matrix, max_nonzeros):
+    """
+    Keep the `max_nonzeros` largest entries of every row of a sparse matrix (and the entries tied with the smallest of them).
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): The matrix.
+        max_nonzeros (int): The number of entries kept per row.
+
+    Returns:
+        scipy.sparse.csr_matrix: The truncated matrix.
+    """
+    matrix = matrix.tocsr()
+    counts = np.diff(matrix.indptr)
+    long_rows = np.flatnonzero(counts > max_nonzeros)
+    if len(long_rows) == 0:
+        return matrix
+    keep = np.ones(len(matrix.data), dtype=bool)
+    for row in long_rows:
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        values = matrix.data[start:end]
+        # Entries tied with the k-th largest value are all kept.
+        threshold = np.partition(values, len(values) - max_nonzeros)[len(values) - max_nonzeros]
+        keep[start:end] = values >= threshold
+    rows = np.repeat(np.arange(matrix.shape[0]), counts)
+    return sp.csr_matrix((matrix.data[keep], (rows[keep], matrix.indices[keep])), shape=matrix.shape)
+
+class PersonalizedPageRank:
+    """
+    Batched personalized PageRank over an undirected graph.
+
+    Args:
+        adjacency (scipy.sparse matrix): The symmetric adjacency matrix of the graph.
+        node_names (list of str): The node names indexing the adjacency.
+        is_icd (array-like of bool): Whether each node is an ICD code node.
+        alpha (float): The probability of following an edge at each step (1 - alpha is the probability of restarting at the seeds).
+    """
+    def __init__(self, adjacency, node_names, is_icd, alpha=0.85):
+        adjacency = sp.csr_matrix(adjacency, dtype=np.float32)
+        adjacency.data[:] = 1.0
+        degree = np.asarray(adjacency.sum(axis=1)).ravel()
+        self.dangling = degree == 0
+        degree[self.dangling] = 1.0
+        self.transition = (sp.diags(1 / degree) @ adjacency).tocsr().astype(np.float32)
+        self.node_names = list(node_names)
+        self.node_index = {name: i for i, name in enumerate(self.node_names)}
+        self.is_icd = np.asarray(is_icd, dtype=bool)
+        self.alpha = alpha
+
+    @classmethod
+    def from_compact_graph(cls, graph, **kwargs):
+        """Build the PageRank operator of a `compact_graph.CompactGraph`."""
+        is_icd = np.asarray(graph.node_types) == graph.type_names.index("ICD")
+        return cls(graph.to_scipy(), [graph.node_name(x) for x in range(graph.n_nodes)], is_icd, **kwargs)
+
+    @classmethod
+    def from_networkx(cls, G, **kwargs):
+        """Build the PageRank operator of the graph of `build_graph` (or the composed KG)."""
+        import networkx as nx
+
+        node_names = list(G.nodes())
+        is_icd = [G.nodes[x].get("type") == "ICD" for x in node_names]
+        return cls(nx.to_scipy_sparse_array(G, nodelist=node_names, format="csr"), node_names, is_icd, **kwargs)
+
+    def seed_matrix(self, notes_entities):
+        """Return the note x node matrix of the seeds, each row summing to 1 (or 0 if no entity of the note is in the KG)."""
+        rows, cols = [], []
+        for i, note_entities in enumerate(notes_entities):
+            ids = {self.node_index[x] for x in note_entities if x in self.node_index}
+            rows.extend([i] * len(ids))
+            cols.extend(ids)
+        seeds = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(notes_entities), len(self.node_names)))
+        totals = np.asarray(seeds.sum(axis=1)).ravel()
+        totals[totals == 0] = 1.0
+        return (sp.diags(1 / totals) @ seeds).tocsr()
+
+    def run(self, seeds, max_iterations=30, tol=1e-4, max_nonzeros=1000):
+        """
+        Run the power iteration x <- alpha * x P + (1 - alpha) * s for all the rows of the seed matrix at once.
+
+        The mass of dangling nodes is returned to the seeds. At each iteration every row of x P is truncated to its
+        `max_nonzeros` largest entries before the seeds are added.
+
+        Args:
+            seeds (scipy.sparse.csr_matrix): The seed matrix returned by `seed_matrix`.
+            max_iterations (int): The maximum number of iterations.
+            tol (float): The iteration stops when the L1 change of every row is below `tol`.
+            max_nonzeros (int): The number of entries kept per row.
+
+        Returns:
+            scipy.sparse.csr_matrix: The note x node matrix of the PageRank scores.
+        """
+        scores = seeds.copy()
+        for _ in range(max_iterations):
+            dangling_mass = np.asarray(scores[:, np.flatnonzero(self.dangling)].sum(axis=1)).ravel() if self.dangling.any() else 0.0
+            restart = (1 - self.alpha) + self.alpha * dangling_mass
+            # Truncating before adding the seeds keeps the sum cheap; the seeds of a row are at most a few entries.
+            updated = truncate_rows(scores @ self.transition, max_nonzeros)
+            updated = self.alpha * updated + sp.diags(np.broadcast_to(restart, (seeds.shape[0],))) @ seeds
+            change = np.asarray(abs(updated - scores).sum(axis=1)).ravel()
+            scores = updated
+            if change.max(initial=0) < tol:
+                break
+        return scores
+
+    def rank(self, notes_entities, top_k=20, exclude_seeds=False, **kwargs):
+        """
+        Rank the ICD codes of a batch of notes by personalized PageRank from their entities.
+
+        Args:
+            notes_entities (list of list of str): The normalized entities of each note.
+            top_k (int): The number of codes returned per note.
+            exclude_seeds (bool): Whether to leave out ICD codes that are themselves in the entities of the note.
+            **kwargs: The arguments of `run`.
+
+        Returns:
+            list: For each note, the list of (ICD code, score) tuples of its best codes, by decreasing score.
+        """
+        seeds = self.seed_matrix(notes_entities)
+        scores = self.run(seeds, **kwargs)
+        results = []
+        for i in range(scores.shape[0]):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            indices, data = scores.indices[start:end], scores.data[start:end]
+            keep = self.is_icd[indices]
+            if exclude_seeds:
+                keep &= ~np.isin(indices, seeds.indices[seeds.indptr[i]:seeds.indptr[i + 1]])
+            indices, data = indices[keep], data[keep]
+            order = np.lexsort((indices, -data))[:top_k]
+            results.append([(self.node_names[indices[j]], float(data[j])) for j in order])
+        return results
@@ -0,0 +1,146 @@
+"""
+In-process retrieval of candidate ICD codes from the knowledge graph.
+
+The edges between the ICD nodes and their entities are held as a sparse entity x code matrix, weighted by the type of
+the entity (a condition says more about the code than a laterality) and by the inverse document frequency of the entity
+(a "subsequent encounter" links to thousands of codes). A batch of notes is a sparse note x entity matrix, so ranking the
+codes of all the notes is one sparse matrix product, without any round-trip to Neo4j.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+TYPE_WEIGHTS = {
+    "condition": 3.0,
+    "bodypart": 1.5,
+    "cause": 1.5,
+    "complication": 1.5,
+    "procedure": 1.5,
+    "severity": 1.0,
+    "trimester": 1.0,
+    "fetus": 1.0,
+    "person": 0.5,
+    "laterality": 0.5,
+    "encounter_type": 0.5,
+    "other_info": 1.0,
+}
+
+class KGRetrievalEngine:
+    """
+    Ranks ICD codes by the weighted overlap between the entities of a note and the entities linked to each code.
+
+    Args:
+        icd_codes (list of str): The ICD codes.
+        entities (list of str): The normalized entities.
+        entity_types (list of str): The type of each entity.
+        entity_ids, code_ids (array-like): The entity and code indices of each ICD-entity edge.
+        type_weights (dict): Weight of each entity type (types not in the dict have weight 1).
+        length_norm (float): The weighted overlap of a code is divided by (total weight of the code's entities) ** length_norm,
+            so that 0 ranks by overlap only and 1 by the fraction of the code's entities found in the note.
+    """
+    def __init__(self, icd_codes, entities, entity_types, entity_ids, code_ids, type_weights=TYPE_WEIGHTS, length_norm=0.5):
+        self.icd_codes = list(icd_codes)
+        self.entities = list(entities)
+        self.entity_types = list(entity_types)
+        self.entity_index = {entity: i for i, entity in enumerate(self.entities)}
+
+        # Inverted index: row i of `postings` holds the codes linked to entity i.
+        links = sp.csr_matrix((np.ones(len(entity_ids), dtype=np.float32), (entity_ids, code_ids)),
+                              shape=(len(self.entities), len(self.icd_codes)))
+        links.data[:] = 1.0
+        self.postings = links
+
+        document_frequency = np.diff(links.indptr)
+        idf = np.log((1 + len(self.icd_codes)) / (1 + document_frequency)) + 1
+        type_weight = np.array([type_weights.get(x, 1.0) for x in self.entity_types], dtype=np.float32)
+        self.entity_weights = (type_weight * idf).astype(np.float32)
+
+        weighted = sp.diags(self.entity_weights) @ links
+        code_norms = np.asarray(weighted.sum(axis=0)).ravel() ** length_norm
+        code_norms[code_norms == 0] = 1.0
+        self.weights = (weighted @ sp.diags(1 / code_norms)).tocsr().astype(np.float32)
+
+    @classmethod
+    def from_networkx(cls, G, **kwargs):
+        """Build the engine from the graph of `build_graph` (or the composed KG)."""
+        icd_codes = [node for node, attributes in G.nodes(data=True) if attributes.get("type") == "ICD"]
+        code_index = {code: i for i, code in enumerate(icd_codes)}
+        entity_index, entities, entity_types, entity_ids, code_ids = {}, [], [], [], []
+        for code in icd_codes:
+            for entity in G.neighbors(code):
+                if entity in code_index:
+                    continue
+                if entity not in entity_index:
+                    entity_index[entity] = len(entities)
+                    entities.append(entity)
+                    entity_types.append(G.nodes[entity].get("type"))
+                entity_ids.append(entity_index[entity])
+                code_ids.append(code_index[code])
+        return cls(icd_codes, entities, entity_types, entity_ids, code_ids, **kwargs)
+
+    @classmethod
+    def from_compact_graph(cls, graph, **kwargs):
+        """Build the engine from a `compact_graph.CompactGraph`."""
+        node_types = np.asarray(graph.node_types)
+        is_icd = node_types == graph.type_names.index("ICD")
+        code_nodes = np.flatnonzero(is_icd)
+        rows = np.repeat(np.arange(graph.n_nodes), np.diff(graph.indptr))
+        cols = np.asarray(graph.indices)
+        # Edges from an entity to an ICD node.
+        keep = ~is_icd[rows] & is_icd[cols]
+        entity_nodes, entity_ids = np.unique(rows[keep], return_inverse=True)
+        code_position = np.full(graph.n_nodes, -1)
+        code_position[code_nodes] = np.arange(len(code_nodes))
+        return cls([graph.node_name(x) for x in code_nodes], [graph.node_name(x) for x in entity_nodes],
+                   [graph.node_type(x) for x in entity_nodes], entity_ids, code_position[cols[keep]], **kwargs)
+
+    def codes_for_entity(self, entity):
+        """Return the ICD codes linked to a normalized entity."""
+        entity_id = self.entity_index.get(entity)
+        if entity_id is None:
+            return []
+        return [self.icd_codes[x] for x in self.postings.indices[self.postings.indptr[entity_id]:self.postings.indptr[entity_id + 1]]]
+
+    def query_matrix(self, notes_entities):
+        """Return the binary note x entity matrix of a batch of notes (entities not in the KG are ignored)."""
+        rows, cols = [], []
+        for i, note_entities in enumerate(notes_entities):
+            ids = {self.entity_index[x] for x in note_entities if x in self.entity_index}
+            rows.extend([i] * len(ids))
+            cols.extend(ids)
+        return sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(notes_entities), len(self.entities)))
+
+    def score(self, notes_entities):
+        """
+        Score the ICD codes of a batch of notes.
+
+        Args:
+            notes_entities (list of list of str): The normalized entities of each note.
+
+        Returns:
+            scipy.sparse.csr_matrix: The note x code score matrix (codes without any shared entity are not stored).
+        """
+        return (self.query_matrix(notes_entities) @ self.weights).tocsr()
+
+    def rank(self, notes_entities, top_k=10):
+        """
+        Rank the ICD codes of a batch of notes.
+
+        Args:
+            notes_entities (list of list of str): The normalized entities of each note.
+            top_k (int): The number of codes returned per note.
+
+        Returns:
+            list: For each note, the list of (ICD code, score) tuples of its best codes, by decreasing score.
+        """
+        scores = self.score(notes_entities)
+        results = []
+        for i in range(scores.shape[0]):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            data, indices = scores.data[start:end], scores.indices[start:end]
+            if len(data) > top_k:
+                best = np.argpartition(-data, top_k)[:top_k]
+                data, indices = data[best], indices[best]
+            order = np.lexsort((indices, -data))
+            results.append([(self.icd_codes[indices[j]], float(data[j])) for j in order])
+        return results
@@ -1,10 +1,18 @@
 from neo4j import GraphDatabase
 import networkx as nx
+import csv
+import os
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 uri = ""
 username = ""
 password = ""
 BATCH_SIZE = 1000
+MAX_CONNECTION_POOL_SIZE = 50
 
 def create_nodes(tx, nodes):
     """
@@ -53,6 +61,40 @@ def create_relationships(tx, relationships):
         relationships=relationships
     )
 
+def delete_nodes(tx, node_ids):
+    """
+    Deletes nodes and all their relationships from the Neo4j database.
+
+    Args:
+        tx (neo4j.Transaction): The active Neo4j transaction.
+        node_ids (list): The unique identifiers of the nodes to delete.
+    """
+    tx.run(
+        """
+        UNWIND $node_ids AS node_id
+        MATCH (n:Node {id: node_id})
+        DETACH DELETE n
+        """,
+        node_ids=node_ids
+    )
+
+def delete_relationships(tx, relationships):
+    """
+    Deletes relationships between nodes from the Neo4j database.
+
+    Args:
+        tx (neo4j.Transaction): The active Neo4j transaction.
+        relationships (list): A list of dictionaries with the 'source_id' and 'target_id' of each relationship.
+    """
+    tx.run(
+        """
+        UNWIND $relationships AS rel
+        MATCH (a:Node {id: rel.source_id})-[r:RELATES_TO]-(b:Node {id: rel.target_id})
+        DELETE r
+        """,
+        relationships=relationships
+    )
+
 def create_index(tx):
     """
     Creates a unique constraint on the `id` property of the `Node` label in the Neo4j database.
@@ -64,3 +106,242 @@ def create_index(tx):
         tx (neo4j.Transaction): The active Neo4j transaction.
     """    
     tx.run("CREATE CONSTRAINT FOR (n:Node) REQUIRE n.id IS UNIQUE")
+
+
+def chunk_list(items, batch_size=BATCH_SIZE):
+    """
+    Splits a list into consecutive batches.
+
+    Args:
+        items (list): The items to split.
+        batch_size (int): The maximum number of items per batch.
+
+    Returns:
+        list: The list of batches.
+    """
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+def get_bucket(node_id, n_buckets):
+    """Assigns a node to one of `n_buckets` buckets with a hash that is stable across processes."""
+    return zlib.crc32(str(node_id).encode("utf-8")) % n_buckets
+
+def schedule_relationships(relationships, num_workers):
+    """
+    Partitions relationships into rounds of groups that do not share any node.
+
+    MERGE on a relationship locks both of its nodes, so relationships written concurrently by different sessions
+    deadlock or wait on each other when they share nodes. Nodes are hashed into an odd number of buckets B = 2 * num_workers - 1,
+    and a relationship between buckets a and b goes to round (a + b) mod B and group min(a, b). This is a round-robin
+    schedule: within a round, every bucket belongs to exactly one group, so the groups of a round can be written in parallel.
+
+    Args:
+        relationships (list): The relationship dictionaries with 'source_id' and 'target_id'.
+        num_workers (int): The number of parallel sessions.
+
+    Returns:
+        list: For each round, the list of its non-empty groups of relationships.
+    """
+    n_buckets = 2 * num_workers - 1
+    rounds = [{} for _ in range(n_buckets)]
+    for relationship in relationships:
+        a, b = get_bucket(relationship['source_id'], n_buckets), get_bucket(relationship['target_id'], n_buckets)
+        rounds[(a + b) % n_buckets].setdefault(min(a, b), []).append(relationship)
+    return [list(groups.values()) for groups in rounds if groups]
+
+def write_batches(driver, function, batches, database=None):
+    """
+    Writes batches sequentially in one session, with one transaction per batch.
+
+    Args:
+        driver (neo4j.Driver): The Neo4j driver.
+        function (callable): The transaction function (`create_nodes` or `create_relationships`).
+        batches (list): The batches to write.
+        database (str): The database name, or None for the default database.
+
+    Returns:
+        int: The number of items written.
+    """
+    with driver.session(database=database) as session:
+        for batch in batches:
+            session.execute_write(function, batch)
+    return sum(len(batch) for batch in batches)
+
+def load_graph(driver, nodes, relationships, batch_size=BATCH_SIZE, num_workers=4, database=None, create_constraint=True):
+    """
+    Loads nodes and relationships into Neo4j in batches of `batch_size`, over `num_workers` parallel sessions.
+
+    Nodes are written first, with the batches spread over the sessions. Relationships are then written in the rounds
+    of `schedule_relationships`, so that concurrent sessions never lock the same nodes.
+
+    Args:
+        driver (neo4j.Driver): The Neo4j driver.
+        nodes (list): The node dictionaries expected by `create_nodes`.
+        relationships (list): The relationship dictionaries expected by `create_relationships`.
+        batch_size (int): The number of items per transaction.
+        num_workers (int): The number of parallel sessions.
+        database (str): The database name, or None for the default database.
+        create_constraint (bool): Whether to create the unique constraint on the node ids first.
+
+    Returns:
+        tuple: The numbers of nodes and relationships written.
+    """
+    if create_constraint:
+        with driver.session(database=database) as session:
+            session.execute_write(create_index)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        node_batches = chunk_list(nodes, batch_size)
+        futures = [executor.submit(write_batches, driver, create_nodes, node_batches[i::num_workers], database) for i in range(num_workers)]
+        n_nodes = sum(future.result() for future in futures)
+
+        n_relationships = 0
+        for groups in schedule_relationships(relationships, num_workers):
+            futures = [executor.submit(write_batches, driver, create_relationships, chunk_list(group, batch_size), database) for group in groups]
+            n_relationships += sum(future.result() for future in futures)
+    return n_nodes, n_relationships
+
+def export_admin_import_csv(nodes, relationships, directory):
+    """
+    Writes the nodes and relationships as CSV files for `neo4j-admin database import`, which is the fastest way to load
+    the full graph into an empty database. The database must be stopped during the import, and the unique constraint
+    can be created with `create_index` afterwards.
+
+    Args:
+        nodes (list): The node dictionaries expected by `create_nodes`.
+        relationships (list): The relationship dictionaries expected by `create_relationships`.
+        directory (str): The output directory.
+
+    Returns:
+        str: The import command.
+    """
+    os.makedirs(directory, exist_ok=True)
+    node_path = os.path.join(directory, "nodes.csv")
+    relationship_path = os.path.join(directory, "relationships.csv")
+    node_keys = sorted({key for node in nodes for key in node['attributes']})
+    relationship_keys = sorted({key for relationship in relationships for key in relationship['attributes']})
+
+    with open(node_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id:ID"] + node_keys)
+        for node in nodes:
+            writer.writerow([node['id']] + [node['attributes'].get(key, "") for key in node_keys])
+
+    with open(relationship_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([":START_ID", ":END_ID"] + relationship_keys)
+        for relationship in relationships:
+            writer.writerow([relationship['source_id'], relationship['target_id']] + [relationship['attributes'].get(key, "") for key in relationship_keys])
+
+    return (f"neo4j-admin database import full --nodes=Node={os.path.abspath(node_path)} "
+            f"--relationships=RELATES_TO={os.path.abspath(relationship_path)} neo4j")
+
+@lru_cache(maxsize=None)
+def get_driver():
+    """
+    Returns the shared Neo4j driver for `uri`, `username` and `password`, creating it on first use.
+
+    Sessions opened from the same driver borrow connections from its pool, so the driver should be created once and
+    reused for all the queries instead of once per query.
+    """
+    return GraphDatabase.driver(uri, auth=(username, password), max_connection_pool_size=MAX_CONNECTION_POOL_SIZE)
+
+def lookup_entities(tx, entity_names):
+    """
+    Looks up a batch of entities in a single query.
+
+    Args:
+        tx (neo4j.Transaction): The active Neo4j transaction.
+        entity_names (list): The normalized entity names (node ids).
+
+    Returns:
+        list: One dictionary per entity found in the database, with the entity 'name', its 'type', the 'icd_codes' it is
+        linked to and its other 'neighbors' (dictionaries with 'id' and 'type').
+    """
+    result = tx.run(
+        """
+        UNWIND $names AS name
+        MATCH (n:Node {id: name})
+        OPTIONAL MATCH (n)-[:RELATES_TO]-(m:Node)
+        RETURN name, n.type AS type,
+               collect(CASE WHEN m.type = 'ICD' THEN m.id END) AS icd_codes,
+               collect(CASE WHEN m IS NOT NULL AND coalesce(m.type, '') <> 'ICD' THEN {id: m.id, type: m.type} END) AS neighbors
+        """,
+        names=entity_names
+    )
+    return [record.data() for record in result]
+
+class KGReader:
+    """
+    Batched read access to the knowledge graph in Neo4j, with a bounded LRU cache of the entity lookups.
+
+    Args:
+        driver (neo4j.Driver): The Neo4j driver (by default the shared driver of `get_driver`).
+        database (str): The database name, or None for the default database.
+        batch_size (int): The number of entities per query.
+        cache_size (int): The maximum number of cached entity lookups.
+    """
+    def __init__(self, driver=None, database=None, batch_size=BATCH_SIZE, cache_size=100000):
+        self.driver = driver or get_driver()
+        self.database = database
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, entity_names):
+        """
+        Resolves a batch of entities, querying Neo4j only for the ones that are not cached.
+
+        Args:
+            entity_names (list): The normalized entity names.
+
+        Returns:
+            dict: Mapping of each entity name to its 'type', 'icd_codes' and 'neighbors', or to None if it is not in the graph.
+        """
+        results = {}
+        missing = []
+        with self.lock:
+            for name in dict.fromkeys(entity_names):
+                if name in self.cache:
+                    self.cache.move_to_end(name)
+                    results[name] = self.cache[name]
+                    self.hits += 1
+                else:
+                    missing.append(name)
+                    self.misses += 1
+
+        if missing:
+            fetched = dict.fromkeys(missing)
+            with self.driver.session(database=self.database) as session:
+                for batch in chunk_list(missing, self.batch_size):
+                    for record in session.execute_read(lookup_entities, batch):
+                        fetched[record['name']] = {'type': record['type'], 'icd_codes': record['icd_codes'], 'neighbors': record['neighbors']}
+            results.update(fetched)
+            with self.lock:
+                for name, value in fetched.items():
+                    self.cache[name] = value
+                    self.cache.move_to_end(name)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return results
+
+    def lookup_notes(self, notes_entities):
+        """
+        Resolves the entities of a batch of notes, with one lookup for the distinct entities of the whole batch.
+
+        Args:
+            notes_entities (list of list of str): The normalized entities of each note.
+
+        Returns:
+            list: For each note, a dictionary with the lookups of its entities ('entities') and the ICD codes linked to its
+            entities, with the number of entities linking to each code ('icd_codes', a Counter).
+        """
+        lookups = self.lookup([name for note_entities in notes_entities for name in note_entities])
+        results = []
+        for note_entities in notes_entities:
+            entities = {name: lookups[name] for name in dict.fromkeys(note_entities)}
+            icd_codes = Counter(code for value in entities.values() if value for code in value['icd_codes'])
+            results.append({'entities': entities, 'icd_codes': icd_codes})
+        return results
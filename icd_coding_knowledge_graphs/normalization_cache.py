@@ -0,0 +1,58 @@
+import sqlite3
+import threading
+
+class NormalizationCache:
+    """
+    Disk-backed cache of entity normalizations, mapping surface forms to their UMLS CUI and canonical name.
+
+    The cache is a SQLite file, so it persists across notebook sessions and KG rebuilds, and only the entities
+    which were never linked before need to go through the UMLS linker.
+
+    Args:
+        file_path (str): The path to the SQLite file (created if it does not exist).
+    """
+    def __init__(self, file_path):
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS normalizations (entity TEXT PRIMARY KEY, cui TEXT, canonical_name TEXT)")
+
+    def get_many(self, entities, chunk_size=500):
+        """
+        Look up the normalizations of several entities.
+
+        Args:
+            entities (list of str): The entity surface forms.
+            chunk_size (int): The number of entities per query.
+
+        Returns:
+            dict: Mapping of the cached entities to (CUI, canonical name) tuples. Entities which are not cached are omitted.
+        """
+        entities = list(entities)
+        found = {}
+        with self.lock:
+            for start in range(0, len(entities), chunk_size):
+                chunk = entities[start:start + chunk_size]
+                rows = self.connection.execute(
+                    f"SELECT entity, cui, canonical_name FROM normalizations WHERE entity IN ({','.join('?' * len(chunk))})", chunk)
+                for entity, cui, canonical_name in rows:
+                    found[entity] = (cui, canonical_name)
+        return found
+
+    def set_many(self, normalizations):
+        """
+        Store the normalizations of several entities.
+
+        Args:
+            normalizations (dict): Mapping of entities to (CUI, canonical name) tuples.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO normalizations VALUES (?, ?, ?)",
+                                        [(entity, cui, name) for entity, (cui, name) in normalizations.items()])
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM normalizations").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
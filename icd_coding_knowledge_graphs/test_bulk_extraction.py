@@ -0,0 +1,73 @@
+import asyncio
+import email.utils
+import json
+import time
+
+from bulk_extraction import AdaptiveLimiter, ShardWriter, load_completed, parse_retry_after
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("0.5") == 0.5
+    assert parse_retry_after(None) == 0.0
+    assert parse_retry_after("soon") == 0.0
+    assert 25 < parse_retry_after(email.utils.formatdate(time.time() + 30, usegmt=True)) <= 30
+    # A date in the past means no wait.
+    assert parse_retry_after(email.utils.formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+def test_limiter_halves_once_per_congestion_window():
+    async def run():
+        limiter = AdaptiveLimiter(initial=8, minimum=1)
+        windows = [await limiter.acquire() for _ in range(8)]
+        # All the requests of the burst were sent under the same limit: only the first 429 halves it.
+        for window in windows:
+            await limiter.release(window, rate_limited=True)
+        assert limiter.limit == 4
+        # A request sent after the decrease starts a new window.
+        await limiter.release(await limiter.acquire(), rate_limited=True)
+        assert limiter.limit == 2
+        for _ in range(3):
+            await limiter.release(await limiter.acquire(), rate_limited=True)
+        assert limiter.limit == 1
+
+    asyncio.run(run())
+
+def test_limiter_grows_after_consecutive_successes():
+    async def run():
+        limiter = AdaptiveLimiter(initial=2, maximum=3, increase_every=2)
+        for _ in range(4):
+            await limiter.release(await limiter.acquire())
+        assert limiter.limit == 3
+        for _ in range(4):
+            await limiter.release(await limiter.acquire())
+        assert limiter.limit == 3
+
+    asyncio.run(run())
+
+def test_limiter_bounds_requests_in_flight():
+    async def run():
+        limiter = AdaptiveLimiter(initial=3, increase_every=100)
+        peak = 0
+
+        async def request():
+            nonlocal peak
+            window = await limiter.acquire()
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.001)
+            await limiter.release(window)
+
+        await asyncio.gather(*[request() for _ in range(20)])
+        return peak
+
+    assert asyncio.run(run()) == 3
+
+def test_shards_resume_after_a_truncated_line(tmp_path):
+    writer = ShardWriter(str(tmp_path), shard_size=2)
+    for i in range(3):
+        writer.write({"code": f"A0{i}", "output": f"output {i}"})
+    writer.close()
+    with open(tmp_path / "shard-00001.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"code": "A09", "output": "cut"})[:10])
+
+    assert load_completed(str(tmp_path)) == {"A00": "output 0", "A01": "output 1", "A02": "output 2"}
+    # A new run never appends to the shards of a previous one.
+    assert ShardWriter(str(tmp_path)).shard_index == 2
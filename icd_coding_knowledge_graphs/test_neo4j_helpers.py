@@ -0,0 +1,173 @@
+import random
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("neo4j")
+
+from neo4j_helpers import KGReader, create_index, create_nodes, create_relationships, load_graph, lookup_entities, schedule_relationships
+
+class FakeGraph:
+    """In-memory stand-in for the database, recording the transactions run by the fake sessions."""
+    def __init__(self, delay=0.002):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.locked_nodes = Counter()
+        self.conflicts = []
+        self.nodes = Counter()
+        self.relationships = Counter()
+
+    def write(self, function, batch=None):
+        if function is create_index:
+            return
+        if function is create_nodes:
+            touched = [node["id"] for node in batch]
+        elif function is create_relationships:
+            touched = [node_id for rel in batch for node_id in (rel["source_id"], rel["target_id"])]
+        # Take the locks of the nodes for the duration of the transaction, as MERGE does.
+        with self.lock:
+            shared = set(touched) & {node_id for node_id, count in self.locked_nodes.items() if count}
+            if shared:
+                self.conflicts.append(shared)
+            self.locked_nodes.update(set(touched))
+        time.sleep(self.delay)
+        with self.lock:
+            self.locked_nodes.subtract(set(touched))
+            if function is create_nodes:
+                self.nodes.update(touched)
+            else:
+                self.relationships.update((rel["source_id"], rel["target_id"]) for rel in batch)
+
+class FakeRecord:
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def data(self):
+        return dict(self.values)
+
+class FakeTransaction:
+    """Checks the entity lookup query and its parameters, and answers with the canned rows of a `FakeKnowledgeGraph`."""
+    def __init__(self, graph):
+        self.graph = graph
+
+    def run(self, query, **parameters):
+        assert "UNWIND $names AS name" in query
+        assert "OPTIONAL MATCH (n)-[:RELATES_TO]-(m:Node)" in query
+        # The null `m` of an entity without neighbours must not be collected as a neighbour.
+        assert "CASE WHEN m IS NOT NULL AND coalesce(m.type, '') <> 'ICD' THEN" in query
+        assert set(parameters) == {"names"}
+        self.graph.queries.append(list(parameters["names"]))
+        return [FakeRecord(self.graph.rows[name]) for name in parameters["names"] if name in self.graph.rows]
+
+class FakeKnowledgeGraph:
+    """Canned rows of the entity lookup query, by entity name, counting the queries."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+class FakeSession:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute_write(self, function, *args):
+        return self.graph.write(function, *args)
+
+    def execute_read(self, function, *args):
+        return function(FakeTransaction(self.graph), *args)
+
+class FakeDriver:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def session(self, database=None):
+        return FakeSession(self.graph)
+
+def make_graph(n_nodes=60, n_relationships=400, seed=0):
+    rng = random.Random(seed)
+    nodes = [{"id": f"n{i}", "attributes": {"type": "Entity"}} for i in range(n_nodes)]
+    pairs = set()
+    while len(pairs) < n_relationships:
+        a, b = rng.sample(range(n_nodes), 2)
+        pairs.add((f"n{a}", f"n{b}"))
+    relationships = [{"source_id": a, "target_id": b, "attributes": {}} for a, b in sorted(pairs)]
+    return nodes, relationships
+
+def test_schedule_relationships_groups_of_a_round_share_no_node():
+    _, relationships = make_graph()
+    rounds = schedule_relationships(relationships, num_workers=4)
+
+    scheduled = [(rel["source_id"], rel["target_id"]) for groups in rounds for group in groups for rel in group]
+    assert Counter(scheduled) == Counter((rel["source_id"], rel["target_id"]) for rel in relationships)
+    for groups in rounds:
+        assert len(groups) <= 2 * 4 - 1
+        group_nodes = [{node_id for rel in group for node_id in (rel["source_id"], rel["target_id"])} for group in groups]
+        for i in range(len(group_nodes)):
+            for j in range(i + 1, len(group_nodes)):
+                assert not group_nodes[i] & group_nodes[j]
+
+def test_load_graph_writes_every_relationship_once_without_concurrent_node_locks():
+    nodes, relationships = make_graph()
+    graph = FakeGraph()
+
+    n_nodes, n_relationships = load_graph(FakeDriver(graph), nodes, relationships, batch_size=7, num_workers=4)
+
+    assert (n_nodes, n_relationships) == (len(nodes), len(relationships))
+    assert graph.conflicts == []
+    assert graph.nodes == Counter(node["id"] for node in nodes)
+    assert graph.relationships == Counter((rel["source_id"], rel["target_id"]) for rel in relationships)
+
+def make_knowledge_graph():
+    rows = {"diabetes": {"name": "diabetes", "type": "Disease", "icd_codes": ["E11.9"], "neighbors": [{"id": "insulin", "type": "Drug"}]},
+            "hypertension": {"name": "hypertension", "type": "Disease", "icd_codes": ["I10"], "neighbors": []},
+            "isolated": {"name": "isolated", "type": "Disease", "icd_codes": [], "neighbors": []}}
+    return FakeKnowledgeGraph(rows)
+
+def test_lookup_entities_returns_icd_codes_and_other_neighbors():
+    graph = make_knowledge_graph()
+
+    records = {record["name"]: record for record in lookup_entities(FakeTransaction(graph), ["diabetes", "isolated", "unknown"])}
+
+    assert graph.queries == [["diabetes", "isolated", "unknown"]]
+    assert set(records) == {"diabetes", "isolated"}
+    assert records["diabetes"] == {"name": "diabetes", "type": "Disease", "icd_codes": ["E11.9"],
+                                   "neighbors": [{"id": "insulin", "type": "Drug"}]}
+    assert records["isolated"] == {"name": "isolated", "type": "Disease", "icd_codes": [], "neighbors": []}
+
+def test_kg_reader_caches_lookups_in_lru_order():
+    graph = make_knowledge_graph()
+    reader = KGReader(driver=FakeDriver(graph), batch_size=2, cache_size=3)
+
+    first = reader.lookup(["diabetes", "isolated", "unknown", "diabetes"])
+    assert graph.queries == [["diabetes", "isolated"], ["unknown"]]
+    assert first["unknown"] is None
+    assert first["isolated"] == {"type": "Disease", "icd_codes": [], "neighbors": []}
+
+    # Cached entities, including the ones which are not in the graph, are not queried again.
+    assert reader.lookup(["unknown", "diabetes"]) == {"unknown": None, "diabetes": first["diabetes"]}
+    assert len(graph.queries) == 2
+    assert (reader.hits, reader.misses) == (2, 3)
+
+    # "isolated" is now the least recently used entity, and is evicted by a new one.
+    reader.lookup(["hypertension"])
+    assert list(reader.cache) == ["unknown", "diabetes", "hypertension"]
+    reader.lookup(["isolated"])
+    assert graph.queries[-1] == ["isolated"]
+
+def test_kg_reader_lookup_notes_counts_linked_codes():
+    reader = KGReader(driver=FakeDriver(make_knowledge_graph()))
+
+    notes = reader.lookup_notes([["diabetes", "hypertension", "isolated"], ["unknown"]])
+
+    assert notes[0]["icd_codes"] == Counter({"E11.9": 1, "I10": 1})
+    assert notes[1] == {"entities": {"unknown": None}, "icd_codes": Counter()}
@@ -0,0 +1,122 @@
+"""
+Checks that the merge/groupby implementations of the CodiEsp metrics in evaluate_performance.py give the same
+numbers as the original per-case/per-code loops, and measures the speedup on a synthetic evaluation set.
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from evaluate_performance import calculate_metrics, calculate_metrics_simple, compute_macro_averaged_scores
+
+def reference_calculate_metrics(df_gs: pd.DataFrame, df_pred: pd.DataFrame) -> tuple[float]:
+    """The original loop-based version of `calculate_metrics`."""
+    pred_per_cc = df_pred.drop_duplicates(subset=['clinical_case', "code"]).groupby("clinical_case")["code"].count()
+    Pred_Pos = df_pred.drop_duplicates(subset=['clinical_case', "code"]).shape[0]
+    true_per_cc = df_gs.drop_duplicates(subset=['clinical_case', "code"]).groupby("clinical_case")["code"].count()
+    GS_Pos = df_gs.drop_duplicates(subset=['clinical_case', "code"]).shape[0]
+    cc = set(df_gs.clinical_case.tolist())
+    TP_per_cc = pd.Series(dtype=float)
+    for c in cc:
+        pred = set(df_pred.loc[df_pred['clinical_case'] == c, 'code'].values)
+        gs = set(df_gs.loc[df_gs['clinical_case'] == c, 'code'].values)
+        TP_per_cc[c] = len(pred.intersection(gs))
+    TP = sum(TP_per_cc.values)
+    precision_per_cc = TP_per_cc / pred_per_cc
+    recall_per_cc = TP_per_cc / true_per_cc
+    f1_score_per_cc = (2 * precision_per_cc * recall_per_cc) / (precision_per_cc + recall_per_cc + 1e-10)
+    precision = TP / Pred_Pos
+    recall = TP / GS_Pos
+    f1_score = (2 * precision * recall) / (precision + recall + 1e-10)
+    return precision_per_cc, precision, recall_per_cc, recall, f1_score_per_cc, f1_score
+
+def reference_calculate_metrics_simple(true: pd.DataFrame, pred: pd.DataFrame) -> dict:
+    """The original loop-based version of `calculate_metrics_simple`."""
+    true_positives = 0
+    for case_id in set(true.clinical_case):
+        true_labels = set(true.loc[true.clinical_case == case_id].code)
+        pred_labels = set(pred.loc[pred.clinical_case == case_id].code)
+        true_positives += len(pred_labels.intersection(true_labels))
+    macro_precision = true_positives / len(pred)
+    macro_recall = true_positives / len(true)
+    macro_f1 = 2 / (macro_recall**-1 + macro_precision**-1)
+    return dict(precision=macro_precision, recall=macro_recall, f1_score=macro_f1)
+
+def reference_compute_macro_averaged_scores(df_gs: pd.DataFrame, df_run: pd.DataFrame) -> tuple[float]:
+    """The original loop-based version of `compute_macro_averaged_scores`."""
+    codes = set(df_gs.code)
+    precisions, recalls, f1_scores = [], [], []
+    for code in codes:
+        true_cases = df_gs[df_gs.code == code]
+        pred_cases = df_run[df_run.code == code]
+        true_positive_count = len(set(pred_cases.clinical_case).intersection(set(true_cases.clinical_case)))
+        precision = true_positive_count / len(pred_cases) if true_positive_count > 0 else 0
+        recall = true_positive_count / len(true_cases)
+        f1_score = 2 * precision * recall / (precision + recall) if precision > 0 and recall > 0 else 0
+        precisions.append(precision)
+        recalls.append(recall)
+        f1_scores.append(f1_score)
+    return np.mean(precisions), np.mean(recalls), np.mean(f1_scores)
+
+def make_synthetic_data(n_cases, n_codes, codes_per_case, seed=0):
+    """
+    Generate a random gold-standard and prediction set.
+
+    Args:
+        n_cases (int): Number of clinical cases.
+        n_codes (int): Size of the code vocabulary.
+        codes_per_case (int): Average number of codes per case in each set.
+        seed (int): Random seed.
+
+    Returns:
+        tuple: The gold-standard and predictions dataframes.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"c{i:05d}" for i in range(n_codes)])
+    cases = np.array([f"case-{i}" for i in range(n_cases)])
+
+    def sample(n_rows):
+        return pd.DataFrame({"clinical_case": cases[rng.integers(0, n_cases, n_rows)],
+                             "code": vocabulary[rng.zipf(1.3, n_rows) % n_codes]})
+
+    df_gs = sample(n_cases * codes_per_case)
+    # Predictions partly copy the gold standard so that there is a realistic number of true positives.
+    df_pred = pd.concat([df_gs.sample(frac=0.4, random_state=seed), sample(n_cases * codes_per_case // 2)])
+    # Leave a few cases without predictions.
+    df_pred = df_pred[~df_pred.clinical_case.isin(cases[:max(1, n_cases // 100)])]
+    return df_gs.reset_index(drop=True), df_pred.reset_index(drop=True)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def compare(df_gs, df_pred):
+    """Run both implementations of each metric, assert that they agree and print the timings."""
+    (ref, ref_time), (new, new_time) = timed(reference_calculate_metrics, df_gs, df_pred), timed(calculate_metrics, df_gs, df_pred)
+    for ref_value, new_value in zip(ref, new):
+        if isinstance(ref_value, pd.Series):
+            pd.testing.assert_series_equal(ref_value.sort_index(), new_value, check_names=False, check_index_type=False)
+        else:
+            assert np.isclose(ref_value, new_value, rtol=1e-12, atol=0), (ref_value, new_value)
+    print(f"calculate_metrics:             {ref_time:8.3f}s -> {new_time:8.3f}s ({ref_time / new_time:6.1f}x)")
+
+    (ref, ref_time), (new, new_time) = timed(reference_calculate_metrics_simple, df_gs, df_pred), timed(calculate_metrics_simple, df_gs, df_pred)
+    assert all(np.isclose(ref[key], new[key], rtol=1e-12, atol=0) for key in ref), (ref, new)
+    print(f"calculate_metrics_simple:      {ref_time:8.3f}s -> {new_time:8.3f}s ({ref_time / new_time:6.1f}x)")
+
+    (ref, ref_time), (new, new_time) = timed(reference_compute_macro_averaged_scores, df_gs, df_pred), timed(compute_macro_averaged_scores, df_gs, df_pred)
+    assert np.allclose(ref, new, rtol=1e-12, atol=0), (ref, new)
+    print(f"compute_macro_averaged_scores: {ref_time:8.3f}s -> {new_time:8.3f}s ({ref_time / new_time:6.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the equivalence and speedup of the vectorized evaluation metrics.")
+    parser.add_argument("--n_cases", type=int, nargs="+", default=[250, 1000, 2500], help="Numbers of clinical cases to benchmark")
+    parser.add_argument("--n_codes", type=int, default=5000, help="Size of the code vocabulary")
+    parser.add_argument("--codes_per_case", type=int, default=10, help="Average number of codes per case")
+    args = parser.parse_args()
+
+    for n_cases in args.n_cases:
+        print(f"\n{n_cases} clinical cases")
+        df_gs, df_pred = make_synthetic_data(n_cases, args.n_codes, args.codes_per_case)
+        compare(df_gs, df_pred)
@@ -3,8 +3,8 @@ import warnings
 import numpy as np
 import pandas as pd
 import simple_icd_10_cm as cm
-import os
 import json
+from functools import lru_cache
 
 """
 @authors: antonio, Joseph Boyle
@@ -32,17 +32,20 @@ def read_run(pred_path: str, valid_codes: set) -> pd.DataFrame:
         warnings.warn('None of the predicted codes are considered valid codes')
     return run_data
 
+def get_true_positive_pairs(df_gs: pd.DataFrame, df_pred: pd.DataFrame) -> pd.DataFrame:
+    """Return the unique (clinical_case, code) pairs present in both the gold-standard and the predictions."""
+    gs_pairs = df_gs[['clinical_case', 'code']].drop_duplicates()
+    pred_pairs = df_pred[['clinical_case', 'code']].drop_duplicates()
+    return gs_pairs.merge(pred_pairs, on=['clinical_case', 'code'], how='inner')
+
 def calculate_metrics(df_gs: pd.DataFrame, df_pred: pd.DataFrame) -> tuple[float]:
     pred_per_cc = df_pred.drop_duplicates(subset=['clinical_case', "code"]).groupby("clinical_case")["code"].count()
     Pred_Pos = df_pred.drop_duplicates(subset=['clinical_case', "code"]).shape[0]
     true_per_cc = df_gs.drop_duplicates(subset=['clinical_case', "code"]).groupby("clinical_case")["code"].count()
     GS_Pos = df_gs.drop_duplicates(subset=['clinical_case', "code"]).shape[0]
-    cc = set(df_gs.clinical_case.tolist())
-    TP_per_cc = pd.Series(dtype=float)
-    for c in cc:
-        pred = set(df_pred.loc[df_pred['clinical_case'] == c, 'code'].values)
-        gs = set(df_gs.loc[df_gs['clinical_case'] == c, 'code'].values)
-        TP_per_cc[c] = len(pred.intersection(gs))
+    cc = sorted(set(df_gs.clinical_case.tolist()))
+    tp_counts = get_true_positive_pairs(df_gs, df_pred).groupby("clinical_case").size()
+    TP_per_cc = pd.Series(tp_counts.reindex(cc, fill_value=0).values, index=cc, dtype=float)
     TP = sum(TP_per_cc.values)
     precision_per_cc = TP_per_cc / pred_per_cc
     recall_per_cc = TP_per_cc / true_per_cc
@@ -54,29 +57,23 @@ def calculate_metrics(df_gs: pd.DataFrame, df_pred: pd.DataFrame) -> tuple[float
 
 def calculate_metrics_simple(true: pd.DataFrame, pred: pd.DataFrame) -> dict:
     """Compute the macro-precision, macro-recall and macro-f1 scores."""
-    true_positives = 0
-    for case_id in set(true.clinical_case):
-        true_labels = set(true.loc[true.clinical_case == case_id].code)
-        pred_labels = set(pred.loc[pred.clinical_case == case_id].code)
-        true_positives += len(pred_labels.intersection(true_labels))
+    true_positives = len(get_true_positive_pairs(true, pred))
     macro_precision = true_positives / len(pred)
     macro_recall = true_positives / len(true)
     macro_f1 = 2 / (macro_recall**-1 + macro_precision**-1)
     return dict(precision=macro_precision, recall=macro_recall, f1_score=macro_f1)
 
 def compute_macro_averaged_scores(df_gs: pd.DataFrame, df_run: pd.DataFrame) -> tuple[float]:
-    codes = set(df_gs.code)
-    precisions, recalls, f1_scores = [], [], []
-    for code in codes:
-        true_cases = df_gs[df_gs.code == code]
-        pred_cases = df_run[df_run.code == code]
-        true_positive_count = len(set(pred_cases.clinical_case).intersection(set(true_cases.clinical_case)))
-        precision = true_positive_count / len(pred_cases) if true_positive_count > 0 else 0
-        recall = true_positive_count / len(true_cases)
-        f1_score = 2 * precision * recall / (precision + recall) if precision > 0 and recall > 0 else 0
-        precisions.append(precision)
-        recalls.append(recall)
-        f1_scores.append(f1_score)
+    codes = sorted(set(df_gs.code))
+    if not codes:
+        return np.nan, np.nan, np.nan
+    true_counts = df_gs.groupby("code").size().reindex(codes).to_numpy(dtype=float)
+    pred_counts = df_run.groupby("code").size().reindex(codes, fill_value=0).to_numpy(dtype=float)
+    tp_counts = get_true_positive_pairs(df_gs, df_run).groupby("code").size().reindex(codes, fill_value=0).to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precisions = np.where(tp_counts > 0, tp_counts / pred_counts, 0.0)
+        recalls = tp_counts / true_counts
+        f1_scores = np.where((precisions > 0) & (recalls > 0), 2 * precisions * recalls / (precisions + recalls), 0.0)
     return np.mean(precisions), np.mean(recalls), np.mean(f1_scores)
 
 def analyse_errors(true: pd.DataFrame, pred: pd.DataFrame) -> None:
@@ -115,72 +112,97 @@ def read_valid_codes(codes_path: str) -> set:
     valid_codes = set(x.lower() for x in valid_codes)
     return valid_codes
 
+@lru_cache(maxsize=None)
+def get_leaf_codes() -> frozenset:
+    """Return the lowercased set of leaf ICD-10-CM codes, computed once per process."""
+    return frozenset(x.lower() for x in cm.get_all_codes() if cm.is_leaf(x))
+
+def load_gold_standard(gs_path: str, valid_codes: set) -> pd.DataFrame:
+    """Read the gold-standard TSV (whose first line is treated as a header) and filter it to the valid codes."""
+    gs_data = pd.read_csv(gs_path, sep="\t", dtype=object)
+    gs_data.columns = ['clinical_case', 'code']
+    gs_data = gs_data[gs_data['code'].str.lower().isin(valid_codes)]
+    gs_data.code = gs_data.code.str.lower()
+    return gs_data
+
+def predictions_to_frame(code_map: dict, valid_codes: set) -> pd.DataFrame:
+    """Convert a {file name: [codes]} prediction map to a dataframe filtered to the valid codes."""
+    rows = [[key.replace(".txt", ""), code.lower()] for key, value in code_map.items() for code in value]
+    run_data = pd.DataFrame(rows, columns=['clinical_case', 'code'], dtype=object)
+    run_data = run_data[run_data['code'].isin(valid_codes)]
+    if run_data.shape[0] == 0:
+        warnings.warn('None of the predicted codes are considered valid codes')
+    return run_data
+
+def evaluate_run(df_gs: pd.DataFrame, df_run: pd.DataFrame) -> dict:
+    """Compute the micro- and macro-averaged scores of a run against the gold-standard."""
+    _, precision, _, recall, _, f1_score = calculate_metrics(df_gs, df_run)
+    macro_precision, macro_recall, macro_f1 = compute_macro_averaged_scores(df_gs, df_run)
+    return {"micro_precision": precision, "micro_recall": recall, "micro_f1": f1_score,
+            "macro_precision": macro_precision, "macro_recall": macro_recall, "macro_f1": macro_f1,
+            "n_documents_with_predictions": len(set(df_run.clinical_case))}
+
+def evaluate_runs(pred_paths: list, gs_path: str, valid_codes: set = None) -> pd.DataFrame:
+    """Evaluate several prediction JSON files against one gold-standard, loaded once, and return a comparison table."""
+    if valid_codes is None:
+        valid_codes = get_leaf_codes()
+    df_gs = load_gold_standard(gs_path, valid_codes)
+    results = {}
+    for pred_path in pred_paths:
+        with open(pred_path) as f:
+            code_map = json.load(f)
+        results[pred_path] = evaluate_run(df_gs, predictions_to_frame(code_map, valid_codes))
+    return pd.DataFrame.from_dict(results, orient="index")
+
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="Process and evaluate medical text predictions.")
     parser.add_argument("--input_json", help="JSON file with predictions")
+    parser.add_argument("--input_jsons", nargs="+", help="Several JSON files with predictions, compared in a single table")
     parser.add_argument("--gold_standard_tsv", help="Gold standard TSV file")
+    parser.add_argument("--output_csv", default=None, help="Optional CSV file to save the comparison table to")
     args = parser.parse_args()    
-    
-    code_map = json.loads(open(args.input_json).read())
-    file_tsv_predictions = []
-
-    for key, value in code_map.items():
-
-        if value == []:
-            file_tsv_predictions.append([key.replace(".txt", ""), ""])
-
-        else:
-            for code in value:
-                file_tsv_predictions.append([key.replace(".txt", ""),code.lower()])
 
-    df_pred = pd.DataFrame(file_tsv_predictions)
-    df_pred.columns = ["clinical_case", "code"]
-    df_pred.to_csv(args.input_json.replace(".json", ".tsv"), sep="\t", index=False)
-
-
-    df_gs = pd.read_csv(args.gold_standard_tsv, sep="\t")
-    df_gs.columns = ["clinical_case", "code"]
-    df_gs.to_csv("gt_test.tsv", sep="\t", index=False)
-
-    valid_codes = set([x.lower() for x in cm.get_all_codes() if cm.is_leaf(x)])
+    if args.input_jsons:
+        table = evaluate_runs(args.input_jsons, args.gold_standard_tsv)
+        print(table.round(3).to_string())
+        if args.output_csv:
+            table.to_csv(args.output_csv)
+    else:
+        valid_codes = get_leaf_codes()
+        code_map = json.loads(open(args.input_json).read())
+        df_gs = load_gold_standard(args.gold_standard_tsv, valid_codes)
+        df_run = predictions_to_frame(code_map, valid_codes)
     
-    gs_path = "gt_test.tsv"
-    pred_path = args.input_json.replace(".json", ".tsv")
-    df_gs = read_gs(gs_path, valid_codes)
-    df_run = read_run(pred_path, valid_codes)
-    
-    precision_per_cc, precision, recall_per_cc, recall, f1_per_cc, f1_score = calculate_metrics(df_gs, df_run)
-    print('\n-----------------------------------------------------')
-    print('Clinical case name\t\t\tPrecision')
-    print('-----------------------------------------------------')
-
-    for index, val in precision_per_cc.items():
-        print(f"{index}\t\t{round(val, 3)}")
-    if any(precision_per_cc.isna()):
-        warnings.warn('Some documents do not have predicted codes, document-wise Precision not computed for them.')
-    print('\nMicro-average precision = {}\n'.format(round(precision, 3)))
-    print('\n-----------------------------------------------------')
-    print('Clinical case name\t\t\tRecall')
-    print('-----------------------------------------------------')
-
-    for index, val in recall_per_cc.items():
-        print(f"{index}\t\t{round(val, 3)}")
-    if any(recall_per_cc.isna()):
-        warnings.warn('Some documents do not have Gold Standard codes, document-wise Recall not computed for them.')
-    print('\nMicro-average recall = {}\n'.format(round(recall, 3)))
-    print('\n-----------------------------------------------------')
-    print('Clinical case name\t\t\tF-score')
-    print('-----------------------------------------------------')
-
-    print('\nMicro-average F-score = {}\n'.format(round(f1_score, 3)))
+        precision_per_cc, precision, recall_per_cc, recall, f1_per_cc, f1_score = calculate_metrics(df_gs, df_run)
+        print('\n-----------------------------------------------------')
+        print('Clinical case name\t\t\tPrecision')
+        print('-----------------------------------------------------')
+
+        for index, val in precision_per_cc.items():
+            print(f"{index}\t\t{round(val, 3)}")
+        if any(precision_per_cc.isna()):
+            warnings.warn('Some documents do not have predicted codes, document-wise Precision not computed for them.')
+        print('\nMicro-average precision = {}\n'.format(round(precision, 3)))
+        print('\n-----------------------------------------------------')
+        print('Clinical case name\t\t\tRecall')
+        print('-----------------------------------------------------')
+
+        for index, val in recall_per_cc.items():
+            print(f"{index}\t\t{round(val, 3)}")
+        if any(recall_per_cc.isna()):
+            warnings.warn('Some documents do not have Gold Standard codes, document-wise Recall not computed for them.')
+        print('\nMicro-average recall = {}\n'.format(round(recall, 3)))
+        print('\n-----------------------------------------------------')
+        print('Clinical case name\t\t\tF-score')
+        print('-----------------------------------------------------')
+
+        print('\nMicro-average F-score = {}\n'.format(round(f1_score, 3)))
+
+        macro_precision, macro_recall, macro_f1 = compute_macro_averaged_scores(df_gs, df_run)
+        print('MACRO-AVERAGE STATISTICS:')
+        print(f"Macro-average precision = {round(macro_precision, 3)}")
+        print(f"Macro-average recall = {round(macro_recall, 3)}")
+        print(f"Macro-average F-score = {round(macro_f1, 3)}")
+        print(f"Number of documents with predictions {len(set(df_run.clinical_case))}")
 
-    macro_precision, macro_recall, macro_f1 = compute_macro_averaged_scores(df_gs, df_run)
-    print('MACRO-AVERAGE STATISTICS:')
-    print(f"Macro-average precision = {round(macro_precision, 3)}")
-    print(f"Macro-average recall = {round(macro_recall, 3)}")
-    print(f"Macro-average F-score = {round(macro_f1, 3)}")
-    print(f"Number of documents with predictions {len(set(df_run.clinical_case))}")
-    
-    # clear the temporary gt tsv file
-    os.remove("gt_test.tsv")
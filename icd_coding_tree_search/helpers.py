@@ -3,6 +3,7 @@ import simple_icd_10_cm as cm
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from openai import OpenAI
 from prompt_templates import *
+from local_backend import LOCAL_MODEL_PREFIX, get_local_backend
 
 CHAPTER_LIST = cm.chapter_list
 
@@ -25,6 +26,20 @@ Spanish Medical Note:
     
     return translation_prompt.format(medical_note = medical_note)
 
+def get_template_name(model_name):
+    """
+    Map a model name to its key in `prompt_template_dict`. Local models use the Llama-2 prompt template.
+    
+    Args:
+        model_name (str): Identifier for the model.
+        
+    Returns:
+        str: The key of the prompt template.
+    """
+    if model_name.startswith(LOCAL_MODEL_PREFIX):
+        return "meta-llama/Llama-2-70b-chat-hf"
+    return model_name
+
 def build_translation_prompt(input_note, system_prompt=""):
     """
     Build a zero-shot prompt for translating spanish medical notes to english.
@@ -93,7 +108,7 @@ def construct_prompt_template(case_note, code_descriptions, model_name):
     Returns:
         str: A structured template ready to be used as input for a language model.
     """
-    template = prompt_template_dict[model_name]
+    template = prompt_template_dict[get_template_name(model_name)]
 
     return template.format(note=case_note, code_descriptions=code_descriptions)
 
@@ -109,7 +124,7 @@ def build_zero_shot_prompt(input_note, descriptions, model_name, system_prompt="
     Returns:
         list of dict: A structured list of dictionaries defining the role and content of each message.
     """
-    if model_name == "meta-llama/Llama-2-70b-chat-hf":
+    if get_template_name(model_name) == "meta-llama/Llama-2-70b-chat-hf":
         code_descriptions = "\n".join(["* " + x for x in descriptions])
     else:
         code_descriptions = "\n".join(descriptions)
@@ -130,13 +145,35 @@ def get_response(messages, model_name, temperature=0.0, max_tokens=500):
     Returns:
         str: The content of the response message from the model.
     """
+    return get_response_with_usage(messages, model_name, temperature=temperature, max_tokens=max_tokens)[0]
+
+def get_response_with_usage(messages, model_name, temperature=0.0, max_tokens=500):
+    """
+    Obtain a response and its token usage from a specified model via the chat-completions API,
+    or from a local model when the model name starts with "local:".
+    
+    Args:
+        messages (list of dict): List of messages structured for API input.
+        model_name (str): Identifier for the model to query.
+        temperature (float): Controls randomness of response, where 0 is deterministic.
+        max_tokens (int): Limit on the number of tokens in the response.
+        
+    Returns:
+        tuple: The content of the response message and a dict with the prompt and completion token counts.
+    """
+    if model_name.startswith(LOCAL_MODEL_PREFIX):
+        return get_local_backend(model_name).submit(messages, max_tokens=max_tokens).result()
+
     response = client.chat.completions.create(
         model=model_name,
         messages=messages,
         temperature=temperature,
         max_tokens=max_tokens
     )
-    return response.choices[0].message.content
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
+    if response.usage is not None:
+        usage = {"prompt_tokens": response.usage.prompt_tokens, "completion_tokens": response.usage.completion_tokens}
+    return response.choices[0].message.content, usage
 
 def remove_noisy_prefix(text):
     # Removing numbers or letters followed by a dot and optional space at the beginning of the string
@@ -160,7 +197,7 @@ def parse_outputs(output, code_description_map, model_name):
     for item in split_outputs:
         try:                
             code_description, confirmation = item.split(":", 1)
-            if model_name == "meta-llama/Llama-2-70b-chat-hf":
+            if get_template_name(model_name) == "meta-llama/Llama-2-70b-chat-hf":
                 code_description = remove_noisy_prefix(code_description)
 
             if confirmation.lower().strip().startswith("yes"):
@@ -0,0 +1,123 @@
+import math
+import re
+from collections import defaultdict
+import simple_icd_10_cm as cm
+
+STOPWORDS = {"a", "an", "and", "as", "at", "by", "for", "from", "in", "is", "of", "on", "or",
+             "the", "to", "with", "without", "other", "not", "elsewhere", "classified"}
+
+def tokenize(text):
+    """
+    Split a text into lowercase alphanumeric tokens, dropping stopwords.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list of str: The tokens of the text.
+    """
+    return [x for x in re.findall(r"[a-z0-9]+", text.lower()) if x not in STOPWORDS]
+
+def get_category(code):
+    """
+    Retrieve the 3-character category that a code belongs to.
+
+    Args:
+        code (str): The ICD-10 code.
+
+    Returns:
+        str: The category code, or the code itself if it is above the category level.
+    """
+    if cm.is_category(code) or cm.is_chapter_or_block(code):
+        return code
+    for ancestor in cm.get_ancestors(code):
+        if cm.is_category(ancestor):
+            return ancestor
+    return code
+
+class LeafCodeIndex:
+    """
+    Lexical index over the descriptions of all leaf ICD-10 codes.
+
+    Each leaf is scored against a note by the fraction of its (idf-weighted) description
+    terms that appear in the note. Leaves are then grouped by category, so that the tree
+    search can start from the most promising categories instead of the chapter list.
+    """
+    def __init__(self, codes=None):
+        if codes is None:
+            codes = [x for x in cm.get_all_codes() if cm.is_leaf(x)]
+
+        self.codes = codes
+        self.categories = [get_category(x) for x in codes]
+        self.category_index = dict(zip(self.codes, self.categories))
+        postings = defaultdict(list)
+        for idx, code in enumerate(codes):
+            for term in set(tokenize(cm.get_description(code))):
+                postings[term].append(idx)
+
+        n_docs = len(codes)
+        self.idf = {term: math.log(1 + n_docs / len(docs)) for term, docs in postings.items()}
+        self.postings = dict(postings)
+        self.norms = [0.0] * n_docs
+        for term, docs in self.postings.items():
+            for idx in docs:
+                self.norms[idx] += self.idf[term]
+
+    def match(self, medical_note):
+        """
+        Match the note against every leaf description that shares a term with it.
+
+        Args:
+            medical_note (str): The medical note to match.
+
+        Returns:
+            dict: Mapping of leaf indices to (matched idf weight, number of matched terms) tuples.
+        """
+        matched = defaultdict(lambda: [0.0, 0])
+        for term in set(tokenize(medical_note)):
+            for idx in self.postings.get(term, []):
+                matched[idx][0] += self.idf[term]
+                matched[idx][1] += 1
+        return matched
+
+    def search(self, medical_note, top_k=20, min_terms=1):
+        """
+        Rank the leaf codes by how well their descriptions are covered by the note.
+
+        Args:
+            medical_note (str): The medical note to match.
+            top_k (int): The number of leaf codes to return.
+            min_terms (int): The minimum number of description terms found in the note for a leaf to be returned.
+
+        Returns:
+            list of tuple: (code, coverage) pairs, sorted by decreasing coverage.
+        """
+        matched = [(idx, weight) for idx, (weight, n_terms) in self.match(medical_note).items() if n_terms >= min_terms]
+        ranked = sorted(matched, key=lambda x: (x[1] / self.norms[x[0]], x[1]), reverse=True)
+        return [(self.codes[idx], weight / self.norms[idx]) for idx, weight in ranked[:top_k]]
+
+    def get_candidate_subtrees(self, medical_note, top_k=5, n_leaves=200, min_terms=3):
+        """
+        Find the categories whose leaves best match the note.
+
+        Args:
+            medical_note (str): The medical note to match.
+            top_k (int): The number of categories to return.
+            n_leaves (int): The number of best-matching leaves considered when grouping by category.
+            min_terms (int): The minimum number of description terms a leaf must share with the note to count towards
+                the confidence, so that a short description matched by one or two words does not give a confidence of 1.
+
+        Returns:
+            tuple: The list of category codes and the confidence of the best match (between 0 and 1).
+        """
+        subtrees = {}
+        for code, coverage in self.search(medical_note, top_k=n_leaves):
+            category = self.category_index[code]
+            if category not in subtrees:
+                subtrees[category] = coverage
+            if len(subtrees) == top_k:
+                break
+
+        confident_matches = self.search(medical_note, top_k=1, min_terms=min_terms)
+        confidence = confident_matches[0][1] if confident_matches else 0.0
+        return list(subtrees.keys()), confidence
@@ -0,0 +1,219 @@
+"""
+Local inference backend for the tree search, selected with a model name of the form "local:<model path or hub id>".
+
+Every prompt built for a note starts with the same block (the chat-template header, the case note and the task
+instructions); only the final paragraph with the candidate code descriptions changes between expansions. The backend
+computes the KV cache of that shared prefix once per note and reuses it for all of the note's expansions. Requests
+made concurrently (e.g. by the workers of `scheduler.TreeSearchScheduler`) are collected into batches, and the
+requests of a batch which share a prefix are generated together on top of the cached prefix.
+"""
+
+import copy
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+LOCAL_MODEL_PREFIX = "local:"
+
+class LocalBackend:
+    """
+    Batched greedy generation with a transformers causal LM and note-prefix KV caching.
+
+    Args:
+        model_path (str): Path or hub identifier of the model.
+        device (str): The device to run the model on.
+        max_batch_size (int): Maximum number of requests generated in a single batch.
+        batch_wait (float): Time in seconds to wait for concurrent requests before running a batch.
+        max_cached_prefixes (int): Number of note prefixes whose KV cache is kept in memory.
+    """
+    def __init__(self, model_path, device="cpu", max_batch_size=8, batch_wait=0.01, max_cached_prefixes=8):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = AutoModelForCausalLM.from_pretrained(model_path).to(device)
+        self.model.eval()
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self.max_cached_prefixes = max_cached_prefixes
+        self.pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        self.prefix_cache = OrderedDict()
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._serve, daemon=True)
+        self.worker.start()
+
+    def render(self, messages):
+        """
+        Render the messages to text and split it into the shared prefix and the prompt-specific suffix.
+
+        The suffix is the last paragraph of the last message, i.e. the code descriptions of the tree-search prompts.
+
+        Args:
+            messages (list of dict): The chat messages.
+
+        Returns:
+            tuple: The prefix and suffix texts.
+        """
+        if self.tokenizer.chat_template:
+            text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        else:
+            text = (self.tokenizer.bos_token or "") + "\n\n".join(x["content"] for x in messages if x["content"]) + "\n\n"
+
+        last_paragraph = messages[-1]["content"].rsplit("\n\n", 1)[-1]
+        split_index = text.rfind(last_paragraph) if last_paragraph else -1
+        if split_index <= 0:
+            # No shared paragraph structure: keep only the last character out of the cached prefix.
+            split_index = len(text) - 1
+        return text[:split_index], text[split_index:]
+
+    def tokenize(self, messages):
+        """
+        Tokenize a chat prompt and split its tokens into the shared prefix and the prompt-specific suffix.
+
+        The full prompt is tokenized at once, so that the model sees the same tokens as without the cache, and split
+        where its tokens stop matching the tokens of the prefix text. The last token of the prefix is left to the suffix,
+        since it may merge with the start of the suffix, and the prefix of a note would then differ between prompts.
+
+        Args:
+            messages (list of dict): The chat messages.
+
+        Returns:
+            tuple: The tuple of prefix token ids and the list of suffix token ids.
+        """
+        prefix, suffix = self.render(messages)
+        full_ids = self.tokenizer(prefix + suffix, add_special_tokens=False).input_ids
+        prefix_ids = self.tokenizer(prefix, add_special_tokens=False).input_ids
+        split_index = 0
+        while split_index < min(len(prefix_ids) - 1, len(full_ids) - 1) and full_ids[split_index] == prefix_ids[split_index]:
+            split_index += 1
+        # Any split of the full tokens gives the same output; the cache only needs a non-empty prefix.
+        split_index = max(split_index, min(1, len(full_ids) - 1))
+        return tuple(full_ids[:split_index]), full_ids[split_index:]
+
+    def _get_prefix(self, prefix):
+        if prefix in self.prefix_cache:
+            self.prefix_cache.move_to_end(prefix)
+            return self.prefix_cache[prefix]
+
+        prefix_ids = torch.tensor([prefix], dtype=torch.long, device=self.device)
+        with torch.no_grad():
+            past_key_values = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+        self.prefix_cache[prefix] = (prefix_ids, past_key_values)
+        if len(self.prefix_cache) > self.max_cached_prefixes:
+            self.prefix_cache.popitem(last=False)
+        return prefix_ids, past_key_values
+
+    def _generate_group(self, prefix, suffixes, max_tokens):
+        """Generate the completions of several prompts sharing the same prefix tokens in one batch."""
+        prefix_ids, prefix_past = self._get_prefix(prefix)
+        suffix_ids = [torch.tensor(x, dtype=torch.long, device=self.device) for x in suffixes]
+
+        batch_size = len(suffixes)
+        suffix_length = max(len(x) for x in suffix_ids)
+        # Left-pad the suffixes, so that the padding sits between the prefix and the suffix and is masked out.
+        padded = torch.full((batch_size, suffix_length), self.pad_token_id, dtype=torch.long, device=self.device)
+        suffix_mask = torch.zeros((batch_size, suffix_length), dtype=torch.long, device=self.device)
+        for i, ids in enumerate(suffix_ids):
+            padded[i, -len(ids):] = ids
+            suffix_mask[i, -len(ids):] = 1
+
+        input_ids = torch.cat([prefix_ids.expand(batch_size, -1), padded], dim=1)
+        attention_mask = torch.cat([torch.ones_like(prefix_ids).expand(batch_size, -1), suffix_mask], dim=1)
+
+        past_key_values = copy.deepcopy(prefix_past)
+        past_key_values.batch_repeat_interleave(batch_size)
+
+        with torch.no_grad():
+            output = self.model.generate(input_ids=input_ids, attention_mask=attention_mask, past_key_values=past_key_values,
+                                         max_new_tokens=max_tokens, do_sample=False, pad_token_id=self.pad_token_id)
+
+        results = []
+        for i, ids in enumerate(suffix_ids):
+            completion = output[i, input_ids.shape[1]:].tolist()
+            if self.tokenizer.eos_token_id in completion:
+                completion = completion[:completion.index(self.tokenizer.eos_token_id) + 1]
+            text = self.tokenizer.decode(completion, skip_special_tokens=True)
+            results.append((text, {"prompt_tokens": prefix_ids.shape[1] + len(ids), "completion_tokens": len(completion)}))
+        return results
+
+    def generate(self, messages_list, max_tokens=500):
+        """
+        Generate the completions of several chat prompts, grouping the prompts which share a prefix.
+
+        Args:
+            messages_list (list of list of dict): The chat prompts.
+            max_tokens (int): Limit on the number of generated tokens per prompt.
+
+        Returns:
+            list of tuple: The completion text and the token usage of each prompt, in input order.
+        """
+        groups = OrderedDict()
+        for idx, messages in enumerate(messages_list):
+            prefix, suffix = self.tokenize(messages)
+            groups.setdefault(prefix, []).append((idx, suffix))
+
+        results = [None] * len(messages_list)
+        for prefix, items in groups.items():
+            for start in range(0, len(items), self.max_batch_size):
+                chunk = items[start:start + self.max_batch_size]
+                outputs = self._generate_group(prefix, [x[1] for x in chunk], max_tokens)
+                for (idx, _), output in zip(chunk, outputs):
+                    results[idx] = output
+        return results
+
+    def submit(self, messages, max_tokens=500):
+        """
+        Queue a single chat prompt; concurrent submissions are generated together.
+
+        Args:
+            messages (list of dict): The chat prompt.
+            max_tokens (int): Limit on the number of generated tokens.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the completion text and the token usage.
+        """
+        future = Future()
+        self.requests.put((messages, max_tokens, future))
+        return future
+
+    def _serve(self):
+        while True:
+            batch = [self.requests.get()]
+            try:
+                while len(batch) < self.max_batch_size:
+                    batch.append(self.requests.get(timeout=self.batch_wait))
+            except queue.Empty:
+                pass
+
+            # Requests with different generation limits are run separately.
+            by_max_tokens = OrderedDict()
+            for item in batch:
+                by_max_tokens.setdefault(item[1], []).append(item)
+            for max_tokens, items in by_max_tokens.items():
+                try:
+                    outputs = self.generate([x[0] for x in items], max_tokens=max_tokens)
+                    for (_, _, future), output in zip(items, outputs):
+                        future.set_result(output)
+                except Exception as e:
+                    for _, _, future in items:
+                        future.set_exception(e)
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_local_backend(model_name, **kwargs):
+    """
+    Return the backend for a "local:<model path>" model name, loading the model on first use.
+
+    Args:
+        model_name (str): The model name, starting with LOCAL_MODEL_PREFIX.
+        **kwargs: Arguments passed to `LocalBackend` when the model is loaded.
+
+    Returns:
+        LocalBackend: The shared backend of the model.
+    """
+    with _backends_lock:
+        if model_name not in _backends:
+            _backends[model_name] = LocalBackend(model_name[len(LOCAL_MODEL_PREFIX):], **kwargs)
+        return _backends[model_name]
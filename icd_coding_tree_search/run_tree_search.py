@@ -2,10 +2,13 @@ import argparse
 import os
 import json
 from tree_search_icd import get_icd_codes
+from leaf_index import LeafCodeIndex
+from search_trace import SearchTrace, append_trace
 from tqdm import tqdm
 
-def process_medical_notes(input_dir, output_file, model_name):
+def process_medical_notes(input_dir, output_file, model_name, retrieval_top_k=0, min_confidence=0.5, trace_file=None, recall_guard=True):
     code_map = {}
+    leaf_index = LeafCodeIndex() if retrieval_top_k > 0 else None
     # Ensure the input directory is valid
     if not os.path.isdir(input_dir):
         raise ValueError("The specified input directory does not exist.")
@@ -16,7 +19,11 @@ def process_medical_notes(input_dir, output_file, model_name):
         with open(file_path, "r", encoding="utf-8") as file:
             medical_note = file.read()
         
-        icd_codes = get_icd_codes(medical_note, model_name)
+        trace = SearchTrace(files) if trace_file else None
+        icd_codes = get_icd_codes(medical_note, model_name, leaf_index=leaf_index, top_k=retrieval_top_k, min_confidence=min_confidence,
+                                  recall_guard=recall_guard, trace=trace)
+        if trace is not None:
+            append_trace(trace_file, trace)
         code_map[files] = icd_codes
 
     # Save the ICD codes to a JSON file
@@ -28,6 +35,11 @@ if __name__ == "__main__":
     parser.add_argument("--input_dir", help="Directory containing the medical text files")
     parser.add_argument("--output_file", help="File to save the extracted ICD codes in JSON format")
     parser.add_argument("--model_name", default="gpt-3.5-turbo-0613", help="Model name to use for ICD code extraction")
+    parser.add_argument("--retrieval_top_k", type=int, default=0, help="Start the search from the top-k retrieved categories (0 disables the shortcut)")
+    parser.add_argument("--min_confidence", type=float, default=0.5, help="Minimum retrieval confidence for using the shortcut search")
+    parser.add_argument("--no_recall_guard", action="store_true", help="After a successful shortcut, do not walk the chapters outside the retrieved categories")
+    parser.add_argument("--trace_file", default=None, help="Optional JSONL file to append the per-note search traces to")
 
     args = parser.parse_args()
-    process_medical_notes(args.input_dir, args.output_file, args.model_name)
+    process_medical_notes(args.input_dir, args.output_file, args.model_name, args.retrieval_top_k, args.min_confidence, args.trace_file,
+                         recall_guard=not args.no_recall_guard)
@@ -0,0 +1,192 @@
+"""
+Corpus-level scheduler for the LLM-guided tree search.
+
+Instead of giving each note its own fixed number of prompts, all pending (note, parent code) expansions of the
+corpus are kept in a single priority queue and dispatched to a pool of workers until a global prompt or token
+budget is used up. Notes which still had pending expansions at that point are reported as cut short.
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tree_search_icd import query_candidate_codes, CHAPTER_LIST, cm
+
+def depth_score(expansion, note_state):
+    """Favour the deepest expansions, i.e. the ones closest to the leaves."""
+    return expansion["depth"]
+
+def breadth_score(expansion, note_state):
+    """Favour the shallowest expansions, i.e. explore every note level by level."""
+    return -expansion["depth"]
+
+def fair_score(expansion, note_state):
+    """Favour the notes which have used the fewest prompts so far."""
+    return -note_state["prompts"]
+
+SCORE_FUNCTIONS = {"depth": depth_score, "breadth": breadth_score, "fair": fair_score}
+
+class TreeSearchScheduler:
+    """
+    Schedules the tree-search expansions of a corpus of notes under a global budget.
+
+    Args:
+        model_name (str): The identifier for the language model used in the API.
+        score (str or callable): Name of a function in SCORE_FUNCTIONS, or a function taking the expansion and the
+            state of its note and returning a score. Expansions with the highest score are dispatched first.
+        max_prompts (int): Global budget of prompts for the corpus (None for no limit).
+        max_tokens (int): Global budget of prompt and completion tokens for the corpus (None for no limit). The tokens of
+            a prompt are only known once it returns, so every prompt in flight reserves the average number of tokens
+            of the prompts completed so far; the budget can still be exceeded by the difference between that average
+            and the actual usage of the last `num_workers` prompts.
+        max_prompts_per_note (int): Limit of prompts for a single note (None for no limit).
+        num_workers (int): Number of prompts in flight at the same time.
+        temperature (float): Controls randomness of the responses.
+    """
+    def __init__(self, model_name="gpt-3.5-turbo-0613", score="depth", max_prompts=None, max_tokens=None,
+                 max_prompts_per_note=50, num_workers=8, temperature=0.0):
+        self.model_name = model_name
+        self.score_fn = SCORE_FUNCTIONS[score] if isinstance(score, str) else score
+        self.max_prompts = max_prompts
+        self.max_tokens = max_tokens
+        self.max_prompts_per_note = max_prompts_per_note
+        self.num_workers = num_workers
+        self.temperature = temperature
+
+    def _budget_left(self, prompts_used, tokens_used, n_in_flight, failed_prompts=0):
+        if self.max_prompts is not None and prompts_used + n_in_flight >= self.max_prompts:
+            return False
+        if self.max_tokens is not None:
+            tokens_per_prompt = tokens_used / (prompts_used - failed_prompts) if prompts_used > failed_prompts else 0
+            if tokens_used + (n_in_flight + 1) * tokens_per_prompt > self.max_tokens or tokens_used >= self.max_tokens:
+                return False
+        return True
+
+    def run(self, notes):
+        """
+        Runs the tree search over a corpus of notes.
+
+        Args:
+            notes (dict): Mapping of note identifiers to medical notes.
+
+        Returns:
+            dict: A dictionary with the keys
+                - "codes": mapping of note identifiers to their confirmed leaf ICD-10 codes.
+                - "cut_short": mapping of the notes whose search was stopped by a budget to their number of
+                  expansions left unexplored.
+                - "errors": mapping of the notes for which some requests failed to the list of error messages. The
+                  subtrees of a failed expansion are not explored, and the other expansions of the note go on.
+                - "prompts_used" and "tokens_used": the total budget spent on the corpus. Failed requests count as used
+                  prompts, and are also counted in "failed_prompts".
+        """
+        counter = itertools.count()
+        queue = []
+        note_states = {note_id: {"prompts": 0, "tokens": 0, "codes": [], "errors": []} for note_id in notes}
+
+        def push(expansion):
+            score = self.score_fn(expansion, note_states[expansion["note_id"]])
+            heapq.heappush(queue, (-score, next(counter), expansion))
+
+        for note_id in notes:
+            push({"note_id": note_id, "candidate_codes": [x.name for x in CHAPTER_LIST], "depth": 0, "parent_code": None})
+
+        prompts_used, tokens_used, failed_prompts = 0, 0, 0
+        skipped = {}
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            while queue or in_flight:
+                while queue and len(in_flight) < self.num_workers and self._budget_left(prompts_used, tokens_used, len(in_flight), failed_prompts):
+                    priority, _, expansion = heapq.heappop(queue)
+                    note_state = note_states[expansion["note_id"]]
+                    # Scores which depend on the state of the note (e.g. "fair") may have changed since the expansion was
+                    # pushed; an expansion whose score dropped is pushed back with its current score.
+                    current = -self.score_fn(expansion, note_state)
+                    if current > priority:
+                        heapq.heappush(queue, (current, next(counter), expansion))
+                        continue
+                    if self.max_prompts_per_note is not None and note_state["prompts"] >= self.max_prompts_per_note:
+                        skipped[expansion["note_id"]] = skipped.get(expansion["note_id"], 0) + 1
+                        continue
+                    # Count the prompt as soon as it is dispatched so that per-note limits hold with concurrent workers.
+                    note_state["prompts"] += 1
+                    future = executor.submit(query_candidate_codes, notes[expansion["note_id"]], expansion["candidate_codes"],
+                                             self.model_name, self.temperature)
+                    in_flight[future] = expansion
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    expansion = in_flight.pop(future)
+                    note_state = note_states[expansion["note_id"]]
+                    # A failed request may still have reached the API, so it counts against the prompt budget.
+                    prompts_used += 1
+                    try:
+                        predicted_codes, usage = future.result()
+                    except Exception as e:
+                        note_state["errors"].append(f"{expansion['parent_code'] or 'ROOT'}: {e}")
+                        failed_prompts += 1
+                        continue
+                    tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+                    tokens_used += tokens
+                    note_state["tokens"] += tokens
+
+                    for code in predicted_codes:
+                        if cm.is_leaf(code["code"]):
+                            note_state["codes"].append(code["code"])
+                        else:
+                            push({"note_id": expansion["note_id"], "candidate_codes": cm.get_children(code["code"]),
+                                  "depth": expansion["depth"] + 1, "parent_code": code["code"]})
+
+        cut_short = {}
+        for _, _, expansion in queue:
+            cut_short[expansion["note_id"]] = cut_short.get(expansion["note_id"], 0) + 1
+        for note_id, count in skipped.items():
+            cut_short[note_id] = cut_short.get(note_id, 0) + count
+
+        return {"codes": {note_id: state["codes"] for note_id, state in note_states.items()},
+                "cut_short": cut_short,
+                "errors": {note_id: state["errors"] for note_id, state in note_states.items() if state["errors"]},
+                "prompts_used": prompts_used,
+                "failed_prompts": failed_prompts,
+                "tokens_used": tokens_used}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the tree search over a corpus of notes under a global prompt or token budget.")
+    parser.add_argument("--input_dir", help="Directory containing the medical text files")
+    parser.add_argument("--output_file", help="File to save the extracted ICD codes in JSON format")
+    parser.add_argument("--model_name", default="gpt-3.5-turbo-0613", help="Model name to use for ICD code extraction")
+    parser.add_argument("--score", default="depth", choices=list(SCORE_FUNCTIONS), help="Order in which the pending expansions are dispatched")
+    parser.add_argument("--max_prompts", type=int, default=None, help="Global prompt budget for the corpus")
+    parser.add_argument("--max_tokens", type=int, default=None, help="Global token budget for the corpus")
+    parser.add_argument("--max_prompts_per_note", type=int, default=50, help="Prompt limit for a single note")
+    parser.add_argument("--num_workers", type=int, default=8, help="Number of concurrent requests")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        raise ValueError("The specified input directory does not exist.")
+
+    notes = {}
+    for files in os.listdir(args.input_dir):
+        with open(os.path.join(args.input_dir, files), "r", encoding="utf-8") as file:
+            notes[files] = file.read()
+
+    scheduler = TreeSearchScheduler(args.model_name, score=args.score, max_prompts=args.max_prompts, max_tokens=args.max_tokens,
+                                    max_prompts_per_note=args.max_prompts_per_note, num_workers=args.num_workers)
+    result = scheduler.run(notes)
+
+    with open(args.output_file, "w") as f:
+        json.dump(result["codes"], f, indent=4)
+
+    print(f"Prompts used: {result['prompts_used']} ({result['failed_prompts']} failed), tokens used: {result['tokens_used']}")
+    print(f"{len(result['cut_short'])} notes were cut short by the budget:")
+    for note_id, count in sorted(result["cut_short"].items()):
+        print(f"{note_id}\t{count} pending expansions")
+    if result["errors"]:
+        print(f"{len(result['errors'])} notes had failed requests:")
+        for note_id, errors in sorted(result["errors"].items()):
+            print(f"{note_id}\t{len(errors)} failed expansions")
@@ -0,0 +1,147 @@
+"""
+Opt-in tracing of the tree search: records every expansion made for a note (the parent code whose children were
+presented to the model, the number of candidates, token usage, latency and confirmed codes), writes the traces to
+a JSONL file and summarizes them.
+"""
+
+import argparse
+import json
+import statistics
+from collections import Counter, defaultdict
+import simple_icd_10_cm as cm
+
+# Labels of the first prompt of a walk: the chapter list, or the categories retrieved by the leaf-code index.
+ROOT = "ROOT"
+SHORTCUT_ROOT = "ROOT:shortcut"
+
+class SearchTrace:
+    """
+    Collects the expansions of the tree search for a single note.
+
+    Args:
+        note_id (str): Identifier of the note (e.g. its file name).
+    """
+    def __init__(self, note_id):
+        self.note_id = note_id
+        self.expansions = []
+
+    def record(self, parent_code, candidate_codes, usage, latency, confirmed_codes, root=ROOT):
+        """
+        Records a single expansion.
+
+        Args:
+            parent_code (str): The code whose children were presented to the model, or None for the starting codes.
+            candidate_codes (list of str): The codes presented to the model.
+            usage (dict): The prompt and completion token counts of the response.
+            latency (float): The response time in seconds.
+            confirmed_codes (list of str): The codes confirmed by the model.
+            root (str): The label of the walk the expansion belongs to (ROOT or SHORTCUT_ROOT).
+        """
+        self.expansions.append({"parent_code": parent_code or root,
+                                "root": root,
+                                "n_candidates": len(candidate_codes),
+                                "prompt_tokens": usage["prompt_tokens"],
+                                "completion_tokens": usage["completion_tokens"],
+                                "latency": latency,
+                                "confirmed_codes": confirmed_codes})
+
+    def to_dict(self):
+        return {"note_id": self.note_id,
+                "n_prompts": len(self.expansions),
+                "prompt_tokens": sum(x["prompt_tokens"] for x in self.expansions),
+                "completion_tokens": sum(x["completion_tokens"] for x in self.expansions),
+                "latency": sum(x["latency"] for x in self.expansions),
+                "expansions": self.expansions}
+
+def append_trace(file_path, trace):
+    """
+    Append the trace of a note to a JSON Lines file.
+
+    Args:
+        file_path (str): The path to the JSONL file.
+        trace (SearchTrace): The trace to write.
+    """
+    with open(file_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(trace.to_dict()) + "\n")
+
+def read_traces(file_path):
+    """
+    Read the traces written by `append_trace`.
+
+    Args:
+        file_path (str): The path to the JSONL file.
+
+    Returns:
+        list of dict: The traces of the notes.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize_traces(traces, top_n=10):
+    """
+    Summarize a set of traces.
+
+    Args:
+        traces (list of dict): The traces, as returned by `read_traces`.
+        top_n (int): The number of notes and subtrees to report.
+
+    Returns:
+        dict: A dictionary with the keys
+            - "slowest_notes": the notes with the highest total latency.
+            - "most_expensive_subtrees": the codes with the highest total token usage over all notes, counting the
+              expansions of every code below them. The root labels count all the expansions of their walk.
+            - "prompts_per_note": statistics and a histogram of the number of prompts per note.
+    """
+    slowest_notes = sorted(traces, key=lambda x: x["latency"], reverse=True)[:top_n]
+
+    subtrees = defaultdict(lambda: {"prompts": 0, "tokens": 0, "latency": 0.0})
+    for trace in traces:
+        for expansion in trace["expansions"]:
+            root = expansion.get("root", ROOT)
+            parent_code = expansion["parent_code"]
+            codes = {root}
+            if parent_code != root:
+                codes.add(parent_code)
+                if cm.is_valid_item(parent_code):
+                    codes.update(cm.get_ancestors(parent_code))
+            for code in codes:
+                subtree = subtrees[code]
+                subtree["prompts"] += 1
+                subtree["tokens"] += expansion["prompt_tokens"] + expansion["completion_tokens"]
+                subtree["latency"] += expansion["latency"]
+    most_expensive = sorted(subtrees.items(), key=lambda x: x[1]["tokens"], reverse=True)[:top_n]
+
+    prompt_counts = sorted(x["n_prompts"] for x in traces)
+    distribution = {}
+    if prompt_counts:
+        distribution = {"min": prompt_counts[0],
+                        "median": statistics.median(prompt_counts),
+                        "mean": statistics.mean(prompt_counts),
+                        "p90": prompt_counts[int(0.9 * (len(prompt_counts) - 1))],
+                        "max": prompt_counts[-1],
+                        "histogram": dict(sorted(Counter(prompt_counts).items()))}
+
+    return {"slowest_notes": [{k: x[k] for k in ("note_id", "n_prompts", "prompt_tokens", "completion_tokens", "latency")} for x in slowest_notes],
+            "most_expensive_subtrees": [dict(parent_code=code, **stats) for code, stats in most_expensive],
+            "prompts_per_note": distribution}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the tree-search traces of a run.")
+    parser.add_argument("--trace_file", help="JSONL file with the traces written by run_tree_search.py")
+    parser.add_argument("--top_n", type=int, default=10, help="Number of notes and subtrees to report")
+    args = parser.parse_args()
+
+    summary = summarize_traces(read_traces(args.trace_file), top_n=args.top_n)
+
+    print("Slowest notes:")
+    for item in summary["slowest_notes"]:
+        print(f"{item['note_id']}\t{item['latency']:.2f}s\t{item['n_prompts']} prompts\t{item['prompt_tokens'] + item['completion_tokens']} tokens")
+    print("\nMost expensive subtrees:")
+    for item in summary["most_expensive_subtrees"]:
+        print(f"{item['parent_code']}\t{item['tokens']} tokens\t{item['prompts']} prompts\t{item['latency']:.2f}s")
+    print("\nPrompts per note:")
+    distribution = dict(summary["prompts_per_note"])
+    histogram = distribution.pop("histogram", {})
+    print(", ".join(f"{key} = {value:.1f}" if isinstance(value, float) else f"{key} = {value}" for key, value in distribution.items()))
+    for n_prompts, count in histogram.items():
+        print(f"{n_prompts:3d} prompts\t{count} notes")
@@ -0,0 +1,172 @@
+"""
+Bootstrap confidence intervals and paired bootstrap significance tests for the ICD coding metrics.
+
+The per-case true-positive, predicted and gold counts are computed once as arrays (and as sparse case x code matrices
+for the macro-averaged scores). A block of resamples is then a matrix of case weights, so the metrics of thousands of
+resamples are obtained with a few matrix products instead of re-running `calculate_metrics` on resampled dataframes.
+"""
+
+import argparse
+import json
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from evaluate_performance import get_leaf_codes, load_gold_standard, predictions_to_frame
+
+def build_counts(df_gs: pd.DataFrame, df_run: pd.DataFrame, cases: list, codes: list) -> dict:
+    """
+    Precompute the per-case counts of a run that the micro- and macro-averaged scores are derived from.
+
+    The counts follow `calculate_metrics` (unique case/code pairs) for the micro-averaged scores and
+    `compute_macro_averaged_scores` (rows, including duplicates) for the macro-averaged scores.
+
+    Args:
+        df_gs (pd.DataFrame): The gold-standard.
+        df_run (pd.DataFrame): The predictions.
+        cases (list): The clinical cases to resample.
+        codes (list): The codes of the gold-standard.
+
+    Returns:
+        dict: Arrays of shape (n_cases,) with the keys "tp", "pred" and "true", and sparse matrices of shape
+            (n_cases, n_codes) with the keys "code_tp", "code_pred" and "code_true".
+    """
+    case_index = pd.Index(cases)
+    code_index = pd.Index(codes)
+    gs_pairs = df_gs[['clinical_case', 'code']].drop_duplicates()
+    run_pairs = df_run[['clinical_case', 'code']].drop_duplicates()
+    tp_pairs = gs_pairs.merge(run_pairs, on=['clinical_case', 'code'], how='inner')
+
+    def per_case(pairs):
+        return np.bincount(case_index.get_indexer(pairs.clinical_case), minlength=len(cases)).astype(float)
+
+    def per_case_and_code(pairs):
+        pairs = pairs[pairs.code.isin(code_index)]
+        rows, cols = case_index.get_indexer(pairs.clinical_case), code_index.get_indexer(pairs.code)
+        return sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(cases), len(codes)))
+
+    return {"tp": per_case(tp_pairs), "pred": per_case(run_pairs), "true": per_case(gs_pairs),
+            "code_tp": per_case_and_code(tp_pairs), "code_pred": per_case_and_code(df_run), "code_true": per_case_and_code(df_gs)}
+
+def scores_from_weights(counts: dict, weights: np.ndarray) -> dict:
+    """
+    Compute the micro- and macro-averaged scores of a run for a block of resamples.
+
+    Args:
+        counts (dict): The counts returned by `build_counts`.
+        weights (np.ndarray): Matrix of shape (n_resamples, n_cases) with the number of times each case is drawn.
+
+    Returns:
+        dict: Arrays of shape (n_resamples,) for each micro- and macro-averaged score.
+    """
+    tp, pred, true = weights @ counts["tp"], weights @ counts["pred"], weights @ counts["true"]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = tp / pred
+        recall = tp / true
+        f1_score = (2 * precision * recall) / (precision + recall + 1e-10)
+
+        code_tp = np.asarray((counts["code_tp"].T @ weights.T).T)
+        code_pred = np.asarray((counts["code_pred"].T @ weights.T).T)
+        code_true = np.asarray((counts["code_true"].T @ weights.T).T)
+        # Only the codes present in the resampled gold-standard are averaged over.
+        present = code_true > 0
+        code_precision = np.where(code_tp > 0, code_tp / code_pred, 0.0)
+        code_recall = np.where(present, code_tp / code_true, 0.0)
+        code_f1 = np.where((code_precision > 0) & (code_recall > 0), 2 * code_precision * code_recall / (code_precision + code_recall), 0.0)
+        n_present = present.sum(axis=1)
+        macro_precision = (code_precision * present).sum(axis=1) / n_present
+        macro_recall = code_recall.sum(axis=1) / n_present
+        macro_f1 = (code_f1 * present).sum(axis=1) / n_present
+
+    return {"micro_precision": precision, "micro_recall": recall, "micro_f1": f1_score,
+            "macro_precision": macro_precision, "macro_recall": macro_recall, "macro_f1": macro_f1}
+
+def resample_scores(df_gs: pd.DataFrame, runs: list, n_resamples=1000, seed=0, block_size=250):
+    """
+    Compute the scores of one or more runs on the same bootstrap resamples of the clinical cases.
+
+    Args:
+        df_gs (pd.DataFrame): The gold-standard.
+        runs (list of pd.DataFrame): The predictions of each run.
+        n_resamples (int): The number of bootstrap resamples.
+        seed (int): The random seed.
+        block_size (int): The number of resamples computed at once, which bounds the memory used.
+
+    Returns:
+        tuple: For each run, the dict of scores on the full data and the dict of arrays of scores on the resamples.
+    """
+    cases = sorted(set(df_gs.clinical_case).union(*[set(x.clinical_case) for x in runs]))
+    codes = sorted(set(df_gs.code))
+    all_counts = [build_counts(df_gs, run, cases, codes) for run in runs]
+    rng = np.random.default_rng(seed)
+    uniform = np.full(len(cases), 1 / len(cases))
+
+    resampled = [{} for _ in runs]
+    for start in range(0, n_resamples, block_size):
+        weights = rng.multinomial(len(cases), uniform, size=min(block_size, n_resamples - start)).astype(float)
+        for counts, scores in zip(all_counts, resampled):
+            for key, values in scores_from_weights(counts, weights).items():
+                scores.setdefault(key, []).append(values)
+
+    full_weights = np.ones((1, len(cases)))
+    results = []
+    for counts, scores in zip(all_counts, resampled):
+        point = {key: values[0] for key, values in scores_from_weights(counts, full_weights).items()}
+        results.append((point, {key: np.concatenate(values) for key, values in scores.items()}))
+    return results
+
+def bootstrap_confidence_intervals(df_gs: pd.DataFrame, df_run: pd.DataFrame, n_resamples=1000, alpha=0.05, seed=0) -> pd.DataFrame:
+    """
+    Compute percentile bootstrap confidence intervals of the micro- and macro-averaged scores of a run.
+
+    Returns:
+        pd.DataFrame: The score on the full data and the lower and upper bounds of the interval of each metric.
+    """
+    (point, resampled), = resample_scores(df_gs, [df_run], n_resamples=n_resamples, seed=seed)
+    rows = {key: {"score": point[key],
+                  "ci_low": np.nanquantile(values, alpha / 2),
+                  "ci_high": np.nanquantile(values, 1 - alpha / 2)} for key, values in resampled.items()}
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+def paired_bootstrap_test(df_gs: pd.DataFrame, df_run_a: pd.DataFrame, df_run_b: pd.DataFrame, n_resamples=1000, alpha=0.05, seed=0) -> pd.DataFrame:
+    """
+    Paired bootstrap test of the difference between the scores of two runs (run A - run B).
+
+    Both runs are scored on the same resamples. The two-sided p-value is the fraction of resamples whose difference
+    deviates from the observed difference by at least the observed difference (i.e. the bootstrap distribution
+    shifted to the null hypothesis of no difference).
+
+    Returns:
+        pd.DataFrame: The scores of both runs, the observed difference, its confidence interval and the p-value of each metric.
+    """
+    (point_a, resampled_a), (point_b, resampled_b) = resample_scores(df_gs, [df_run_a, df_run_b], n_resamples=n_resamples, seed=seed)
+    rows = {}
+    for key in point_a:
+        delta = point_a[key] - point_b[key]
+        deltas = resampled_a[key] - resampled_b[key]
+        deltas = deltas[~np.isnan(deltas)]
+        extreme = np.sum(np.abs(deltas - delta) >= abs(delta))
+        rows[key] = {"score_a": point_a[key], "score_b": point_b[key], "delta": delta,
+                     "ci_low": np.quantile(deltas, alpha / 2), "ci_high": np.quantile(deltas, 1 - alpha / 2),
+                     "p_value": (extreme + 1) / (len(deltas) + 1)}
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals and paired significance test for ICD coding predictions.")
+    parser.add_argument("--input_json", help="JSON file with predictions")
+    parser.add_argument("--compare_json", default=None, help="Optional second JSON file with predictions, compared to the first with a paired test")
+    parser.add_argument("--gold_standard_tsv", help="Gold standard TSV file")
+    parser.add_argument("--n_resamples", type=int, default=1000, help="Number of bootstrap resamples")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Confidence intervals cover 1 - alpha")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    valid_codes = get_leaf_codes()
+    df_gs = load_gold_standard(args.gold_standard_tsv, valid_codes)
+    df_run = predictions_to_frame(json.loads(open(args.input_json).read()), valid_codes)
+
+    if args.compare_json:
+        df_run_b = predictions_to_frame(json.loads(open(args.compare_json).read()), valid_codes)
+        table = paired_bootstrap_test(df_gs, df_run, df_run_b, n_resamples=args.n_resamples, alpha=args.alpha, seed=args.seed)
+    else:
+        table = bootstrap_confidence_intervals(df_gs, df_run, n_resamples=args.n_resamples, alpha=args.alpha, seed=args.seed)
+    print(table.round(4).to_string())
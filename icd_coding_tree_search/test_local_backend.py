@@ -0,0 +1,70 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from local_backend import LocalBackend
+
+NOTE = "The patient is a 54 year old man with type 2 diabetes and chronic kidney disease, admitted for chest pain."
+CANDIDATES = ["E11.22 Type 2 diabetes mellitus with diabetic chronic kidney disease",
+              "I20.9 Angina pectoris, unspecified",
+              "N18.3 Chronic kidney disease, stage 3 (moderate)",
+              "I10 Essential (primary) hypertension; R07.9 Chest pain, unspecified; Z79.4 Long term (current) use of insulin"]
+
+def build_messages(candidates):
+    return [{"role": "system", "content": "You are a medical coder."},
+            {"role": "user", "content": f"Case note:\n{NOTE}\n\nWhich of the following codes are mentioned?\n\n" + "\n".join(candidates)}]
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    torch.manual_seed(0)
+    path = tmp_path_factory.mktemp("tiny_llama")
+    bpe = tokenizers.Tokenizer(tokenizers.models.BPE(unk_token="<unk>"))
+    bpe.pre_tokenizer = tokenizers.pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = tokenizers.decoders.ByteLevel()
+    trainer = tokenizers.trainers.BpeTrainer(vocab_size=300, special_tokens=["<unk>", "<s>", "</s>"],
+                                             initial_alphabet=tokenizers.pre_tokenizers.ByteLevel.alphabet())
+    bpe.train_from_iterator([NOTE] + CANDIDATES + [x["content"] for x in build_messages(CANDIDATES)], trainer)
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=bpe, bos_token="<s>", eos_token="</s>", unk_token="<unk>")
+    tokenizer.save_pretrained(path)
+
+    config = transformers.LlamaConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                                      num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512,
+                                      bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id)
+    transformers.LlamaForCausalLM(config).save_pretrained(path)
+    return str(path)
+
+def plain_generate(backend, messages, max_tokens):
+    prefix, suffix = backend.render(messages)
+    input_ids = backend.tokenizer(prefix + suffix, add_special_tokens=False, return_tensors="pt").input_ids
+    with torch.no_grad():
+        output = backend.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=max_tokens,
+                                        do_sample=False, pad_token_id=backend.pad_token_id)
+    completion = output[0, input_ids.shape[1]:].tolist()
+    if backend.tokenizer.eos_token_id in completion:
+        completion = completion[:completion.index(backend.tokenizer.eos_token_id) + 1]
+    return backend.tokenizer.decode(completion, skip_special_tokens=True), input_ids.shape[1]
+
+def test_batched_prefix_cached_generation_matches_generate(model_path):
+    backend = LocalBackend(model_path, max_batch_size=4)
+    # Suffixes of different lengths, so that the batch is padded between the prefix and the suffixes.
+    messages_list = [build_messages(CANDIDATES[:n]) for n in (1, 4, 2, 3)]
+
+    results = backend.generate(messages_list, max_tokens=12)
+
+    assert len(backend.prefix_cache) == 1
+    for messages, (text, usage) in zip(messages_list, results):
+        expected_text, prompt_tokens = plain_generate(backend, messages, 12)
+        assert text == expected_text
+        assert usage["prompt_tokens"] == prompt_tokens
+
+def test_prefix_and_suffix_tokens_are_the_full_prompt_tokens(model_path):
+    backend = LocalBackend(model_path)
+    messages = build_messages(CANDIDATES)
+    prefix, suffix = backend.render(messages)
+
+    prefix_ids, suffix_ids = backend.tokenize(messages)
+
+    assert list(prefix_ids) + suffix_ids == backend.tokenizer(prefix + suffix, add_special_tokens=False).input_ids
+    assert prefix_ids and suffix_ids
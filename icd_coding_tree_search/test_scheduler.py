@@ -0,0 +1,49 @@
+import os
+
+import pytest
+import simple_icd_10_cm as cm
+
+if not hasattr(cm, "chapter_list"):
+    pytest.skip("tree_search_icd needs a simple_icd_10_cm version with chapter_list", allow_module_level=True)
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import scheduler
+from scheduler import TreeSearchScheduler
+
+def first_candidate(medical_note, candidate_codes, model_name=None, temperature=0.0):
+    """Confirms the first candidate code of every prompt, and fails on the notes starting with "fail"."""
+    if medical_note.startswith("fail") and len(candidate_codes) < 10:
+        raise RuntimeError("server error")
+    return [{"code": candidate_codes[0]}], {"prompt_tokens": 10, "completion_tokens": 5}
+
+def test_failed_expansions_are_recorded_and_count_against_the_budget(monkeypatch):
+    monkeypatch.setattr(scheduler, "query_candidate_codes", first_candidate)
+
+    result = TreeSearchScheduler(num_workers=2).run({"a": "note", "b": "fail"})
+
+    assert result["codes"]["a"] and result["codes"]["b"] == []
+    assert len(result["errors"]["b"]) == 1 and "a" not in result["errors"]
+    assert result["failed_prompts"] == 1
+    assert result["prompts_used"] == result["tokens_used"] // 15 + 1
+
+def test_max_prompts_includes_failed_prompts(monkeypatch):
+    monkeypatch.setattr(scheduler, "query_candidate_codes", first_candidate)
+
+    result = TreeSearchScheduler(num_workers=3, max_prompts=4).run({"a": "fail", "b": "fail", "c": "fail"})
+
+    assert result["prompts_used"] == 4
+    assert result["cut_short"]
+
+def test_fair_score_interleaves_the_notes(monkeypatch):
+    calls = []
+
+    def query(medical_note, candidate_codes, model_name=None, temperature=0.0):
+        calls.append(medical_note)
+        return first_candidate(medical_note, candidate_codes)
+
+    monkeypatch.setattr(scheduler, "query_candidate_codes", query)
+    TreeSearchScheduler(score="fair", num_workers=1).run({"a": "x", "b": "y"})
+
+    # With a single worker, the note with the fewest prompts so far always goes next.
+    assert all(calls[i] != calls[i + 1] for i in range(0, len(calls) - 1, 2))
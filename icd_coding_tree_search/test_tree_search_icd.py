@@ -0,0 +1,62 @@
+import os
+
+import pytest
+import simple_icd_10_cm as cm
+
+if not hasattr(cm, "chapter_list"):
+    pytest.skip("tree_search_icd needs a simple_icd_10_cm version with chapter_list", allow_module_level=True)
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import tree_search_icd
+from tree_search_icd import get_icd_codes
+
+GOLD_CODES = ["E11.22", "S52.301A", "J45.909", "I10"]
+
+class OracleModel:
+    """Confirms exactly the candidate codes which are gold codes or ancestors of gold codes, and counts the prompts."""
+    def __init__(self, gold_codes):
+        self.relevant = set(gold_codes) | {ancestor for code in gold_codes for ancestor in cm.get_ancestors(code)}
+        self.prompts = 0
+
+    def __call__(self, medical_note, candidate_codes, model_name=None, temperature=0.0):
+        self.prompts += 1
+        return [{"code": code} for code in candidate_codes if code in self.relevant], {"prompt_tokens": 0, "completion_tokens": 0}
+
+class FixedIndex:
+    def __init__(self, subtrees, confidence):
+        self.subtrees = subtrees
+        self.confidence = confidence
+
+    def get_candidate_subtrees(self, medical_note, top_k=5):
+        return self.subtrees[:top_k], self.confidence
+
+def run(monkeypatch, gold_codes, leaf_index=None, **kwargs):
+    model = OracleModel(gold_codes)
+    monkeypatch.setattr(tree_search_icd, "query_candidate_codes", model)
+    return sorted(get_icd_codes("note", leaf_index=leaf_index, **kwargs)), model.prompts
+
+def test_shortcut_finds_the_same_codes_with_fewer_prompts(monkeypatch):
+    walk_codes, walk_prompts = run(monkeypatch, GOLD_CODES)
+    shortcut_codes, shortcut_prompts = run(monkeypatch, GOLD_CODES, FixedIndex(["E11", "S52", "J45", "I10"], 1.0))
+
+    assert walk_codes == shortcut_codes == sorted(GOLD_CODES)
+    assert shortcut_prompts < walk_prompts
+
+def test_recall_guard_walks_the_chapters_outside_the_retrieved_categories(monkeypatch):
+    gold_codes = GOLD_CODES + ["A09"]
+    index = FixedIndex(["E11", "S52", "J45", "I10"], 1.0)
+
+    guarded_codes, _ = run(monkeypatch, gold_codes, index)
+    unguarded_codes, _ = run(monkeypatch, gold_codes, index, recall_guard=False)
+
+    assert guarded_codes == sorted(gold_codes)
+    assert unguarded_codes == sorted(GOLD_CODES)
+
+def test_falls_back_to_the_chapter_walk(monkeypatch):
+    walk_codes, walk_prompts = run(monkeypatch, GOLD_CODES)
+
+    # Low retrieval confidence: the shortcut is not tried.
+    assert run(monkeypatch, GOLD_CODES, FixedIndex(["E11"], 0.1)) == (walk_codes, walk_prompts)
+    # The shortcut confirms nothing: one prompt is spent on it before the walk.
+    assert run(monkeypatch, GOLD_CODES, FixedIndex(["K35"], 1.0)) == (walk_codes, walk_prompts + 1)
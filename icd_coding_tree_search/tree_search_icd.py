@@ -1,32 +1,57 @@
+import time
 from helpers import *
+from search_trace import ROOT, SHORTCUT_ROOT
 
-def get_icd_codes(medical_note, model_name="gpt-3.5-turbo-0613", temperature=0.0):
+def query_candidate_codes(medical_note, candidate_codes, model_name="gpt-3.5-turbo-0613", temperature=0.0):
     """
-    Identifies relevant ICD-10 codes for a given medical note by querying a language model.
+    Asks the language model which of the candidate codes are mentioned in the medical note.
 
-    This function implements the tree-search algorithm for ICD coding described in https://openreview.net/forum?id=mqnR8rGWkn.
+    Args:
+        medical_note (str): The medical note.
+        candidate_codes (list of str): The ICD-10 codes to present to the language model.
+        model_name (str): The identifier for the language model used in the API.
+        temperature (float): Controls randomness of the response.
+
+    Returns:
+        tuple: The list of confirmed codes (dicts with "code" and "description") and the token usage of the prompt.
+    """
+    code_descriptions = {}
+    for x in candidate_codes:
+        description, code = get_name_and_description(x, model_name)
+        code_descriptions[description] = code
+
+    prompt = build_zero_shot_prompt(medical_note, list(code_descriptions.keys()), model_name=model_name)
+    lm_response, usage = get_response_with_usage(prompt, model_name, temperature=temperature, max_tokens=500)
+    predicted_codes = parse_outputs(lm_response, code_descriptions, model_name=model_name)
+    return predicted_codes, usage
+
+def search_from_codes(medical_note, candidate_codes, model_name="gpt-3.5-turbo-0613", temperature=0.0, max_prompts=50, trace=None, root=ROOT):
+    """
+    Runs the LLM-guided tree search on a medical note, starting from the given candidate codes.
 
     Args:
         medical_note (str): The medical note for which ICD-10 codes are to be identified.
-        model_name (str): The identifier for the language model used in the API (default is 'gpt-3.5-turbo-0613').
+        candidate_codes (list of str): The codes presented to the language model in the first prompt.
+        model_name (str): The identifier for the language model used in the API.
+        temperature (float): Controls randomness of the responses.
+        max_prompts (int): The maximum number of prompts to spend on the note.
+        trace (SearchTrace): Optional trace in which every expansion is recorded.
+        root (str): The label of the first prompt in the trace.
 
     Returns:
-        list of str: A list of confirmed ICD-10 codes that are relevant to the medical note.
+        tuple: The list of confirmed leaf ICD-10 codes and the number of prompts used.
     """
     assigned_codes = []
-    candidate_codes = [x.name for x in CHAPTER_LIST]
     parent_codes = []
     prompt_count = 0
+    parent_code = None
 
-    while prompt_count < 50:
-        code_descriptions = {}
-        for x in candidate_codes:
-            description, code = get_name_and_description(x, model_name)
-            code_descriptions[description] = code
-
-        prompt = build_zero_shot_prompt(medical_note, list(code_descriptions.keys()), model_name=model_name)
-        lm_response = get_response(prompt, model_name, temperature=temperature, max_tokens=500)
-        predicted_codes = parse_outputs(lm_response, code_descriptions, model_name=model_name)
+    while prompt_count < max_prompts:
+        start = time.perf_counter()
+        predicted_codes, usage = query_candidate_codes(medical_note, candidate_codes, model_name, temperature)
+        if trace is not None:
+            trace.record(parent_code["code"] if parent_code else None, candidate_codes, usage,
+                         time.perf_counter() - start, [x["code"] for x in predicted_codes], root=root)
 
         for code in predicted_codes:
             if cm.is_leaf(code["code"]):
@@ -34,12 +59,53 @@ def get_icd_codes(medical_note, model_name="gpt-3.5-turbo-0613", temperature=0.0
             else:
                 parent_codes.append(code)
 
+        prompt_count += 1
+
         if len(parent_codes) > 0:
             parent_code = parent_codes.pop(0)
             candidate_codes = cm.get_children(parent_code["code"])
         else:
             break
 
-        prompt_count += 1
+    return assigned_codes, prompt_count
+
+def get_icd_codes(medical_note, model_name="gpt-3.5-turbo-0613", temperature=0.0, leaf_index=None, top_k=5, min_confidence=0.5, recall_guard=True, trace=None):
+    """
+    Identifies relevant ICD-10 codes for a given medical note by querying a language model.
+
+    This function implements the tree-search algorithm for ICD coding described in https://openreview.net/forum?id=mqnR8rGWkn.
+    If a `LeafCodeIndex` is given and its retrieval confidence is at least `min_confidence`, the search starts from the
+    top-k categories retrieved for the note instead of the chapter list. If it confirms any code, the walk from the chapter
+    list is skipped; otherwise (or if the confidence is low) the walk from the chapter list runs as usual.
+
+    Args:
+        medical_note (str): The medical note for which ICD-10 codes are to be identified.
+        model_name (str): The identifier for the language model used in the API (default is 'gpt-3.5-turbo-0613').
+        leaf_index (LeafCodeIndex): Optional index over the leaf code descriptions used to shortcut the search.
+        top_k (int): The number of retrieved categories to start the search from.
+        min_confidence (float): The minimum retrieval confidence for using the shortcut.
+        recall_guard (bool): After a successful shortcut, also walk the chapters that contain none of the retrieved
+            categories, so that codes in unrelated chapters are still found.
+        trace (SearchTrace): Optional trace in which every expansion made for the note is recorded.
+
+    Returns:
+        list of str: A list of confirmed ICD-10 codes that are relevant to the medical note.
+    """
+    max_prompts = 50
+    candidate_codes = [x.name for x in CHAPTER_LIST]
+
+    if leaf_index is not None:
+        subtrees, confidence = leaf_index.get_candidate_subtrees(medical_note, top_k=top_k)
+        if subtrees and confidence >= min_confidence:
+            assigned_codes, prompt_count = search_from_codes(medical_note, subtrees, model_name, temperature, max_prompts, trace, root=SHORTCUT_ROOT)
+            if assigned_codes:
+                covered_chapters = {cm.get_ancestors(code)[-1] for code in subtrees}
+                uncovered_chapters = [x for x in candidate_codes if x not in covered_chapters]
+                if recall_guard and uncovered_chapters and prompt_count < max_prompts:
+                    guard_codes, _ = search_from_codes(medical_note, uncovered_chapters, model_name, temperature, max_prompts - prompt_count, trace)
+                    assigned_codes += [x for x in guard_codes if x not in assigned_codes]
+                return assigned_codes
+            max_prompts -= prompt_count
 
+    assigned_codes, _ = search_from_codes(medical_note, candidate_codes, model_name, temperature, max_prompts, trace)
     return assigned_codes
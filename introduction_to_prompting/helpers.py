@@ -1,6 +1,7 @@
 import json
 import re
 from openai import OpenAI
+from llm_client import RateLimitedClient
 
 pattern = re.compile(r"([A-Z])[.:]\s*(.*)")
 
@@ -262,6 +263,43 @@ def get_response(messages, model_name, temperature = 0.0, max_tokens = 10):
     )
     return response.choices[0].message.content
 
+rate_limited_clients = {}
+
+def get_rate_limited_client(**limits):
+    """
+    Returns the shared rate-limited client for the given limits, creating it on first use.
+
+    The client is kept between calls, so that its token buckets account for the requests of the previous calls.
+
+    Args:
+        **limits: The rate limits and retry settings of `llm_client.RateLimitedClient`.
+
+    Returns:
+        RateLimitedClient: The client.
+    """
+    key = tuple(sorted(limits.items()))
+    if key not in rate_limited_clients:
+        rate_limited_clients[key] = RateLimitedClient(**limits)
+    return rate_limited_clients[key]
+
+def get_responses(messages_list, model_name, temperature = 0.0, max_tokens = 10, llm = None, **limits):
+    """
+    Obtains the responses of the model for many prompts, with concurrent rate-limited requests.
+
+    Args:
+        messages_list (list of list of dict): The built messages of each prompt.
+        model_name (str): Name of the model to access through the API
+        temperature (float): A value between 0 and 1 that controls the randomness of the output.
+        max_tokens (int): Maximum number of tokens that the model should generate
+        llm (RateLimitedClient): Optional client to send the requests with; by default the shared client of `get_rate_limited_client`.
+        **limits: The rate limits and retry settings of `llm_client.RateLimitedClient`, when `llm` is not given.
+
+    Returns:
+        list of str: The response message contents, in the order of the prompts.
+    """
+    llm = llm or get_rate_limited_client(**limits)
+    return llm.map(messages_list, model_name, temperature=temperature, max_tokens=max_tokens)
+
 def build_few_shot_prompt_wo_chat_template(system_prompt, content, few_shot_examples):
     """
     Builds the few-shot prompt using provided examples, bypassing the chat-template
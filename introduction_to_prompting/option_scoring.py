@@ -0,0 +1,177 @@
+"""
+Multiple-choice inference with a local model by scoring the option letters.
+
+Instead of generating "The answer is X" token by token and parsing it with `parse_answer`, the prompt is followed by the
+answer prefix ("The answer is") and the model is run once over it. The logits of the option letters at the last position
+give the prediction and its probabilities, so every question has an answer, and a batch of questions costs a single
+forward pass. The probabilities can be calibrated with a temperature fitted on labelled questions.
+"""
+
+import numpy as np
+import torch
+
+def chat_prompt(tokenizer, messages):
+    """Return the text of the messages of `build_zero_shot_prompt` or `build_few_shot_prompt` in the chat template of the tokenizer."""
+    return tokenizer.apply_chat_template(messages, tokenize=False)
+
+def option_token_ids(tokenizer, letters, answer_prefix):
+    """
+    Return the id of the token of every option letter when it follows the answer prefix.
+
+    The letter is tokenized in context (with the space before it), since most tokenizers have different tokens for a
+    letter at the start of a word and after a space.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): The tokenizer.
+        letters (str): The option letters.
+        answer_prefix (str): The text after which the letter is predicted.
+
+    Returns:
+        list of int: The token ids, in the order of `letters`.
+    """
+    prefix_ids = tokenizer(answer_prefix, add_special_tokens=False).input_ids
+    token_ids = []
+    for letter in letters:
+        ids = tokenizer(answer_prefix + " " + letter, add_special_tokens=False).input_ids
+        if ids[:len(prefix_ids)] != prefix_ids or len(ids) != len(prefix_ids) + 1:
+            raise ValueError(f"The option letter {letter} is not a single token after {answer_prefix!r}")
+        token_ids.append(ids[-1])
+    return token_ids
+
+def softmax(logits, temperature=1.0):
+    scaled = np.asarray(logits, dtype=np.float64) / temperature
+    scaled = scaled - np.max(scaled, axis=1, keepdims=True)
+    probabilities = np.exp(scaled)
+    return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+def fit_temperature(logits, labels, min_temperature=0.05, max_temperature=20.0, n_steps=60):
+    """
+    Fit the temperature that minimizes the negative log-likelihood of the correct options (temperature scaling).
+
+    Args:
+        logits (np.ndarray): The option logits of labelled questions, of shape (n_questions, n_options).
+        labels (list of int): The index of the correct option of every question.
+        min_temperature (float): The lowest temperature searched.
+        max_temperature (float): The highest temperature searched.
+        n_steps (int): The number of steps of the golden-section search (over the log of the temperature).
+
+    Returns:
+        float: The temperature.
+    """
+    labels = np.asarray(labels)
+
+    def nll(log_temperature):
+        probabilities = softmax(logits, np.exp(log_temperature))
+        return -np.mean(np.log(probabilities[np.arange(len(labels)), labels] + 1e-12))
+
+    ratio = (np.sqrt(5) - 1) / 2
+    low, high = np.log(min_temperature), np.log(max_temperature)
+    for _ in range(n_steps):
+        a, b = high - ratio * (high - low), low + ratio * (high - low)
+        if nll(a) < nll(b):
+            high = b
+        else:
+            low = a
+    return float(np.exp((low + high) / 2))
+
+class OptionScorer:
+    """
+    Scores the option letters of multiple-choice prompts with a causal language model.
+
+    Args:
+        model (PreTrainedModel): The causal language model.
+        tokenizer (PreTrainedTokenizer): Its tokenizer.
+        letters (str): The option letters.
+        answer_prefix (str): The text appended to every prompt, after which the option letter is predicted.
+        batch_size (int): The number of prompts per forward pass.
+        temperature (float): The temperature of the probabilities (see `calibrate`).
+    """
+    def __init__(self, model, tokenizer, letters="ABCDE", answer_prefix="The answer is", batch_size=8, temperature=1.0):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.letters = letters
+        self.answer_prefix = answer_prefix
+        self.batch_size = batch_size
+        self.temperature = temperature
+        self.token_ids = option_token_ids(tokenizer, letters, answer_prefix)
+
+    def encode(self, prompt):
+        """Token ids of a prompt followed by the answer prefix (prompts in a chat template already start with the BOS token)."""
+        text = prompt if prompt.endswith(("\n", " ")) else prompt + " "
+        bos_token = self.tokenizer.bos_token
+        add_special_tokens = not (bos_token and prompt.startswith(bos_token))
+        return self.tokenizer(text + self.answer_prefix, add_special_tokens=add_special_tokens).input_ids
+
+    @torch.no_grad()
+    def score_prompts(self, prompts):
+        """
+        Run the model over the prompts and return the logits of the option letters at the answer position.
+
+        The prompts are sorted by length and left-padded in batches of `batch_size`, so that the answer position is the
+        last one of every row.
+
+        Args:
+            prompts (list of str): The prompts, as built by `build_few_shot_prompt_wo_chat_template` or `chat_prompt`.
+
+        Returns:
+            np.ndarray: The float32 logits, of shape (n_prompts, n_letters), in the order of `prompts`.
+        """
+        encoded = [self.encode(prompt) for prompt in prompts]
+        order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        device = next(self.model.parameters()).device
+        token_ids = torch.tensor(self.token_ids, device=device)
+        logits = np.zeros((len(prompts), len(self.letters)), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            length = max(len(encoded[i]) for i in batch)
+            input_ids = torch.full((len(batch), length), pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+            for row, i in enumerate(batch):
+                input_ids[row, length - len(encoded[i]):] = torch.tensor(encoded[i])
+                attention_mask[row, length - len(encoded[i]):] = 1
+            # With left padding, the positions of every row start at its first token.
+            position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+            outputs = self.model(input_ids=input_ids.to(device), attention_mask=attention_mask.to(device),
+                                 position_ids=position_ids.to(device), logits_to_keep=1)
+            logits[batch] = outputs.logits[:, -1, token_ids].float().cpu().numpy()
+        return logits
+
+    def mask_options(self, logits, options_list):
+        """Set the logits of the letters which are not among the options of a question to -inf."""
+        if options_list is None:
+            return logits
+        mask = np.array([[letter in options for letter in self.letters] for options in options_list])
+        return np.where(mask, logits, -np.inf)
+
+    def predict(self, prompts, options_list=None):
+        """
+        Predict the answers of multiple-choice prompts.
+
+        Args:
+            prompts (list of str): The prompts.
+            options_list (list of dict): Optionally, the options of every question; letters which are not among its
+                options are never predicted.
+
+        Returns:
+            tuple: The list of predicted letters and the (n_prompts, n_letters) matrix of their probabilities.
+        """
+        logits = self.mask_options(self.score_prompts(prompts), options_list)
+        probabilities = softmax(logits, self.temperature)
+        return [self.letters[i] for i in probabilities.argmax(axis=1)], probabilities
+
+    def calibrate(self, prompts, answers, options_list=None):
+        """
+        Fit the temperature of the probabilities on labelled prompts.
+
+        Args:
+            prompts (list of str): The prompts.
+            answers (list of str): The correct letter of every prompt.
+            options_list (list of dict): Optionally, the options of every question.
+
+        Returns:
+            float: The fitted temperature, also stored in `temperature`.
+        """
+        logits = self.mask_options(self.score_prompts(prompts), options_list)
+        self.temperature = fit_temperature(logits, [self.letters.index(answer) for answer in answers])
+        return self.temperature
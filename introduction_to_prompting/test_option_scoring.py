@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from option_scoring import fit_temperature, option_token_ids, softmax
+
+class WordTokenizer:
+    """Tokenizes on spaces, with the space before a word kept in its token, as byte-level BPE tokenizers do."""
+    def __init__(self):
+        self.vocabulary = {}
+
+    def tokens(self, text):
+        words = text.split(" ")
+        return words[:1] + [" " + word for word in words[1:]]
+
+    def __call__(self, text, add_special_tokens=True):
+        ids = [self.vocabulary.setdefault(token, len(self.vocabulary)) for token in self.tokens(text)]
+        return SimpleNamespace(input_ids=ids)
+
+class CharacterTokenizer(WordTokenizer):
+    def tokens(self, text):
+        return list(text)
+
+def test_option_token_ids_are_the_letter_tokens_after_the_prefix():
+    tokenizer = WordTokenizer()
+
+    token_ids = option_token_ids(tokenizer, "ABCD", "The answer is")
+
+    assert token_ids == [tokenizer.vocabulary[" " + letter] for letter in "ABCD"]
+    assert len(set(token_ids)) == 4
+
+def test_option_token_ids_rejects_letters_which_are_not_one_token():
+    with pytest.raises(ValueError, match="option letter A"):
+        option_token_ids(CharacterTokenizer(), "AB", "The answer is")
+
+def test_fit_temperature_recovers_the_temperature_of_the_labels():
+    rng = np.random.default_rng(0)
+    logits = rng.normal(scale=3.0, size=(20000, 4))
+    # The labels are drawn from the probabilities of the logits at temperature 2.5.
+    probabilities = softmax(logits, 2.5)
+    labels = (rng.random((len(logits), 1)) > np.cumsum(probabilities, axis=1)).sum(axis=1)
+
+    assert fit_temperature(logits, labels) == pytest.approx(2.5, rel=0.1)
+    # Labels which are always the most likely option are fitted with the lowest temperature.
+    assert fit_temperature(logits, logits.argmax(axis=1)) == pytest.approx(0.05, rel=0.01)
@@ -0,0 +1,150 @@
+"""
+Resumable generation of the self-generated chains of thought of the Medprompt training set.
+
+The responses are generated with concurrent rate-limited requests, and validated and parsed as soon as they arrive.
+Every response is appended to a single JSONL store as an accepted record (a well-formed answer, with its CoT and
+predicted option) or a rejected one (with the raw response). The store is indexed by the position of the question in the
+training set, so an interrupted run resumes with the questions that have no record, and the filtered examples are read
+from the store without a second pass over per-question files.
+"""
+
+import asyncio
+import json
+import os
+from tqdm import tqdm
+from llm_client import run_sync
+
+class CoTStore:
+    """
+    Append-only JSONL store of CoT records, with an in-memory index of the offset of the record of every question.
+
+    Args:
+        file_path (str): The path to the JSONL file (created if it does not exist).
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.offsets = {}
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    # A line may be truncated if the previous run was killed while writing it.
+                    try:
+                        self.offsets[json.loads(line)["idx"]] = offset
+                    except (json.JSONDecodeError, UnicodeDecodeError, KeyError):
+                        pass
+                    offset += len(line)
+                if offset and not line.endswith(b"\n"):
+                    # Start the next record on a new line after a truncated one.
+                    with open(file_path, "ab") as out:
+                        out.write(b"\n")
+        self.file = open(file_path, "ab")
+
+    def __contains__(self, idx):
+        return idx in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, record):
+        """Append a record and flush it, so that it survives an interruption."""
+        offset = self.file.seek(0, os.SEEK_END)
+        self.file.write((json.dumps(record) + "\n").encode("utf-8"))
+        self.file.flush()
+        self.offsets[record["idx"]] = offset
+
+    def get(self, idx):
+        """Return the latest record of a question."""
+        with open(self.file_path, "rb") as f:
+            f.seek(self.offsets[idx])
+            return json.loads(f.readline())
+
+    def records(self, status=None):
+        """
+        Return the latest record of every question, in order of their index.
+
+        Args:
+            status (str): Optionally, only the "accepted" or the "rejected" records.
+
+        Returns:
+            list of dict: The records.
+        """
+        self.file.flush()
+        latest = {}
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                latest[record["idx"]] = record
+        return [latest[idx] for idx in sorted(latest) if status is None or latest[idx]["status"] == status]
+
+    def filtered_examples(self):
+        """Return the accepted records whose predicted answer is the correct one, the few-shot candidates of Medprompt."""
+        return [record for record in self.records("accepted") if record["options"].get(record["pred_ans"]) == record["answer"]]
+
+    def close(self):
+        self.file.close()
+
+def make_record(idx, item, response, parse_response):
+    """
+    Validate and parse a response into a store record.
+
+    Args:
+        idx (int): The position of the question in the training set.
+        item (dict): The training question, with "question", "answer" and "options".
+        response (str): The response of the model.
+        parse_response (callable): Returns the (CoT, answer letter) tuple of a response, or ("", "") if it is invalid.
+
+    Returns:
+        dict: The record, with the fields of `cot_responses_medqa_train_set.jsonl` if it is accepted.
+    """
+    cot, pred_ans = parse_response(response)
+    record = {"idx": idx, "question": item["question"], "answer": item["answer"], "options": item["options"]}
+    if pred_ans:
+        record.update({"status": "accepted", "cot": cot, "pred_ans": pred_ans})
+    else:
+        record.update({"status": "rejected", "response": response})
+    return record
+
+async def generate_cots_async(llm, train_data, store, build_prompt, parse_response, **kwargs):
+    """
+    Generate, validate and store the CoT responses of the training questions that are not in the store yet.
+
+    Args:
+        llm (llm_client.RateLimitedClient): The rate-limited client.
+        train_data (list of dict): The training questions.
+        store (CoTStore): The store.
+        build_prompt (callable): Returns the messages of a training question.
+        parse_response (callable): Returns the (CoT, answer letter) tuple of a response, or ("", "") if it is invalid.
+        **kwargs: The arguments of `RateLimitedClient.complete` (model_name, max_tokens, ...).
+
+    Returns:
+        dict: The numbers of accepted, rejected and failed questions of this run. Failed questions have no record and
+            are retried on the next run.
+    """
+    pending = [idx for idx in range(len(train_data)) if idx not in store]
+    counts = {"accepted": 0, "rejected": 0, "failed": 0}
+    progress = tqdm(total=len(pending))
+
+    async def process(idx):
+        try:
+            response = await llm.complete(build_prompt(train_data[idx]), **kwargs)
+        except Exception:
+            counts["failed"] += 1
+        else:
+            record = make_record(idx, train_data[idx], response, parse_response)
+            store.add(record)
+            counts[record["status"]] += 1
+        progress.update(1)
+
+    try:
+        await asyncio.gather(*[process(idx) for idx in pending])
+    finally:
+        progress.close()
+    return counts
+
+def generate_cots(llm, train_data, store, build_prompt, parse_response, **kwargs):
+    """Synchronous version of `generate_cots_async`, for scripts and notebooks."""
+    return run_sync(generate_cots_async(llm, train_data, store, build_prompt, parse_response, **kwargs))
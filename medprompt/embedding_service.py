@@ -0,0 +1,156 @@
+"""
+Batched and cached embeddings for Medprompt.
+
+`get_embedding` sends one request per string and nothing is kept between runs. `EmbeddingService.embed` deduplicates its
+inputs, looks them up in a SQLite cache keyed by (model, SHA-256 of the text), and sends the missing ones in
+multi-input requests of up to `max_batch_size` strings and `max_batch_tokens` estimated tokens. Re-running the
+pipeline only embeds the questions that were never embedded with the same model.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Disk-backed cache of embeddings, stored as float32 blobs under (model, text hash).
+
+    Args:
+        file_path (str): The path to the SQLite file (created if it does not exist).
+    """
+    def __init__(self, file_path):
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings (model TEXT, text_hash TEXT, embedding BLOB, PRIMARY KEY (model, text_hash))")
+
+    def get_many(self, model, hashes, chunk_size=500):
+        """
+        Look up the embeddings of several texts.
+
+        Args:
+            model (str): The embedding model.
+            hashes (list of str): The hashes of the texts.
+            chunk_size (int): The number of hashes per query.
+
+        Returns:
+            dict: Mapping of the cached hashes to float32 embeddings. Hashes which are not cached are omitted.
+        """
+        hashes = list(hashes)
+        found = {}
+        with self.lock:
+            for start in range(0, len(hashes), chunk_size):
+                chunk = hashes[start:start + chunk_size]
+                rows = self.connection.execute(
+                    f"SELECT text_hash, embedding FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})", [model] + chunk)
+                for hash, embedding in rows:
+                    found[hash] = np.frombuffer(embedding, dtype=np.float32)
+        return found
+
+    def set_many(self, model, embeddings):
+        """
+        Store the embeddings of several texts.
+
+        Args:
+            model (str): The embedding model.
+            embeddings (dict): Mapping of text hashes to embeddings.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                                        [(model, hash, np.asarray(embedding, dtype=np.float32).tobytes()) for hash, embedding in embeddings.items()])
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+def make_batches(texts, max_batch_size=2048, max_batch_tokens=300000):
+    """
+    Group texts into requests under the input-count and token limits of the embeddings API.
+
+    The token count of a text is estimated as one token per 4 characters (rounded up).
+
+    Returns:
+        list of list of str: The batches, in the order of `texts`.
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for text in texts:
+        tokens = len(text) // 4 + 1
+        if batch and (len(batch) >= max_batch_size or batch_tokens + tokens > max_batch_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+class EmbeddingService:
+    """
+    Embeds texts with deduplication, a persistent cache and multi-input requests.
+
+    Args:
+        client (OpenAI): Optional OpenAI client; by default one is created from the environment.
+        model (str): The embedding model.
+        cache_path (str): The path of the SQLite cache, or None to disable the cache.
+        max_batch_size (int): The highest number of inputs per request (2048 for the OpenAI API).
+        max_batch_tokens (int): The highest estimated number of tokens per request.
+    """
+    def __init__(self, client=None, model="text-embedding-ada-002", cache_path="embedding_cache.sqlite",
+                 max_batch_size=2048, max_batch_tokens=300000):
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI()
+        self.client = client
+        self.model = model
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.requests = 0
+
+    def request(self, texts):
+        response = self.client.embeddings.create(input=texts, model=self.model)
+        self.requests += 1
+        # The API returns the embeddings with the index of their input, which is not guaranteed to be in order.
+        embeddings = [None] * len(texts)
+        for item in response.data:
+            embeddings[item.index] = np.asarray(item.embedding, dtype=np.float32)
+        return embeddings
+
+    def embed(self, texts):
+        """
+        Embed a list of texts.
+
+        Args:
+            texts (list of str): The texts, possibly with duplicates.
+
+        Returns:
+            np.ndarray: The float32 matrix of the embeddings, one row per text in the order of `texts`.
+        """
+        texts = list(texts)
+        unique = {text_hash(text): text for text in texts}
+        embeddings = self.cache.get_many(self.model, unique) if self.cache is not None else {}
+        missing = [hash for hash in unique if hash not in embeddings]
+        for batch in make_batches([unique[hash] for hash in missing], self.max_batch_size, self.max_batch_tokens):
+            new_embeddings = {text_hash(text): embedding for text, embedding in zip(batch, self.request(batch))}
+            # Every batch is cached as soon as it arrives, so an interrupted run keeps the embeddings it paid for.
+            if self.cache is not None:
+                self.cache.set_many(self.model, new_embeddings)
+            embeddings.update(new_embeddings)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([embeddings[text_hash(text)] for text in texts])
+
+    def embed_one(self, text):
+        """Drop-in replacement of `get_embedding`, returning the embedding of one text as a list."""
+        return self.embed([text])[0].tolist()
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,224 @@
+"""
+kNN selection of the few-shot examples of Medprompt.
+
+The embeddings of the training questions are L2-normalized and stored as a float32 `.npy` matrix, which is memory-mapped
+when loaded, next to a table of the ids of its rows. The neighbours of the whole test set are found at once: the cosine
+similarities of a block of test questions with the corpus are one matrix product, and the top k of every row is taken with
+`np.argpartition`. Above `ivf_threshold` questions, the index is built as an inverted file (IVF): the embeddings are
+clustered with spherical k-means and stored grouped by cluster, and each query only scans the `n_probe` clusters whose
+centroids are closest to it.
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+
+def normalize_rows(matrix):
+    """Return the rows of a matrix scaled to unit L2 norm, as float32 (rows of zeros are left unchanged)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k(similarities, k):
+    """
+    Return the indices and values of the k largest entries of every row, by decreasing value (ties by increasing index).
+
+    Args:
+        similarities (np.ndarray): Matrix of shape (n_queries, n_candidates).
+        k (int): The number of entries per row.
+
+    Returns:
+        tuple: The (n_queries, k) matrices of column indices and values.
+    """
+    k = min(k, similarities.shape[1])
+    if k < similarities.shape[1]:
+        candidates = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(similarities.shape[1]), similarities.shape)
+    values = np.take_along_axis(similarities, candidates, axis=1)
+    order = np.lexsort((candidates, -values), axis=1)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+def spherical_kmeans(embeddings, n_clusters, n_iterations=10, sample_size=None, block_size=4096, seed=0):
+    """
+    Cluster unit vectors by cosine similarity.
+
+    Args:
+        embeddings (np.ndarray): The L2-normalized embeddings.
+        n_clusters (int): The number of clusters.
+        n_iterations (int): The number of k-means iterations.
+        sample_size (int): The number of embeddings the centroids are trained on (by default, 256 per cluster).
+        block_size (int): The number of embeddings assigned per matrix product.
+        seed (int): The random seed.
+
+    Returns:
+        tuple: The L2-normalized centroids, of shape (n_clusters, dim), and the cluster of every embedding.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(embeddings), sample_size or 256 * n_clusters)
+    sample = np.asarray(embeddings[np.sort(rng.choice(len(embeddings), sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, n_clusters, replace=False)]
+    for _ in range(n_iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.bincount(assignments, minlength=n_clusters) == 0
+        # Empty clusters are restarted from random points.
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    assignments = np.concatenate([np.argmax(np.asarray(embeddings[i:i + block_size]) @ centroids.T, axis=1)
+                                  for i in range(0, len(embeddings), block_size)])
+    return centroids, assignments
+
+class KNNSelector:
+    """
+    Cosine kNN index over the embeddings of the few-shot candidates.
+
+    Args:
+        embeddings (np.ndarray): The L2-normalized float32 embeddings (possibly memory-mapped).
+        ids (list): The id of every row of the embeddings.
+        centroids (np.ndarray): The IVF centroids, or None for exact search.
+        list_offsets (np.ndarray): The start of every IVF list in the rows of the embeddings, followed by the number of rows.
+    """
+    def __init__(self, embeddings, ids, centroids=None, list_offsets=None):
+        self.embeddings = embeddings
+        self.ids = list(ids)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+
+    @classmethod
+    def build(cls, embeddings, ids=None, ivf_threshold=50000, n_lists=None, seed=0):
+        """
+        Build the index of a corpus of embeddings.
+
+        Args:
+            embeddings (array-like): The embeddings, of shape (n, dim).
+            ids (list): The id of every embedding (by default, its position).
+            ivf_threshold (int): The corpus size above which an IVF index is built instead of an exact one.
+            n_lists (int): The number of IVF lists (by default, 4 * sqrt(n)).
+            seed (int): The random seed of the clustering.
+
+        Returns:
+            KNNSelector: The index.
+        """
+        embeddings = normalize_rows(embeddings)
+        ids = list(range(len(embeddings))) if ids is None else list(ids)
+        if len(embeddings) <= ivf_threshold:
+            return cls(embeddings, ids)
+        n_lists = n_lists or int(4 * np.sqrt(len(embeddings)))
+        centroids, assignments = spherical_kmeans(embeddings, n_lists, seed=seed)
+        # The rows are stored grouped by list, so that every list is a contiguous slice of the memory-mapped matrix.
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))]).astype(np.int64)
+        return cls(embeddings[order], [ids[i] for i in order], centroids, list_offsets)
+
+    @classmethod
+    def from_records(cls, records, embedding_key="embedding", **kwargs):
+        """Build the index of records holding their embedding (such as `cot_responses_medqa_train_set_filtered_with_embeddings.jsonl`), with their positions as ids."""
+        return cls.build(np.array([record[embedding_key] for record in records], dtype=np.float32), **kwargs)
+
+    @property
+    def is_ivf(self):
+        return self.centroids is not None
+
+    def save(self, directory):
+        """Save the index as `.npy` files and a JSON id table."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "embeddings.npy"), self.embeddings)
+        with open(os.path.join(directory, "ids.json"), "w") as f:
+            json.dump(self.ids, f)
+        if self.is_ivf:
+            np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+            np.save(os.path.join(directory, "list_offsets.npy"), self.list_offsets)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load an index saved with `save`, with the embeddings memory-mapped by default."""
+        embeddings = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r" if mmap else None)
+        with open(os.path.join(directory, "ids.json"), "r") as f:
+            ids = json.load(f)
+        centroids = list_offsets = None
+        if os.path.exists(os.path.join(directory, "centroids.npy")):
+            centroids = np.load(os.path.join(directory, "centroids.npy"))
+            list_offsets = np.load(os.path.join(directory, "list_offsets.npy"))
+        return cls(embeddings, ids, centroids, list_offsets)
+
+    def search_rows(self, queries, k, block_size=1024):
+        """Exact search: the (n_queries, k) row positions and similarities of the nearest embeddings."""
+        rows, similarities = [], []
+        for i in range(0, len(queries), block_size):
+            block_rows, block_similarities = top_k(queries[i:i + block_size] @ self.embeddings.T, k)
+            rows.append(block_rows)
+            similarities.append(block_similarities)
+        return np.concatenate(rows), np.concatenate(similarities)
+
+    def search_rows_ivf(self, queries, k, n_probe):
+        """IVF search: every list is scored once against all the queries that probe it, and the best candidates of each query are merged."""
+        n_probe = min(n_probe, len(self.centroids))
+        probes = top_k(queries @ self.centroids.T, n_probe)[0]
+        query_ids, rows, similarities = [], [], []
+        for list_id in np.unique(probes):
+            probing = np.flatnonzero((probes == list_id).any(axis=1))
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == end:
+                continue
+            list_rows, list_similarities = top_k(queries[probing] @ np.asarray(self.embeddings[start:end]).T, k)
+            query_ids.append(np.repeat(probing, list_rows.shape[1]))
+            rows.append((list_rows + start).ravel())
+            similarities.append(list_similarities.ravel())
+        query_ids, rows, similarities = np.concatenate(query_ids), np.concatenate(rows), np.concatenate(similarities)
+        order = np.lexsort((rows, -similarities, query_ids))
+        query_ids, rows, similarities = query_ids[order], rows[order], similarities[order]
+        starts = np.searchsorted(query_ids, np.arange(len(queries)))
+        # A query may have fewer than k candidates if its lists are small; the missing neighbours are -1.
+        result_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        result_similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for j in range(k):
+            positions = starts + j
+            valid = positions < np.append(starts[1:], len(query_ids))
+            result_rows[valid, j] = rows[positions[valid]]
+            result_similarities[valid, j] = similarities[positions[valid]]
+        return result_rows, result_similarities
+
+    def search(self, query_embeddings, k=5, n_probe=16, block_size=1024):
+        """
+        Find the nearest neighbours of a batch of queries.
+
+        Args:
+            query_embeddings (array-like): The query embeddings, of shape (n_queries, dim).
+            k (int): The number of neighbours per query.
+            n_probe (int): The number of IVF lists scanned per query (ignored by exact indexes).
+            block_size (int): The number of queries per matrix product of the exact search.
+
+        Returns:
+            tuple: The (n_queries, k) matrix of cosine distances (1 - cosine similarity, as in `NearestNeighbors(metric='cosine')`)
+                and, for every query, the list of the ids of its neighbours by increasing distance.
+        """
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        k = min(k, len(self.ids))
+        if self.is_ivf:
+            rows, similarities = self.search_rows_ivf(queries, k, n_probe)
+        else:
+            rows, similarities = self.search_rows(queries, k, block_size)
+        neighbor_ids = [[self.ids[row] for row in query_rows if row >= 0] for query_rows in rows]
+        return 1 - similarities, neighbor_ids
+
+    def select(self, query_embeddings, records, k=5, **kwargs):
+        """Return, for every query, the records of its k nearest neighbours, for an index whose ids are positions in `records`."""
+        _, neighbor_ids = self.search(query_embeddings, k=k, **kwargs)
+        return [[records[i] for i in ids] for ids in neighbor_ids]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the kNN index of the few-shot candidates of Medprompt.")
+    parser.add_argument("--input_file", default="cot_responses_medqa_train_set_filtered_with_embeddings.jsonl", help="JSONL file of the candidates with their embeddings")
+    parser.add_argument("--output_dir", default="knn_index", help="Directory to save the index to")
+    parser.add_argument("--ivf_threshold", type=int, default=50000, help="Corpus size above which an IVF index is built")
+    args = parser.parse_args()
+
+    with open(args.input_file, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    selector = KNNSelector.from_records(records, ivf_threshold=args.ivf_threshold)
+    selector.save(args.output_dir)
+    print(f"Indexed {len(selector.ids)} embeddings ({'IVF' if selector.is_ivf else 'exact'}) in {args.output_dir}")
@@ -0,0 +1,196 @@
+"""
+Rate-limited asynchronous client for the chat-completions API.
+
+The evaluation loops call `get_response` once per question, and wait for every response before sending the next
+request. `RateLimitedClient` sends the requests concurrently while staying under the requests-per-minute and
+tokens-per-minute limits of the account, with two token buckets. Rate-limit and transient errors are retried with
+exponential backoff and jitter. `map` returns the responses of a list of prompts in input order, so that a loop over
+`get_response` can be replaced with a single call.
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a fixed rate per minute.
+
+    Args:
+        rate_per_minute (float): The number of tokens added per minute.
+        capacity (float): The largest number of tokens the bucket holds (by default, one minute of tokens).
+    """
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until `amount` tokens are available and take them. Larger amounts than the capacity wait for a full bucket."""
+        amount = min(amount, self.capacity)
+        while True:
+            self.refill()
+            # There is no await between the check and the update, so concurrent tasks cannot take the same tokens.
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount):
+        """Give back (positive) or take (negative) tokens, to correct an estimate once the actual usage is known."""
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+def run_sync(coroutine):
+    """Run a coroutine to completion from synchronous code, in a separate thread if an event loop is already running (as in a notebook)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    result = {}
+
+    def run():
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+def content_length(content):
+    """Number of characters of a message content, which is a string or a list of content parts (only text parts are counted)."""
+    if isinstance(content, list):
+        return sum(len(part.get("text", "")) for part in content if part.get("type") == "text")
+    return len(content or "")
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token count of a request: about 4 characters per prompt token, plus the completion budget."""
+    return sum(content_length(message.get("content")) for message in messages) // 4 + 4 * len(messages) + max_tokens
+
+def parse_retry_after(value):
+    """
+    Parse the Retry-After header of a response, given either in seconds or as an HTTP date.
+
+    Args:
+        value (str): The header value (None if it is missing).
+
+    Returns:
+        float: The number of seconds to wait, 0 if the header is missing or invalid.
+    """
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return 0.0
+
+class RateLimitedClient:
+    """
+    Sends chat-completion requests concurrently under request and token rate limits.
+
+    Args:
+        client (AsyncOpenAI): Optional asynchronous client; by default one is created from the environment for each event loop.
+        requests_per_minute (int): The request rate limit.
+        tokens_per_minute (int): The token rate limit (prompt and completion tokens).
+        max_concurrency (int): The highest number of requests in flight.
+        max_retries (int): The number of retries on rate-limit and transient errors.
+        base_delay (float): The delay before the first retry, doubled at each retry.
+        max_delay (float): The maximum delay between retries.
+    """
+    def __init__(self, client=None, requests_per_minute=500, tokens_per_minute=200000, max_concurrency=32,
+                 max_retries=8, base_delay=1.0, max_delay=60.0):
+        self.client = client
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # The semaphore and the default client are bound to the event loop they are used in, and are recreated for a new one.
+        self.loop = None
+        self.semaphore = None
+        self.loop_client = None
+
+    def bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.loop_client = self.client or AsyncOpenAI(max_retries=0)
+        return self.loop_client
+
+    async def complete(self, messages, model_name, temperature=0.0, max_tokens=10, **kwargs):
+        """
+        Asynchronous version of `helpers.get_response`.
+
+        Args:
+            messages (list of dict): The built messages provided to the API.
+            model_name (str): Name of the model to access through the API.
+            temperature (float): The randomness of the output.
+            max_tokens (int): Maximum number of tokens that the model should generate.
+            **kwargs: Other arguments of `chat.completions.create`.
+
+        Returns:
+            str: The response message content from the model.
+        """
+        client = self.bind_loop()
+        estimate = estimate_tokens(messages, max_tokens)
+        for attempt in range(self.max_retries + 1):
+            await self.request_bucket.acquire()
+            await self.token_bucket.acquire(estimate)
+            retry_after = 0.0
+            try:
+                async with self.semaphore:
+                    response = await client.chat.completions.create(model=model_name, messages=messages,
+                                                                    temperature=temperature, max_tokens=max_tokens, **kwargs)
+                if getattr(response, "usage", None) is not None:
+                    self.token_bucket.adjust(estimate - response.usage.total_tokens)
+                return response.choices[0].message.content
+            except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+                if isinstance(e, RateLimitError):
+                    retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+                if attempt == self.max_retries:
+                    raise
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            await asyncio.sleep(max(retry_after, delay / 2 + random.uniform(0, delay / 2)))
+
+    async def complete_many(self, messages_list, model_name, temperature=0.0, max_tokens=10, return_exceptions=False, **kwargs):
+        """
+        Run `complete` on many prompts concurrently.
+
+        Args:
+            messages_list (list of list of dict): The messages of each request.
+            model_name (str): Name of the model to access through the API.
+            temperature (float): The randomness of the output.
+            max_tokens (int): Maximum number of tokens that the model should generate.
+            return_exceptions (bool): Whether to return the exception of a failed request in its place instead of raising it.
+            **kwargs: Other arguments of `chat.completions.create`.
+
+        Returns:
+            list of str: The responses, in the order of `messages_list`.
+        """
+        return await asyncio.gather(*[self.complete(messages, model_name, temperature=temperature, max_tokens=max_tokens, **kwargs)
+                                      for messages in messages_list], return_exceptions=return_exceptions)
+
+    def map(self, messages_list, model_name, temperature=0.0, max_tokens=10, return_exceptions=False, **kwargs):
+        """Synchronous version of `complete_many`, for scripts and notebooks."""
+        return run_sync(self.complete_many(messages_list, model_name, temperature=temperature, max_tokens=max_tokens,
+                                           return_exceptions=return_exceptions, **kwargs))
@@ -0,0 +1,182 @@
+"""
+Choice-shuffle ensembling of Medprompt with early stopping.
+
+Medprompt answers every test question with `n_variants` prompts whose answer options are shuffled, and takes the
+majority answer. Here the variants of a question are sent in waves of concurrent requests. After each wave the votes
+are counted, and no more variants are sent once the leading answer cannot be overtaken by the remaining ones, so the
+final answer is the one full ensembling would give. Optionally, a question also stops as soon as the share of the
+leading answer reaches a confidence threshold. All the questions are run concurrently.
+"""
+
+import asyncio
+import random
+from collections import Counter
+from llm_client import run_sync
+
+def shuffle_option_labels(answer_options, rng=random):
+    """
+    Shuffles the options of the question.
+
+    Args:
+        answer_options (dict): A dictionary with the options.
+        rng (random.Random): The random generator.
+
+    Returns:
+        dict: A new dictionary with the shuffled options.
+    """
+    options = list(answer_options.values())
+    rng.shuffle(options)
+    labels = [chr(i) for i in range(ord('A'), ord('A') + len(options))]
+    return {label: option for label, option in zip(labels, options)}
+
+def final_prediction(votes):
+    """Return the most frequent answer, or "" if several answers are tied (as in the evaluation of the notebook)."""
+    counts = Counter(votes).most_common(2)
+    if not counts or (len(counts) == 2 and counts[0][1] == counts[1][1]):
+        return ""
+    return counts[0][0]
+
+def leading_counts(votes):
+    """Return the counts of the first and second most frequent answers (0 if there are none)."""
+    counts = [count for _, count in Counter(votes).most_common(2)] + [0, 0]
+    return counts[0], counts[1]
+
+def is_decided(votes, n_variants, confidence=None, min_votes=1):
+    """
+    Whether the ensemble can stop.
+
+    Args:
+        votes (list of str): The answers of the variants sent so far ("" for invalid responses).
+        n_variants (int): The number of variants of full ensembling.
+        confidence (float): Optional share of the votes above which the leading answer is accepted early.
+        min_votes (int): The number of votes before the confidence threshold applies.
+
+    Returns:
+        bool: True if the remaining variants cannot change the result, or if the confidence threshold is reached.
+    """
+    first, second = leading_counts(votes)
+    remaining = n_variants - len(votes)
+    if remaining <= 0 or first > second + remaining:
+        return True
+    return confidence is not None and len(votes) >= max(1, min_votes) and first / len(votes) >= confidence
+
+def next_wave_size(votes, n_variants):
+    """
+    The smallest number of further variants after which the ensemble may be decided (if they all agree with the leader).
+
+    The leader with `first` votes cannot be overtaken after k more votes when first + k > second + (remaining - k).
+    """
+    first, second = leading_counts(votes)
+    remaining = n_variants - len(votes)
+    return min(remaining, max(1, (second + remaining - first) // 2 + 1))
+
+async def run_question(llm, question, build_prompt, parse_response, n_variants=5, confidence=None, min_votes=1,
+                       rng=random, **kwargs):
+    """
+    Run the early-stopping ensemble of one question.
+
+    Args:
+        llm (llm_client.RateLimitedClient): The rate-limited client.
+        question (dict): The test question, with "question", "options" and "answer".
+        build_prompt (callable): Returns the messages of a question with shuffled options.
+        parse_response (callable): Returns the (CoT, answer letter) tuple of a response, or ("", "") if it is invalid.
+        n_variants (int): The number of variants of full ensembling.
+        confidence (float): Optional confidence threshold of `is_decided`.
+        min_votes (int): The number of votes before the confidence threshold applies.
+        rng (random.Random): The random generator of the shuffles.
+        **kwargs: The arguments of `RateLimitedClient.complete` (model_name, max_tokens, ...).
+
+    Returns:
+        dict: The outputs of the variants that were sent, in the format of the notebook, the final prediction (an option
+            text, or "" if tied) and the number of calls. A variant whose request failed (after the retries of the client)
+            is an invalid vote "", with the error under "error" in its output.
+    """
+    outputs, votes = [], []
+    while not is_decided(votes, n_variants, confidence, min_votes):
+        variants = []
+        for _ in range(next_wave_size(votes, n_variants)):
+            variant = question.copy()
+            variant["options"] = shuffle_option_labels(question["options"], rng)
+            variants.append(variant)
+        responses = await asyncio.gather(*[llm.complete(build_prompt(variant), **kwargs) for variant in variants],
+                                         return_exceptions=True)
+        for variant, response in zip(variants, responses):
+            if isinstance(response, Exception):
+                outputs.append({"question": variant["question"], "options": variant["options"], "cot": "", "pred_ans": "",
+                                "error": repr(response)})
+            else:
+                cot, pred_ans = parse_response(response)
+                outputs.append({"question": variant["question"], "options": variant["options"], "cot": cot,
+                                "pred_ans": variant["options"].get(pred_ans, "")})
+            votes.append(outputs[-1]["pred_ans"])
+    return {"outputs": outputs, "prediction": final_prediction(votes), "n_calls": len(outputs)}
+
+async def run_ensemble_async(llm, questions, build_prompt, parse_response, **kwargs):
+    """
+    Run `run_question` on all the questions concurrently.
+
+    Args:
+        llm (llm_client.RateLimitedClient): The rate-limited client.
+        questions (list of dict): The test questions.
+        build_prompt (callable or list of callable): The prompt builder of all the questions, or one per question (for
+            instance with the kNN few-shot examples of each question bound to it).
+        parse_response (callable): Returns the (CoT, answer letter) tuple of a response, or ("", "") if it is invalid.
+        **kwargs: The other arguments of `run_question`.
+
+    Returns:
+        list of dict: The results of `run_question`, in the order of `questions`. A question whose ensemble raised (e.g.
+            in `build_prompt` or `parse_response`) has no outputs, the prediction "" and its error under "error".
+    """
+    builders = build_prompt if isinstance(build_prompt, (list, tuple)) else [build_prompt] * len(questions)
+    results = await asyncio.gather(*[run_question(llm, question, builder, parse_response, **kwargs)
+                                     for question, builder in zip(questions, builders)], return_exceptions=True)
+    return [{"outputs": [], "prediction": "", "n_calls": 0, "error": repr(result)} if isinstance(result, Exception) else result
+            for result in results]
+
+def run_ensemble(llm, questions, build_prompt, parse_response, **kwargs):
+    """Synchronous version of `run_ensemble_async`, for scripts and notebooks."""
+    return run_sync(run_ensemble_async(llm, questions, build_prompt, parse_response, **kwargs))
+
+def summarize(results, questions, n_variants=5):
+    """
+    Report the accuracy and the calls saved against full ensembling.
+
+    Args:
+        results (list of dict): The results of `run_question`.
+        questions (list of dict): The questions, with their "answer".
+        n_variants (int): The number of variants of full ensembling.
+
+    Returns:
+        dict: The accuracy, the average number of calls per question and the average number of calls saved.
+    """
+    calls = sum(result["n_calls"] for result in results) / len(results)
+    accuracy = sum(result["prediction"] == question["answer"] for result, question in zip(results, questions)) / len(results)
+    return {"accuracy": accuracy, "average_calls": calls, "average_calls_saved": n_variants - calls}
+
+def replay(questions, confidence=None, min_votes=1):
+    """
+    Simulate early stopping on the outputs of full ensembling (such as `final_processed_test_set_responses_medprompt.jsonl`),
+    taking the votes of each question in the order of its "outputs", one wave at a time.
+
+    Args:
+        questions (list of dict): The questions, with their "answer" and the "outputs" of all their variants.
+        confidence (float): Optional confidence threshold of `is_decided`.
+        min_votes (int): The number of votes before the confidence threshold applies.
+
+    Returns:
+        dict: The `summarize` report of early stopping, with the accuracy of full ensembling under "full_accuracy".
+    """
+    results = []
+    for question in questions:
+        all_votes = [output["pred_ans"] for output in question["outputs"]]
+        n_variants = len(all_votes)
+        votes = []
+        while not is_decided(votes, n_variants, confidence, min_votes):
+            votes = all_votes[:len(votes) + next_wave_size(votes, n_variants)]
+        results.append({"prediction": final_prediction(votes), "n_calls": len(votes), "full_prediction": final_prediction(all_votes)})
+    report = {"accuracy": sum(result["prediction"] == question["answer"] for result, question in zip(results, questions)) / len(results),
+              "full_accuracy": sum(result["full_prediction"] == question["answer"] for result, question in zip(results, questions)) / len(results),
+              "average_calls": sum(result["n_calls"] for result in results) / len(results),
+              "full_calls": sum(len(question["outputs"]) for question in questions) / len(questions)}
+    report["average_calls_saved"] = report["full_calls"] - report["average_calls"]
+    return report
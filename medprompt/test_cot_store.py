@@ -0,0 +1,53 @@
+import json
+
+from cot_store import CoTStore, generate_cots
+
+TRAIN_DATA = [{"question": f"question {i}", "answer": "x", "options": {"A": "x", "B": "y"}} for i in range(5)]
+
+class FakeClient:
+    """Answers every prompt with its scripted response, or fails, and records the prompts it was sent."""
+    def __init__(self, responses):
+        self.responses = responses
+        self.prompts = []
+
+    async def complete(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        response = self.responses[prompt]
+        if response is None:
+            raise RuntimeError("rate limited")
+        return response
+
+def build_prompt(item):
+    return item["question"]
+
+def parse_response(response):
+    return ("cot", response) if response in ("A", "B") else ("", "")
+
+def test_store_resumes_after_a_truncated_trailing_line(tmp_path):
+    file_path = str(tmp_path / "cots.jsonl")
+    llm = FakeClient({"question 0": "A", "question 1": "nonsense", "question 2": None, "question 3": "B", "question 4": "A"})
+    store = CoTStore(file_path)
+    counts = generate_cots(llm, TRAIN_DATA[:4], store, build_prompt, parse_response)
+    store.close()
+    assert counts == {"accepted": 2, "rejected": 1, "failed": 1}
+
+    # The run is killed while writing the record of question 4.
+    with open(file_path, "a") as f:
+        f.write(json.dumps({"idx": 4, "status": "accepted"})[:15])
+
+    store = CoTStore(file_path)
+    assert sorted(store.offsets) == [0, 1, 3]
+    llm = FakeClient({"question 2": "A", "question 4": "B"})
+    counts = generate_cots(llm, TRAIN_DATA, store, build_prompt, parse_response)
+
+    assert sorted(llm.prompts) == ["question 2", "question 4"]
+    assert counts == {"accepted": 2, "rejected": 0, "failed": 0}
+    assert store.get(4)["pred_ans"] == "B" and store.get(1)["status"] == "rejected"
+    assert [record["idx"] for record in store.records()] == [0, 1, 2, 3, 4]
+    assert [record["idx"] for record in store.filtered_examples()] == [0, 2]
+    store.close()
+
+    # The truncated line is skipped again when the store is reopened.
+    store = CoTStore(file_path)
+    assert len(store) == 5
+    store.close()
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from embedding_service import EmbeddingService
+
+def fake_embedding(text):
+    return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0]
+
+class FakeEmbeddings:
+    """Stand-in for `client.embeddings`, recording the inputs of every request and answering in reverse order."""
+    def __init__(self):
+        self.requests = []
+
+    def create(self, input, model):
+        self.requests.append(list(input))
+        data = [SimpleNamespace(index=i, embedding=fake_embedding(text)) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data[::-1])
+
+def make_service(cache_path, **kwargs):
+    embeddings = FakeEmbeddings()
+    return EmbeddingService(client=SimpleNamespace(embeddings=embeddings), cache_path=cache_path, **kwargs), embeddings
+
+def test_embed_deduplicates_and_batches_the_texts():
+    service, embeddings = make_service(None, max_batch_size=2)
+    texts = ["fever", "cough", "fever", "rash", "cough"]
+
+    result = service.embed(texts)
+
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, np.array([fake_embedding(text) for text in texts], dtype=np.float32))
+    assert embeddings.requests == [["fever", "cough"], ["rash"]]
+    assert service.embed([]).shape == (0, 0)
+
+def test_embed_only_requests_the_texts_missing_from_the_cache(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+    service, embeddings = make_service(cache_path)
+    first = service.embed(["fever", "cough"])
+    service.close()
+
+    # A new service on the same cache, as in a re-run of the pipeline.
+    service, embeddings = make_service(cache_path)
+    result = service.embed(["cough", "rash", "fever"])
+
+    assert embeddings.requests == [["rash"]]
+    np.testing.assert_array_equal(result[[2, 0]], first)
+    assert len(service.cache) == 3
+    # The cache is keyed by model.
+    service.model = "text-embedding-3-small"
+    service.embed(["fever"])
+    assert embeddings.requests[-1] == ["fever"]
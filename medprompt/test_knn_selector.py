@@ -0,0 +1,51 @@
+import numpy as np
+
+from knn_selector import KNNSelector
+
+def make_corpus(n=600, dim=16, n_queries=40, seed=0):
+    rng = np.random.default_rng(seed)
+    corpus = rng.normal(size=(n, dim)).astype(np.float32)
+    queries = rng.normal(size=(n_queries, dim)).astype(np.float32)
+    return corpus, queries
+
+def brute_force(corpus, queries, k):
+    corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    similarities = queries @ corpus.T
+    return [list(np.argsort(-row, kind="stable")[:k]) for row in similarities], np.sort(1 - similarities, axis=1)[:, :k]
+
+def test_exact_search_matches_brute_force():
+    corpus, queries = make_corpus()
+    ids = [f"q{i}" for i in range(len(corpus))]
+    selector = KNNSelector.build(corpus, ids)
+    assert not selector.is_ivf
+
+    distances, neighbor_ids = selector.search(queries, k=5, block_size=7)
+
+    expected_rows, expected_distances = brute_force(corpus, queries, 5)
+    assert neighbor_ids == [[ids[row] for row in rows] for rows in expected_rows]
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+def test_ivf_search_matches_brute_force_when_every_list_is_probed(tmp_path):
+    corpus, queries = make_corpus()
+    selector = KNNSelector.build(corpus, ivf_threshold=100, n_lists=12)
+    assert selector.is_ivf and selector.list_offsets[-1] == len(corpus)
+
+    selector.save(tmp_path)
+    loaded = KNNSelector.load(tmp_path)
+    distances, neighbor_ids = loaded.search(queries, k=5, n_probe=12)
+
+    expected_rows, expected_distances = brute_force(corpus, queries, 5)
+    assert neighbor_ids == [[int(row) for row in rows] for rows in expected_rows]
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+def test_ivf_search_with_few_probes_finds_most_neighbors():
+    corpus, queries = make_corpus()
+    selector = KNNSelector.build(corpus, ivf_threshold=100, n_lists=12)
+
+    _, neighbor_ids = selector.search(queries, k=5, n_probe=4)
+
+    expected_rows, _ = brute_force(corpus, queries, 5)
+    found = sum(len(set(ids) & {int(row) for row in rows}) for ids, rows in zip(neighbor_ids, expected_rows))
+    assert found / (5 * len(queries)) >= 0.6
+    assert all(len(ids) == 5 for ids in neighbor_ids)
@@ -0,0 +1,24 @@
+import ast
+import os
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ORIGINAL = os.path.join(HERE, "..", "introduction_to_prompting", "llm_client.py")
+BULK_EXTRACTION = os.path.join(HERE, "..", "icd_coding_knowledge_graphs", "bulk_extraction.py")
+
+def read(path):
+    if not os.path.exists(path):
+        pytest.skip(f"{path} is not in this checkout")
+    with open(path) as f:
+        return f.read()
+
+def function_source(source, name):
+    function = next(node for node in ast.parse(source).body if isinstance(node, ast.FunctionDef) and node.name == name)
+    return ast.get_source_segment(source, function)
+
+def test_vendored_copy_is_identical_to_the_original():
+    assert read(os.path.join(HERE, "llm_client.py")) == read(ORIGINAL)
+
+def test_bulk_extraction_parses_retry_after_the_same_way():
+    assert function_source(read(BULK_EXTRACTION), "parse_retry_after") == function_source(read(ORIGINAL), "parse_retry_after")
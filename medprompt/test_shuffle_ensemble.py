@@ -0,0 +1,71 @@
+import asyncio
+import itertools
+import random
+from collections import Counter
+
+import pytest
+
+from shuffle_ensemble import final_prediction, is_decided, next_wave_size, replay, run_question
+
+def find_mode_string_list(string_list):
+    """The mode of the votes as computed in the evaluation cell of medprompt.ipynb."""
+    if not string_list:
+        return None
+
+    string_counts = Counter(string_list)
+    max_freq = max(string_counts.values())
+    mode_strings = [string for string, count in string_counts.items() if count == max_freq]
+    return mode_strings
+
+def notebook_prediction(votes):
+    modes = find_mode_string_list(votes)
+    return "" if len(modes) > 1 else modes[0]
+
+def early_stopping_votes(all_votes):
+    votes = []
+    while not is_decided(votes, len(all_votes)):
+        votes = all_votes[:len(votes) + next_wave_size(votes, len(all_votes))]
+    return votes
+
+@pytest.mark.parametrize("n_variants", [3, 5, 7])
+def test_early_stopping_gives_the_prediction_of_full_ensembling(n_variants):
+    # Every sequence of votes, with "" for invalid responses, including all the ties.
+    for all_votes in itertools.product(["x", "y", "z", ""], repeat=n_variants):
+        all_votes = list(all_votes)
+        votes = early_stopping_votes(all_votes)
+        assert final_prediction(votes) == notebook_prediction(all_votes), all_votes
+        assert final_prediction(all_votes) == notebook_prediction(all_votes)
+
+def test_early_stopping_saves_calls_when_the_variants_agree():
+    assert early_stopping_votes(["x"] * 5) == ["x"] * 3
+    assert early_stopping_votes(["x", "x", "x", "y", "y", "x", "x"]) == ["x", "x", "x", "y", "y", "x"]
+
+    questions = [{"answer": "x", "outputs": [{"pred_ans": vote} for vote in votes]}
+                 for votes in itertools.product(["x", "y", ""], repeat=5)]
+    report = replay(questions)
+    assert report["accuracy"] == report["full_accuracy"]
+    assert report["average_calls"] < report["full_calls"] == 5
+
+class ScriptedClient:
+    """Answers the prompts with the scripted option texts in turn; an exception in the script is raised instead."""
+    def __init__(self, script):
+        self.script = iter(script)
+        self.calls = 0
+
+    async def complete(self, prompt, **kwargs):
+        self.calls += 1
+        answer = next(self.script)
+        if isinstance(answer, Exception):
+            raise answer
+        return next(label for label, option in prompt.items() if option == answer)
+
+def test_run_question_counts_failed_requests_as_invalid_votes():
+    question = {"question": "q", "options": {"A": "x", "B": "y", "C": "z"}, "answer": "x"}
+    llm = ScriptedClient(["x", RuntimeError("timeout"), "x", "y", "x"])
+
+    result = asyncio.run(run_question(llm, question, lambda variant: variant["options"], lambda response: ("", response),
+                                      n_variants=5, rng=random.Random(0)))
+
+    assert [output["pred_ans"] for output in result["outputs"]] == ["x", "", "x", "y", "x"]
+    assert "timeout" in result["outputs"][1]["error"]
+    assert result["prediction"] == "x" and result["n_calls"] == llm.calls == 5
@@ -0,0 +1,348 @@
+"""
+A local stand-in for the OpenAI API, speaking the chat-completions and embeddings endpoints.
+
+Responses are either replayed from a JSONL file of recorded request/response pairs, recorded from an upstream
+OpenAI-compatible API, or produced by deterministic generators. Latency, rate-limit errors and token-throughput
+limits can be injected to benchmark the pipelines of this repository without network access or API spend.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+IGNORED_REQUEST_KEYS = {"stream", "user"}
+
+def request_key(endpoint, body):
+    """
+    Compute the key identifying a request in the recordings.
+
+    Args:
+        endpoint (str): The API endpoint (e.g. "chat/completions").
+        body (dict): The JSON body of the request.
+
+    Returns:
+        str: The SHA-256 hash of the endpoint and the canonical JSON of the body.
+    """
+    canonical = json.dumps({k: v for k, v in body.items() if k not in IGNORED_REQUEST_KEYS}, sort_keys=True)
+    return hashlib.sha256((endpoint + "\n" + canonical).encode("utf-8")).hexdigest()
+
+def count_tokens(text):
+    """Approximate the number of tokens of a text (about 4 characters per token)."""
+    return max(1, math.ceil(len(text) / 4)) if text else 0
+
+def message_text(message):
+    """Return the text of a chat message, whose content may be a string or a list of content parts."""
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content
+
+class RecordingStore:
+    """
+    Recorded request/response pairs, kept in memory and appended to a JSONL file.
+
+    Args:
+        file_path (str): The path to the JSONL file (None to keep the recordings in memory only).
+    """
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.responses = {}
+        self.lock = threading.Lock()
+        if file_path and os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.responses[record["key"]] = record["response"]
+
+    def get(self, key):
+        return self.responses.get(key)
+
+    def add(self, key, endpoint, request, response):
+        with self.lock:
+            self.responses[key] = response
+            if self.file_path:
+                with open(self.file_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "endpoint": endpoint, "request": request, "response": response}) + "\n")
+
+def estimate_request_tokens(endpoint, body):
+    """
+    Estimate the tokens of a request before its response is known, as the upstream API counts them against its
+    tokens-per-minute limit: the prompt tokens plus the completion budget.
+    """
+    if endpoint == "embeddings":
+        inputs = body.get("input") or []
+        return sum(count_tokens(x) for x in (inputs if isinstance(inputs, list) else [inputs]) if isinstance(x, str))
+    prompt_tokens = sum(count_tokens(message_text(x)) for x in body.get("messages", []))
+    return prompt_tokens + (body.get("max_tokens") or body.get("max_completion_tokens") or 256)
+
+def generate_chat_text(body, generator, key, fixed_response=""):
+    """
+    Produce a deterministic chat completion.
+
+    Args:
+        body (dict): The request body.
+        generator (str): "echo" repeats the last user message, "fixed" returns `fixed_response`, and "lorem" returns
+            pseudo-random words seeded by the request, as many as `max_tokens` allows.
+        key (str): The request key, used as a seed.
+        fixed_response (str): The response of the "fixed" generator.
+
+    Returns:
+        str: The content of the completion.
+    """
+    max_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or 256
+    if generator == "fixed":
+        return fixed_response
+    if generator == "echo":
+        user_messages = [x for x in body.get("messages", []) if x.get("role") == "user"]
+        text = message_text(user_messages[-1]) if user_messages else ""
+        return text[:4 * max_tokens]
+    rng = random.Random(key)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do"]
+    return " ".join(rng.choice(words) for _ in range(max(1, int(max_tokens * 0.75))))
+
+def generate_embedding(text, dimensions):
+    """Produce a deterministic unit-norm embedding seeded by the text."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).hexdigest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector]
+
+class RateLimiter:
+    """
+    Sliding one-minute window of request and token counts.
+
+    Args:
+        requests_per_minute (int): Maximum number of requests per minute (None for no limit).
+        tokens_per_minute (int): Maximum number of tokens per minute (None for no limit).
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.events = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """
+        Account for a request if it fits in the limits.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the number of seconds after which to retry.
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.events and now - self.events[0][0] >= 60:
+                self.events.popleft()
+            used_tokens = sum(x[1] for x in self.events)
+            if (self.requests_per_minute is not None and len(self.events) >= self.requests_per_minute) or \
+               (self.tokens_per_minute is not None and self.events and used_tokens + tokens > self.tokens_per_minute):
+                return max(0.0, 60 - (now - self.events[0][0]))
+            self.events.append((now, tokens))
+            return 0.0
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    HTTP server holding the configuration and the state shared by the request handlers.
+
+    Args:
+        address (tuple): The (host, port) to listen on.
+        mode (str): "replay" serves recorded responses and falls back to the generators, "strict_replay" returns an
+            error for requests which were not recorded, "record" forwards the requests to the upstream API and
+            records the responses, and "generate" only uses the generators.
+        store (RecordingStore): The recorded responses.
+        chat_generator (str): The generator used for chat completions (see `generate_chat_text`).
+        fixed_response (str): The response of the "fixed" chat generator.
+        embedding_dim (int): The dimension of the generated embeddings.
+        latency (float): Fixed delay in seconds added to every response.
+        latency_jitter (float): Maximum random delay in seconds added to every response.
+        tokens_per_second (float): Completion speed of a single response, used to delay it (None for no delay).
+        error_rate (float): Probability of answering a request with a 429 rate-limit error.
+        rate_limiter (RateLimiter): Per-minute request and token limits, answered with 429 errors.
+        upstream_url (str): The base URL of the upstream API in record mode.
+        upstream_api_key (str): The API key of the upstream API in record mode.
+        seed (int): Seed of the injected delays and errors.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, mode="replay", store=None, chat_generator="lorem", fixed_response="", embedding_dim=1536,
+                 latency=0.0, latency_jitter=0.0, tokens_per_second=None, error_rate=0.0, rate_limiter=None,
+                 upstream_url="https://api.openai.com/v1", upstream_api_key=None, seed=0):
+        super().__init__(address, StandInHandler)
+        self.mode = mode
+        self.store = store or RecordingStore()
+        self.chat_generator = chat_generator
+        self.fixed_response = fixed_response
+        self.embedding_dim = embedding_dim
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.upstream_url = upstream_url.rstrip("/")
+        self.upstream_api_key = upstream_api_key
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def random(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    def forward(self, endpoint, body):
+        """Send a request to the upstream API and return its JSON response."""
+        request = urllib.request.Request(self.upstream_url + "/" + endpoint, data=json.dumps(body).encode("utf-8"),
+                                         headers={"Content-Type": "application/json",
+                                                  "Authorization": f"Bearer {self.upstream_api_key}"})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def generate(self, endpoint, body, key):
+        """Produce a response in the OpenAI format with the deterministic generators."""
+        model = body.get("model", "stand-in")
+        if endpoint == "embeddings":
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            dimensions = body.get("dimensions") or self.embedding_dim
+            prompt_tokens = sum(count_tokens(x) for x in inputs)
+            return {"object": "list", "model": model,
+                    "data": [{"object": "embedding", "index": i, "embedding": generate_embedding(x, dimensions)} for i, x in enumerate(inputs)],
+                    "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}}
+
+        content = generate_chat_text(body, self.chat_generator, key, self.fixed_response)
+        prompt_tokens = sum(count_tokens(message_text(x)) for x in body.get("messages", []))
+        completion_tokens = count_tokens(content)
+        return {"id": "chatcmpl-" + key[:24], "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens}}
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Handles the chat-completions and embeddings requests of a `StandInServer`."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, error_type, headers=None, param=None):
+        self.send_json(status, {"error": {"message": message, "type": error_type, "param": param, "code": None}}, headers)
+
+    def acquire_rate_limit(self, tokens):
+        """Account for a request in the rate limits, or answer it with a 429 error and return False."""
+        retry_after = self.server.rate_limiter.acquire(tokens)
+        if retry_after > 0:
+            self.send_error_json(429, "Rate limit reached for requests or tokens per minute.", "rate_limit_error",
+                                 {"Retry-After": str(math.ceil(retry_after))})
+            return False
+        return True
+
+    def do_POST(self):
+        endpoint = self.path.split("?")[0].strip("/")
+        if endpoint.startswith("v1/"):
+            endpoint = endpoint[len("v1/"):]
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if endpoint not in ("chat/completions", "embeddings"):
+            self.send_error_json(404, f"Unknown endpoint: {self.path}", "invalid_request_error")
+            return
+        try:
+            body = json.loads(data or b"{}")
+        except ValueError as e:
+            self.send_error_json(400, f"We could not parse the JSON body of your request. ({e})", "invalid_request_error")
+            return
+        if not isinstance(body, dict):
+            self.send_error_json(400, "The body of your request must be a JSON object.", "invalid_request_error")
+            return
+        required = "input" if endpoint == "embeddings" else "messages"
+        if required not in body:
+            self.send_error_json(400, f"Missing required parameter: '{required}'.", "invalid_request_error", param=required)
+            return
+
+        server = self.server
+        if server.error_rate and server.random() < server.error_rate:
+            self.send_error_json(429, "Rate limit reached (injected).", "rate_limit_error", {"Retry-After": "1"})
+            return
+
+        key = request_key(endpoint, body)
+        forwarded = False
+        response = server.store.get(key) if server.mode in ("replay", "strict_replay") else None
+        if response is None:
+            if server.mode == "strict_replay":
+                self.send_error_json(404, "No recorded response for this request.", "invalid_request_error")
+                return
+            if server.mode == "record":
+                # Requests forwarded upstream are limited before they are sent, so that the limits protect the upstream
+                # account; the completion is not known yet and is counted at its `max_tokens`.
+                if not self.acquire_rate_limit(estimate_request_tokens(endpoint, body)):
+                    return
+                try:
+                    response = server.forward(endpoint, body)
+                except urllib.error.HTTPError as e:
+                    data = e.read()
+                    try:
+                        self.send_json(e.code, json.loads(data or b"{}"))
+                    except ValueError:
+                        self.send_error_json(e.code, data.decode("utf-8", errors="replace") or str(e.reason), "api_error")
+                    return
+                except (urllib.error.URLError, OSError, ValueError) as e:
+                    # The upstream API is unreachable, timed out or answered with a body which is not JSON.
+                    self.send_error_json(502, f"The upstream API could not be reached: {e}", "api_error")
+                    return
+                server.store.add(key, endpoint, body, response)
+                forwarded = True
+            else:
+                response = server.generate(endpoint, body, key)
+
+        usage = response.get("usage") or {}
+        if not forwarded and not self.acquire_rate_limit(usage.get("total_tokens", 0)):
+            return
+
+        delay = server.latency + server.latency_jitter * server.random()
+        if server.tokens_per_second:
+            delay += usage.get("completion_tokens", 0) / server.tokens_per_second
+        if delay > 0:
+            time.sleep(delay)
+        self.send_json(200, response)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the OpenAI chat-completions and embeddings API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--mode", default="replay", choices=["replay", "strict_replay", "record", "generate"], help="How responses are produced")
+    parser.add_argument("--recordings", default=None, help="JSONL file of recorded responses (read in replay modes, appended to in record mode)")
+    parser.add_argument("--chat_generator", default="lorem", choices=["lorem", "echo", "fixed"], help="Generator for chat completions which were not recorded")
+    parser.add_argument("--fixed_response", default="", help="Response of the 'fixed' chat generator")
+    parser.add_argument("--embedding_dim", type=int, default=1536, help="Dimension of the generated embeddings")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fixed delay in seconds added to every response")
+    parser.add_argument("--latency_jitter", type=float, default=0.0, help="Maximum random delay in seconds added to every response")
+    parser.add_argument("--tokens_per_second", type=float, default=None, help="Completion speed used to delay each response")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Probability of answering with a 429 error")
+    parser.add_argument("--requests_per_minute", type=int, default=None, help="Requests-per-minute limit (429 errors above it)")
+    parser.add_argument("--tokens_per_minute", type=int, default=None, help="Tokens-per-minute limit (429 errors above it)")
+    parser.add_argument("--upstream_url", default="https://api.openai.com/v1", help="Upstream API in record mode")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the injected delays and errors")
+    args = parser.parse_args()
+
+    server = StandInServer((args.host, args.port), mode=args.mode, store=RecordingStore(args.recordings),
+                           chat_generator=args.chat_generator, fixed_response=args.fixed_response,
+                           embedding_dim=args.embedding_dim, latency=args.latency, latency_jitter=args.latency_jitter,
+                           tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+                           rate_limiter=RateLimiter(args.requests_per_minute, args.tokens_per_minute),
+                           upstream_url=args.upstream_url, upstream_api_key=os.getenv("OPENAI_API_KEY"), seed=args.seed)
+    print(f"Serving on http://{args.host}:{args.port}/v1 (mode: {args.mode})")
+    server.serve_forever()
@@ -0,0 +1,133 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from server import RateLimiter, RecordingStore, StandInServer
+
+CHAT_REQUEST = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "What is the ICD-10 code of asthma?"}], "max_tokens": 20}
+
+def start(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(server):
+        servers.append(server)
+        return start(server)
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def post(url, body):
+    data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read()), response.headers
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read()), e.headers
+
+class TextErrorHandler(BaseHTTPRequestHandler):
+    """Upstream answering every request with a plain-text 500 error."""
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        data = b"upstream exploded"
+        self.send_response(500)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def test_generate_mode_answers_chat_and_embeddings(serve):
+    url = serve(StandInServer(("127.0.0.1", 0), mode="generate", embedding_dim=8))
+
+    status, response, _ = post(url + "/chat/completions", CHAT_REQUEST)
+    assert status == 200
+    assert response["choices"][0]["message"]["content"]
+    assert response["usage"]["total_tokens"] == response["usage"]["prompt_tokens"] + response["usage"]["completion_tokens"]
+    # The generators are deterministic.
+    assert post(url + "/chat/completions", CHAT_REQUEST)[1]["choices"] == response["choices"]
+
+    status, response, _ = post(url + "/embeddings", {"model": "text-embedding-3-small", "input": ["a", "b"]})
+    assert status == 200
+    assert [len(x["embedding"]) for x in response["data"]] == [8, 8]
+
+def test_invalid_requests_get_openai_errors(serve):
+    url = serve(StandInServer(("127.0.0.1", 0), mode="generate"))
+
+    status, response, _ = post(url + "/chat/completions", b"{not json")
+    assert status == 400 and response["error"]["type"] == "invalid_request_error"
+    status, response, _ = post(url + "/embeddings", {"model": "text-embedding-3-small"})
+    assert status == 400 and response["error"]["param"] == "input"
+    status, response, _ = post(url + "/completions", CHAT_REQUEST)
+    assert status == 404
+
+def test_record_then_replay(serve, tmp_path):
+    upstream_url = serve(StandInServer(("127.0.0.1", 0), mode="generate", chat_generator="echo"))
+    recordings = str(tmp_path / "recordings.jsonl")
+    url = serve(StandInServer(("127.0.0.1", 0), mode="record", store=RecordingStore(recordings), upstream_url=upstream_url))
+
+    status, recorded, _ = post(url + "/chat/completions", CHAT_REQUEST)
+    assert status == 200
+    assert recorded["choices"][0]["message"]["content"] == CHAT_REQUEST["messages"][0]["content"]
+
+    replay_url = serve(StandInServer(("127.0.0.1", 0), mode="strict_replay", store=RecordingStore(recordings)))
+    assert post(replay_url + "/chat/completions", CHAT_REQUEST)[:2] == (200, recorded)
+    status, response, _ = post(replay_url + "/chat/completions", dict(CHAT_REQUEST, max_tokens=5))
+    assert status == 404
+
+    # The non-strict replay falls back to the generators.
+    fallback_url = serve(StandInServer(("127.0.0.1", 0), mode="replay", store=RecordingStore(recordings), chat_generator="fixed",
+                                       fixed_response="fallback"))
+    assert post(fallback_url + "/chat/completions", CHAT_REQUEST)[1] == recorded
+    assert post(fallback_url + "/chat/completions", dict(CHAT_REQUEST, max_tokens=5))[1]["choices"][0]["message"]["content"] == "fallback"
+
+def test_record_mode_reports_upstream_failures(serve):
+    unreachable = ThreadingHTTPServer(("127.0.0.1", 0), TextErrorHandler)
+    closed_port = unreachable.server_address[1]
+    unreachable.server_close()
+    url = serve(StandInServer(("127.0.0.1", 0), mode="record", upstream_url=f"http://127.0.0.1:{closed_port}/v1"))
+    status, response, _ = post(url + "/chat/completions", CHAT_REQUEST)
+    assert status == 502 and response["error"]["type"] == "api_error"
+
+    text_upstream = ThreadingHTTPServer(("127.0.0.1", 0), TextErrorHandler)
+    url = serve(StandInServer(("127.0.0.1", 0), mode="record", upstream_url=start(text_upstream)))
+    status, response, _ = post(url + "/chat/completions", CHAT_REQUEST)
+    text_upstream.shutdown()
+    text_upstream.server_close()
+    assert status == 500 and response["error"]["message"] == "upstream exploded"
+
+def test_record_mode_rate_limits_before_forwarding(serve):
+    forwarded = []
+
+    class CountingServer(StandInServer):
+        def forward(self, endpoint, body):
+            forwarded.append(body)
+            return self.generate(endpoint, body, "0" * 64)
+
+    url = serve(CountingServer(("127.0.0.1", 0), mode="record", rate_limiter=RateLimiter(requests_per_minute=1)))
+
+    assert post(url + "/chat/completions", CHAT_REQUEST)[0] == 200
+    status, response, headers = post(url + "/chat/completions", dict(CHAT_REQUEST, max_tokens=5))
+    assert status == 429 and response["error"]["type"] == "rate_limit_error"
+    assert int(headers["Retry-After"]) > 0
+    assert len(forwarded) == 1
+
+def test_injected_errors(serve):
+    url = serve(StandInServer(("127.0.0.1", 0), mode="generate", error_rate=1.0))
+
+    status, response, headers = post(url + "/chat/completions", CHAT_REQUEST)
+    assert status == 429 and headers["Retry-After"] == "1"
@@ -144,13 +144,14 @@ def main():
     parser.add_argument("--max-tokens", type=int, default=3000, help="Max tokens for OpenAI response. Default: 3000")
     parser.add_argument("--temperature", type=float, default=0.0, help="Temperature for generation. Default: 0.0")
     parser.add_argument("--max-workers", type=int, default=5, help="Max parallel threads. Default: 5")
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL"), help="Base URL of an OpenAI-compatible API. Default: the OpenAI API")
     args = parser.parse_args()
 
     api_key = os.getenv("OPENAI_API_KEY") or args.api_key
     if not api_key:
         raise ValueError("OpenAI API key is required. Provide it via the OPENAI_API_KEY environment variable.")
 
-    client = OpenAI(api_key=api_key)
+    client = OpenAI(api_key=api_key, base_url=args.base_url)
 
     input_root = Path(args.input_dir)
     output_root = Path(args.output_dir)